@@ -701,9 +701,11 @@ def do_setup(args):
 def handle_search_commands(args):
     '''provide search related utility'''
     if args.update:
-        update_search_index()
+        update_search_index(args.shard)
     elif args.clear:
         delete_search_index()
+    elif args.status:
+        show_search_index_status(args.shards)
 
 def get_seafes_env():
     env = env_mgr.get_seahub_env()
@@ -713,13 +715,15 @@ def get_seafes_env():
 
     return env
 
-def update_search_index():
+def update_search_index(shard=None):
     argv = [
         Utils.get_python_executable(),
         '-m', 'seafes.index_local',
         '--loglevel', 'debug',
         'update',
     ]
+    if shard:
+        argv += ['--shard', shard]
 
     Utils.info('\nUpdating search index, this may take a while...\n')
 
@@ -745,6 +749,16 @@ def delete_search_index():
 
     Utils.run_argv(argv, env=get_seafes_env())
 
+def show_search_index_status(shards):
+    argv = [
+        Utils.get_python_executable(),
+        '-m', 'seafes.index_local',
+        'status',
+        '--shards', str(shards),
+    ]
+
+    Utils.run_argv(argv, env=get_seafes_env())
+
 def handle_ldap_sync_commands(args):
     if args.test:
         argv = [
@@ -799,6 +813,9 @@ def main():
     parser_search = subparsers.add_parser('search', help='search related utility commands')
     parser_search.add_argument('--update', help='update seafile search index', action='store_true')
     parser_search.add_argument('--clear', help='delete seafile search index', action='store_true')
+    parser_search.add_argument('--status', help='show search index progress per shard', action='store_true')
+    parser_search.add_argument('--shard', help='with --update, only update shard i of N, given as i/N')
+    parser_search.add_argument('--shards', help='with --status, number of shards', type=int, default=1)
     parser_search.set_defaults(func=handle_search_commands)
 
     # ldapsync
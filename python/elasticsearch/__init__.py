@@ -17,7 +17,7 @@ if (2, 7) <= sys.version_info < (3, 2):
 from .client import Elasticsearch
 from .transport import Transport
 from .connection_pool import ConnectionPool, ConnectionSelector, \
-    RoundRobinSelector
+    RoundRobinSelector, LatencySelector
 from .serializer import JSONSerializer
 from .connection import Connection, RequestsHttpConnection, \
     Urllib3HttpConnection
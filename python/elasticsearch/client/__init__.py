@@ -192,6 +192,12 @@ class Elasticsearch(object):
             return super(Elasticsearch, self).__repr__()
 
     def _bulk_body(self, body):
+        # already serialized, e.g. by helpers._chunk_actions
+        if isinstance(body, (bytes, bytearray)):
+            if not body.endswith(b'\n'):
+                body += b'\n'
+            return body
+
         # if not passed in a string, serialize items and join by newline
         if not isinstance(body, string_types):
             body = '\n'.join(map(self.transport.serializer.dumps, body))
@@ -1,4 +1,5 @@
 import time
+import gzip
 import urllib3
 from urllib3.exceptions import ReadTimeoutError, SSLError as UrllibSSLError
 import warnings
@@ -43,14 +44,18 @@ class Urllib3HttpConnection(Connection):
         host. See https://urllib3.readthedocs.io/en/1.4/pools.html#api for more
         information.
     :arg headers: any custom http headers to be add to requests
+    :arg http_compress: gzip the request bodies and accept gzip compressed
+        responses (default: False)
     """
     def __init__(self, host='localhost', port=9200, http_auth=None,
             use_ssl=False, verify_certs=True, ca_certs=None, client_cert=None,
             client_key=None, ssl_version=None, ssl_assert_hostname=None,
-            ssl_assert_fingerprint=None, maxsize=10, headers=None, **kwargs):
+            ssl_assert_fingerprint=None, maxsize=10, headers=None,
+            http_compress=False, **kwargs):
 
         super(Urllib3HttpConnection, self).__init__(host=host, port=port, use_ssl=use_ssl, **kwargs)
-        self.headers = urllib3.make_headers(keep_alive=True)
+        self.http_compress = http_compress
+        self.headers = urllib3.make_headers(keep_alive=True, accept_encoding=http_compress)
         if http_auth is not None:
             if isinstance(http_auth, (tuple, list)):
                 http_auth = ':'.join(http_auth)
@@ -97,6 +102,13 @@ class Urllib3HttpConnection(Connection):
             url = '%s?%s' % (url, urlencode(params))
         full_url = self.host + url
 
+        headers = self.headers
+        orig_body = body
+        if self.http_compress and body:
+            body = gzip.compress(body)
+            headers = dict(headers)
+            headers['content-encoding'] = 'gzip'
+
         start = time.time()
         try:
             kw = {}
@@ -111,11 +123,11 @@ class Urllib3HttpConnection(Connection):
             if not isinstance(method, str):
                 method = method.encode('utf-8')
 
-            response = self.pool.urlopen(method, url, body, retries=False, headers=self.headers, **kw)
+            response = self.pool.urlopen(method, url, body, retries=False, headers=headers, **kw)
             duration = time.time() - start
             raw_data = response.data.decode('utf-8')
         except Exception as e:
-            self.log_request_fail(method, full_url, url, body, time.time() - start, exception=e)
+            self.log_request_fail(method, full_url, url, orig_body, time.time() - start, exception=e)
             if isinstance(e, UrllibSSLError):
                 raise SSLError('N/A', str(e), e)
             if isinstance(e, ReadTimeoutError):
@@ -124,10 +136,10 @@ class Urllib3HttpConnection(Connection):
 
         # raise errors based on http status codes, let the client handle those if needed
         if not (200 <= response.status < 300) and response.status not in ignore:
-            self.log_request_fail(method, full_url, url, body, duration, response.status, raw_data)
+            self.log_request_fail(method, full_url, url, orig_body, duration, response.status, raw_data)
             self._raise_error(response.status, raw_data)
 
-        self.log_request_success(method, full_url, url, body, response.status,
+        self.log_request_success(method, full_url, url, orig_body, response.status,
             raw_data, duration)
 
         return response.status, response.getheaders(), raw_data
@@ -1,4 +1,5 @@
 import time
+import math
 import random
 import logging
 import threading
@@ -44,6 +45,21 @@ class ConnectionSelector(object):
         """
         pass
 
+    def on_request_start(self, connection):
+        """
+        Called by the `Transport` before a request is sent to `connection`.
+        """
+        pass
+
+    def on_request_end(self, connection, duration, failed=False):
+        """
+        Called by the `Transport` when a request to `connection` is over.
+
+        :arg duration: seconds the request took
+        :arg failed: whether the node could not be reached or timed out
+        """
+        pass
+
 
 class RandomSelector(ConnectionSelector):
     """
@@ -66,6 +82,105 @@ class RoundRobinSelector(ConnectionSelector):
         self.data.rr %= len(connections)
         return connections[self.data.rr]
 
+class LatencySelector(ConnectionSelector):
+    """
+    Latency-aware selector using the "power of two choices": pick two live
+    connections at random, and use the one with the lower cost, which is
+    the peak EWMA of its response time multiplied by its number of requests in
+    flight (plus one).
+
+    The EWMA decays with time, so a node that was slow (e.g. during a GC
+    pause) and stopped getting requests is tried again after a while. A
+    request that fails to reach the node counts as `failure_penalty`
+    seconds. A node without any response yet is assumed to be as fast as
+    the median node, so that a new node doesn't get all the requests until
+    its first one returns. Use `get_stats` to inspect the numbers.
+
+    Stats are only kept for the connections of the pool: a request that
+    ends after sniffing replaced the pool is ignored.
+    """
+    def __init__(self, opts, decay_time=10.0, failure_penalty=5.0):
+        """
+        :arg decay_time: seconds after which the weight of a response time
+            drops to 1/e
+        :arg failure_penalty: latency in seconds recorded for a failure
+        """
+        super(LatencySelector, self).__init__(opts)
+        self.decay_time = decay_time
+        self.failure_penalty = failure_penalty
+        self._lock = threading.Lock()
+        # connection -> [ewma, time of last update, in flight, requests, failures]
+        self._stats = {}
+
+    def _get(self, connection):
+        if connection not in self.connection_opts:
+            return None
+        stats = self._stats.get(connection)
+        if stats is None:
+            stats = self._stats[connection] = [0.0, time.time(), 0, 0, 0]
+        return stats
+
+    def _ewma(self, stats, now):
+        return stats[0] * math.exp(-max(now - stats[1], 0) / self.decay_time)
+
+    def _median_ewma(self, now):
+        values = sorted(self._ewma(stats, now) for stats in self._stats.values() if stats[3])
+        return values[len(values) // 2] if values else 0.0
+
+    def _cost(self, connection, now):
+        stats = self._stats.get(connection)
+        if stats is None or not stats[3]:
+            # no response yet, assume it's as fast as the median node
+            in_flight = stats[2] if stats is not None else 0
+            return self._median_ewma(now) * (in_flight + 1)
+        return self._ewma(stats, now) * (stats[2] + 1)
+
+    def select(self, connections):
+        a, b = random.sample(connections, 2)
+        now = time.time()
+        with self._lock:
+            return a if self._cost(a, now) <= self._cost(b, now) else b
+
+    def on_request_start(self, connection):
+        with self._lock:
+            stats = self._get(connection)
+            if stats is not None:
+                stats[2] += 1
+
+    def on_request_end(self, connection, duration, failed=False):
+        if failed:
+            duration = max(duration, self.failure_penalty)
+        now = time.time()
+        with self._lock:
+            stats = self._get(connection)
+            if stats is None:
+                return
+            stats[2] = max(stats[2] - 1, 0)
+            stats[3] += 1
+            if failed:
+                stats[4] += 1
+            if duration > stats[0]:
+                # peak sensitive, a slow response is taken in at once
+                stats[0] = duration
+            else:
+                w = math.exp(-max(now - stats[1], 0) / self.decay_time)
+                stats[0] = stats[0] * w + duration * (1 - w)
+            stats[1] = now
+
+    def get_stats(self):
+        """
+        Return a dict of host -> `ewma` (seconds), `in_flight`, `requests`
+        and `failures`.
+        """
+        with self._lock:
+            return dict((c.host, {
+                'ewma': stats[0],
+                'in_flight': stats[2],
+                'requests': stats[3],
+                'failures': stats[4],
+            }) for c, stats in self._stats.items())
+
+
 class ConnectionPool(object):
     """
     Container holding the :class:`~elasticsearch.Connection` instances,
@@ -228,6 +343,12 @@ class ConnectionPool(object):
         # only one connection, no need for a selector
         return connections[0]
 
+    def request_started(self, connection):
+        self.selector.on_request_start(connection)
+
+    def request_finished(self, connection, duration, failed=False):
+        self.selector.on_request_end(connection, duration, failed)
+
     def close(self):
         """
         Explicitly closes connections
@@ -256,6 +377,6 @@ class DummyConnectionPool(ConnectionPool):
 
     def _noop(self, *args, **kwargs):
         pass
-    mark_dead = mark_live = resurrect = _noop
+    mark_dead = mark_live = resurrect = request_started = request_finished = _noop
 
 
@@ -48,42 +48,63 @@ def expand_action(data):
 
     return action, data.get('_source', data)
 
+def _get_bytes_dumps(serializer):
+    """
+    Return a function serializing data into utf-8 bytes with `serializer`,
+    using its `dumps_bytes` if it has one.
+    """
+    dumps_bytes = getattr(serializer, 'dumps_bytes', None)
+    if dumps_bytes is not None:
+        return dumps_bytes
+
+    def dumps(data):
+        data = serializer.dumps(data)
+        return data if isinstance(data, bytes) else data.encode('utf-8', 'surrogatepass')
+    return dumps
+
 def _chunk_actions(actions, chunk_size, max_chunk_bytes, serializer):
     """
-    Split actions into chunks by number or size, serialize them into strings in
-    the process.
+    Split actions into chunks by number or size, serialize them into bulk
+    request bodies (bytes) in the process.
+
+    Each action and document is serialized once, straight into a buffer that
+    is reused for all the chunks.
     """
-    bulk_actions, bulk_data = [], []
-    size, action_count = 0, 0
+    dumps = _get_bytes_dumps(serializer)
+    buf = bytearray()
+    bulk_data = []
+    action_count = 0
     for action, data in actions:
         raw_data, raw_action = data, action
-        action = serializer.dumps(action)
+        action = dumps(action)
         cur_size = len(action) + 1
 
         if data is not None:
-            data = serializer.dumps(data)
+            data = dumps(data)
             cur_size += len(data) + 1
 
         # full chunk, send it and start a new one
-        if bulk_actions and (size + cur_size > max_chunk_bytes or action_count == chunk_size):
-            yield bulk_data, bulk_actions
-            bulk_actions, bulk_data = [], []
-            size, action_count = 0, 0
-
-        bulk_actions.append(action)
+        if bulk_data and (len(buf) + cur_size > max_chunk_bytes or action_count == chunk_size):
+            yield bulk_data, bytes(buf)
+            del buf[:]
+            bulk_data = []
+            action_count = 0
+
+        buf += action
+        buf += b'\n'
         if data is not None:
-            bulk_actions.append(data)
+            buf += data
+            buf += b'\n'
             bulk_data.append((raw_action, raw_data))
         else:
             bulk_data.append((raw_action, ))
 
-        size += cur_size
         action_count += 1
 
-    if bulk_actions:
-        yield bulk_data, bulk_actions
+    if bulk_data:
+        yield bulk_data, bytes(buf)
 
-def _process_bulk_chunk(client, bulk_actions, bulk_data, raise_on_exception=True, raise_on_error=True, **kwargs):
+def _process_bulk_chunk(client, bulk_body, bulk_data, raise_on_exception=True, raise_on_error=True, **kwargs):
     """
     Send a bulk request to elasticsearch and process the output.
     """
@@ -92,7 +113,7 @@ def _process_bulk_chunk(client, bulk_actions, bulk_data, raise_on_exception=True
 
     try:
         # send the actual request
-        resp = client.bulk('\n'.join(bulk_actions) + '\n', **kwargs)
+        resp = client.bulk(bulk_body, **kwargs)
     except TransportError as e:
         # default behavior - just propagate exception
         if raise_on_exception:
@@ -174,10 +195,11 @@ def streaming_bulk(client, actions, chunk_size=500, max_chunk_bytes=100 * 1024 *
     :arg yield_ok: if set to False will skip successful documents in the output
     """
     actions = map(expand_action_callback, actions)
+    dumps = _get_bytes_dumps(client.transport.serializer)
 
-    for bulk_data, bulk_actions in _chunk_actions(actions, chunk_size,
-                                                  max_chunk_bytes,
-                                                  client.transport.serializer):
+    for bulk_data, bulk_body in _chunk_actions(actions, chunk_size,
+                                               max_chunk_bytes,
+                                               client.transport.serializer):
 
         for attempt in range(max_retries + 1):
             to_retry, to_retry_data = [], []
@@ -187,7 +209,7 @@ def streaming_bulk(client, actions, chunk_size=500, max_chunk_bytes=100 * 1024 *
             try:
                 for data, (ok, info) in zip(
                             bulk_data,
-                            _process_bulk_chunk(client, bulk_actions, bulk_data,
+                            _process_bulk_chunk(client, bulk_body, bulk_data,
                                                 raise_on_exception,
                                                 raise_on_error, **kwargs)
                         ):
@@ -199,9 +221,9 @@ def streaming_bulk(client, actions, chunk_size=500, max_chunk_bytes=100 * 1024 *
                         if max_retries \
                                 and info['status'] == 429 \
                                 and (attempt+1) <= max_retries:
-                            # _process_bulk_chunk expects strings so we need to
-                            # re-serialize the data
-                            to_retry.extend(map(client.transport.serializer.dumps, data))
+                            # _process_bulk_chunk expects a serialized body so
+                            # we need to re-serialize the data
+                            to_retry.extend(map(dumps, data))
                             to_retry_data.append(data)
                         else:
                             yield ok, {action: info}
@@ -216,7 +238,8 @@ def streaming_bulk(client, actions, chunk_size=500, max_chunk_bytes=100 * 1024 *
                 if not to_retry:
                     break
                 # retry only subset of documents that didn't succeed
-                bulk_actions, bulk_data = to_retry, to_retry_data
+                bulk_body = b'\n'.join(to_retry) + b'\n'
+                bulk_data = to_retry_data
 
 
 def bulk(client, actions, stats_only=False, **kwargs):
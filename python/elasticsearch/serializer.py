@@ -2,6 +2,11 @@ try:
     import simplejson as json
 except ImportError:
     import json
+# optional faster encoder, used to serialize bulk bodies straight to bytes
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import uuid
 from datetime import date, datetime
 from decimal import Decimal
@@ -49,6 +54,24 @@ class JSONSerializer(object):
         except (ValueError, TypeError) as e:
             raise SerializationError(data, e)
 
+    def dumps_bytes(self, data):
+        """
+        Serialize `data` into utf-8 encoded bytes, with `orjson` when it is
+        installed. Data it can't encode (e.g. lone surrogates, integers beyond
+        64 bits) falls back to `dumps`.
+        """
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, string_types):
+            return data.encode('utf-8', 'surrogatepass')
+
+        if orjson is not None:
+            try:
+                return orjson.dumps(data, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                pass
+        return self.dumps(data).encode('utf-8', 'surrogatepass')
+
 DEFAULT_SERIALIZERS = {
     JSONSerializer.mimetype: JSONSerializer(),
     TextSerializer.mimetype: TextSerializer(),
@@ -308,10 +308,14 @@ class Transport(object):
         for attempt in range(self.max_retries + 1):
             connection = self.get_connection()
 
+            self.connection_pool.request_started(connection)
+            start = time.time()
             try:
                 status, headers, data = connection.perform_request(method, url, params, body, ignore=ignore, timeout=timeout)
 
             except TransportError as e:
+                self.connection_pool.request_finished(connection, time.time() - start,
+                                                      failed=isinstance(e, ConnectionError))
                 if method == 'HEAD' and e.status_code == 404:
                     return False
 
@@ -333,6 +337,7 @@ class Transport(object):
                     raise
 
             else:
+                self.connection_pool.request_finished(connection, time.time() - start)
                 if method == 'HEAD':
                     return 200 <= status < 300
 
@@ -3,7 +3,51 @@
 from .indexes import RepoFilesIndex
 from .connection import es_get_conn
 
-def es_search(repos_map, search_path, keyword, obj_desc, start, size):
+def es_search(repos_map, search_path, keyword, obj_desc, start, size, username=None):
     conn = es_get_conn()
     files_index = RepoFilesIndex(conn)
-    return files_index.search_files(repos_map, search_path, keyword, obj_desc, start, size)
+    return files_index.search_files(repos_map, search_path, keyword, obj_desc, start, size,
+                                    username=username)
+
+def es_search_by_cursor(repos_map, search_path, keyword, obj_desc, cursor, size, username=None):
+    conn = es_get_conn()
+    files_index = RepoFilesIndex(conn)
+    return files_index.search_files_by_cursor(repos_map, search_path, keyword, obj_desc, cursor, size,
+                                              username=username)
+
+def es_search_with_facets(repos_map, search_path, keyword, obj_desc, start, size, facets=None,
+                          username=None):
+    conn = es_get_conn()
+    files_index = RepoFilesIndex(conn)
+    if facets is None:
+        facets = RepoFilesIndex.FACETS
+    return files_index.search_files_with_facets(repos_map, search_path, keyword, obj_desc, start, size,
+                                                username=username, facets=facets)
+
+def es_search_multi(scopes, keyword, obj_desc=None, start=0, size=10, username=None):
+    conn = es_get_conn()
+    files_index = RepoFilesIndex(conn)
+    return files_index.search_files_multi(scopes, keyword, obj_desc, start, size, username=username)
+
+def es_suggest_filenames(repos_map, prefix, search_path=None, size=10):
+    conn = es_get_conn()
+    files_index = RepoFilesIndex(conn)
+    return files_index.suggest_filenames(repos_map, prefix, search_path, size)
+
+def es_render_metrics():
+    """Return the metrics of this process in the prometheus text format.
+
+    The search latency histograms and the search cache counters are
+    recorded in the process running the searches, which doesn't serve
+    ``/metrics`` itself: its web frontend (seahub) should return this from
+    an endpoint of its own.
+    """
+    from .metrics import render_metrics
+    return render_metrics()
+
+def es_check_results(results):
+    """Return a list of booleans, telling for each search result whether it
+    still matches the current state of its repo.
+    """
+    from .freshness import FreshnessChecker
+    return FreshnessChecker(es_get_conn()).check(results)
@@ -0,0 +1,159 @@
+# coding: UTF-8
+
+import time
+import random
+import logging
+import threading
+
+from .config import seafes_config
+
+logger = logging.getLogger('seafes')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# outcomes passed to ``CircuitBreaker.release``
+SUCCESS = 'success'
+FAILURE = 'failure'
+
+
+class CircuitBreaker(object):
+    '''Shared by the worker threads of a process to stop hammering
+    elasticsearch while it is down.
+
+    (1) closed: tasks run freely. ``failure_threshold`` consecutive transport
+        failures open the circuit.
+    (2) open: no thread takes a new task. A single probe thread checks
+        elasticsearch with exponential backoff (plus jitter), until a probe
+        succeeds.
+    (3) half-open: only ``limit`` tasks may run at once. The limit starts at 1
+        and doubles with each successful task, the circuit closes once it
+        reaches ``max_concurrency``. A failure opens it again.
+
+    Workers wait with ``wait_allowed`` before taking a task, call ``acquire``
+    once they have one, and ``release`` with the outcome when it's done.
+    '''
+
+    def __init__(self, probe, max_concurrency, failure_threshold=5,
+                 initial_backoff=1.0, max_backoff=60.0):
+        self.probe = probe
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.state = CLOSED
+        self._cond = threading.Condition()
+        self._failures = 0
+        self._limit = 1
+        self._in_flight = 0
+        self._probing = False
+
+    def acquire(self, timeout=None):
+        """Wait until a task may run. Return False if it's still not allowed
+        after ``timeout`` seconds, so the caller can check whether to stop.
+        """
+        with self._cond:
+            if not self._wait(timeout):
+                return False
+            self._in_flight += 1
+            return True
+
+    def wait_allowed(self, timeout=None):
+        """Wait until a task would be allowed to run, without acquiring it.
+        Return False if it's still not allowed after ``timeout`` seconds.
+        """
+        with self._cond:
+            return self._wait(timeout)
+
+    def _wait(self, timeout):
+        # called with ``_cond`` held
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            if self.state == CLOSED or \
+               (self.state == HALF_OPEN and self._in_flight < self._limit):
+                return True
+            remaining = deadline - time.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return False
+            self._cond.wait(remaining)
+
+    def release(self, outcome=None):
+        """Report the end of a task acquired with ``acquire``. ``outcome`` is
+        SUCCESS if elasticsearch answered, FAILURE on a transport failure
+        (unreachable or timed out), or None if the task didn't reach it.
+        """
+        with self._cond:
+            self._in_flight = max(self._in_flight - 1, 0)
+            if outcome == FAILURE:
+                self._failures += 1
+                if self.state == HALF_OPEN or \
+                   (self.state == CLOSED and self._failures >= self.failure_threshold):
+                    self._open()
+            elif outcome == SUCCESS:
+                self._failures = 0
+                if self.state == HALF_OPEN:
+                    self._limit *= 2
+                    if self._limit >= self.max_concurrency:
+                        logger.warning('elasticsearch is back, circuit closed')
+                        self.state = CLOSED
+                    else:
+                        logger.info('circuit half open, %d tasks allowed', self._limit)
+            self._cond.notify_all()
+
+    def _open(self):
+        logger.warning('elasticsearch not available after %d failures, circuit open',
+                       self._failures)
+        self.state = OPEN
+        # called with ``_cond`` held. The prober clears ``_probing`` when it
+        # leaves the open state, under the same lock, so exactly one prober
+        # runs while the circuit is open.
+        if not self._probing:
+            self._probing = True
+            prober = threading.Thread(target=self._probe_loop, name='es_circuit_probe')
+            prober.daemon = True
+            prober.start()
+
+    def _probe_loop(self):
+        backoff = self.initial_backoff
+        while True:
+            time.sleep(backoff * random.uniform(0.5, 1.0))
+            try:
+                alive = self.probe()
+            except Exception as e:
+                logger.debug('elasticsearch probe failed: %s', e)
+                alive = False
+            if alive:
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+            logger.info('elasticsearch still not available, next probe in %.1fs', backoff)
+
+        with self._cond:
+            logger.warning('elasticsearch reachable again, circuit half open')
+            self.state = HALF_OPEN
+            self._limit = 1
+            self._failures = 0
+            self._probing = False
+            self._cond.notify_all()
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+def get_circuit_breaker(max_concurrency):
+    """Return the circuit breaker shared by the whole process, probing
+    elasticsearch with a ping through the shared client.
+    """
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            from .connection import es_get_conn
+
+            def probe():
+                return es_get_conn().ping(request_timeout=5)
+
+            _breaker = CircuitBreaker(probe, max_concurrency,
+                                      failure_threshold=seafes_config.es_breaker_failures,
+                                      max_backoff=seafes_config.es_breaker_max_backoff)
+        return _breaker
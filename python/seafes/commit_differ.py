@@ -1,6 +1,7 @@
 # coding: UTF-8
 
 from .constants import ZERO_OBJ_ID
+from .metrics import index_stage_seconds
 
 from seafobj import fs_mgr
 
@@ -43,8 +44,8 @@ class CommitDiffer(object):
             except IndexError:
                 break
 
-            dir1 = fs_mgr.load_seafdir(self.repo_id, self.version, old_id)
-            dir2 = fs_mgr.load_seafdir(self.repo_id, self.version, new_id)
+            dir1 = self.load_dir(old_id)
+            dir2 = self.load_dir(new_id)
 
             for dent in dir1.get_files_list():
                 new_dent = dir2.lookup_dent(dent.name)
@@ -81,7 +82,7 @@ class CommitDiffer(object):
                 added_dirs.append((path, obj_id, mtime, size))
             except IndexError:
                 break
-            d = fs_mgr.load_seafdir(self.repo_id, self.version, obj_id)
+            d = self.load_dir(obj_id)
             added_files.extend([(make_path(path, dent.name), dent.id, dent.mtime, dent.size) for dent in d.get_files_list()])
 
             new_dirs.extend([(make_path(path, dent.name), dent.id, dent.mtime, dent.size) for dent in d.get_subdirs_list()])
@@ -89,6 +90,10 @@ class CommitDiffer(object):
         return (added_files, deleted_files, added_dirs, deleted_dirs,
                 modified_files)
 
+    def load_dir(self, obj_id):
+        with index_stage_seconds.time(stage='fetch_dir'):
+            return fs_mgr.load_seafdir(self.repo_id, self.version, obj_id)
+
 def search_entry(entries, entryname):
     for name, obj_id in entries:
         if name == entryname:
@@ -97,12 +97,46 @@ class SeafesConfig(object):
             'external_es_server': 'false',
             'es_host': '127.0.0.1',
             'es_port': '9200',
+            'es_hosts': '',
+            'es_sniff_on_start': 'false',
+            'es_sniff_on_connection_fail': 'false',
+            'es_sniffer_timeout': '0',
+            'es_maxsize': '50',
+            'es_timeout': '30',
+            'es_http_compress': 'false',
+            'es_selector': 'round_robin',
+            'es_breaker_failures': '5',
+            'es_breaker_max_backoff': '60',
             'debug': 'false',
             'lang': '',
             'office_file_size_limit': '10', # 10 MB
             'index_workers': '2',
             'content_extract_time': '5',
-            'highlight': 'plain'
+            'extract_max_attempts': '0', # 0 to disable the quarantine
+            'highlight': 'plain',
+            'acl_lookup': 'false',
+            'search_cache': '', # memory (entries only expire after the ttl) or redis
+            'search_cache_ttl': '300',
+            'search_cache_size': '1000',
+            'redis_host': '127.0.0.1',
+            'redis_port': '6379',
+            'redis_password': '',
+            'two_phase_search': 'false',
+            'highlight_fragment_size': '100',
+            'highlight_fragments': '3',
+            'slow_search_threshold': '1', # seconds, 0 to disable
+            'search_profile_log': '',
+            'search_profile_rate': '0.01', # fraction of the searches profiled
+            'metrics_port': '0', # 0 to disable
+            'metrics_addr': '127.0.0.1', # 0.0.0.0 to serve metrics to other hosts
+            'dedup_content': 'false',
+            'dedup_max_content_hits': '500',
+            'dedup_max_scope_objects': '10000',
+            'status_flush_interval': '0', # seconds, 0 to write repo status at once
+            'merge_window': '', # e.g. 01:00-05:00, empty to disable
+            'merge_deleted_ratio': '0.1',
+            'merge_max_segments': '0', # 0 to disable
+            'merge_max_cpu': '70',
         }
 
         cp = configparser.ConfigParser(defaults)
@@ -125,6 +159,11 @@ class SeafesConfig(object):
                 # http api.
                 port = 9200
 
+        hosts = ['{}:{}'.format(host, port)]
+        if external_es_server and cp.get(section_name, 'es_hosts'):
+            # e.g. es_hosts = 192.168.1.10:9200, 192.168.1.11:9200
+            hosts = [e.strip() for e in cp.get(section_name, 'es_hosts').split(',') if e.strip()]
+
         lang = cp.get(section_name, 'lang').lower()
 
         if lang:
@@ -148,12 +187,71 @@ class SeafesConfig(object):
         self.index_office_pdf = index_office_pdf
         self.host = host
         self.port = port
+        self.hosts = hosts
+        self.es_sniff_on_start = cp.getboolean(section_name, 'es_sniff_on_start')
+        self.es_sniff_on_connection_fail = cp.getboolean(section_name, 'es_sniff_on_connection_fail')
+        self.es_sniffer_timeout = cp.getint(section_name, 'es_sniffer_timeout')
+        self.es_maxsize = cp.getint(section_name, 'es_maxsize')
+        self.es_timeout = cp.getint(section_name, 'es_timeout')
+        self.es_http_compress = cp.getboolean(section_name, 'es_http_compress')
+
+        es_selector = cp.get(section_name, 'es_selector').lower()
+        if es_selector not in ('round_robin', 'random', 'latency'):
+            logger.warning('[seafes] invalid es selector ' + es_selector)
+            es_selector = 'round_robin'
+        self.es_selector = es_selector
+        # consecutive transport failures after which index workers pause
+        self.es_breaker_failures = cp.getint(section_name, 'es_breaker_failures')
+        self.es_breaker_max_backoff = cp.getint(section_name, 'es_breaker_max_backoff')
         self.office_file_size_limit = cp.getint(section_name, 'office_file_size_limit') * 1024 * 1024
 
         self.debug = cp.getboolean(section_name, 'debug')
         self.lang = lang
         self.index_workers = index_workers
         self.content_extract_time = content_extract_time
+        # files failing to be extracted this many times only get their name
+        # indexed, see ExtractQuarantineIndex.
+        self.extract_max_attempts = cp.getint(section_name, 'extract_max_attempts')
+        self.acl_lookup = cp.getboolean(section_name, 'acl_lookup')
+        # store extracted content once per file object, see RepoContentsIndex.
+        self.dedup_content = cp.getboolean(section_name, 'dedup_content')
+        # the number of best matching objects a search looks for in
+        # ``repocontents``, and the number of objects of a narrower search
+        # scope they are looked among, see RepoFilesIndex.build_search.
+        self.dedup_max_content_hits = cp.getint(section_name, 'dedup_max_content_hits')
+        self.dedup_max_scope_objects = cp.getint(section_name, 'dedup_max_scope_objects')
+        # buffer repo status changes of the index updaters, see RepoStatusIndex.
+        self.status_flush_interval = cp.getfloat(section_name, 'status_flush_interval')
+
+        search_cache = cp.get(section_name, 'search_cache').lower()
+        if search_cache not in ('', 'memory', 'redis'):
+            logger.warning('[seafes] invalid search cache ' + search_cache)
+            search_cache = ''
+        self.search_cache = search_cache
+        self.search_cache_ttl = cp.getint(section_name, 'search_cache_ttl')
+        self.search_cache_size = cp.getint(section_name, 'search_cache_size')
+        self.redis_host = cp.get(section_name, 'redis_host')
+        self.redis_port = cp.getint(section_name, 'redis_port')
+        self.redis_password = cp.get(section_name, 'redis_password') or None
+
+        self.two_phase_search = cp.getboolean(section_name, 'two_phase_search')
+        self.highlight_fragment_size = cp.getint(section_name, 'highlight_fragment_size')
+        self.highlight_fragments = cp.getint(section_name, 'highlight_fragments')
+        self.slow_search_threshold = cp.getfloat(section_name, 'slow_search_threshold')
+        # when set, a ``search_profile_rate`` sample of the searches run with
+        # ``profile`` and the profiles are written to this (rotating) file.
+        self.search_profile_log = cp.get(section_name, 'search_profile_log')
+        self.search_profile_rate = cp.getfloat(section_name, 'search_profile_rate')
+        # index_local and index_worker serve prometheus metrics on this address
+        self.metrics_port = cp.getint(section_name, 'metrics_port')
+        self.metrics_addr = cp.get(section_name, 'metrics_addr')
+        # index_master expunges deleted docs in this window, see
+        # seafes.segment_maintenance.
+        self.merge_window = cp.get(section_name, 'merge_window').strip()
+        self.merge_deleted_ratio = cp.getfloat(section_name, 'merge_deleted_ratio')
+        self.merge_max_segments = cp.getint(section_name, 'merge_max_segments')
+        self.merge_max_cpu = cp.getint(section_name, 'merge_max_cpu')
+
         self.highlight = 'plain'
 
         config_highlight = cp.get(section_name, 'highlight')
@@ -202,6 +300,13 @@ class SeafesConfig(object):
             logger.warning("index workers can't less than zero.")
             index_slave_workers = 2
         self.index_slave_workers = index_slave_workers 
+
+        # index the files of the repos with an IndexPipeline
+        self.index_pipeline = self.config_get_boolean(cp, 'DEFAULT', 'pipeline')
+        self.pipeline_fetch_workers = self.config_get_int(cp, 'DEFAULT', 'pipeline_fetch_workers') or 8
+        self.pipeline_extract_workers = self.config_get_int(cp, 'DEFAULT', 'pipeline_extract_workers') or 4
+        self.pipeline_write_workers = self.config_get_int(cp, 'DEFAULT', 'pipeline_write_workers') or 2
+        self.pipeline_bulk_size = self.config_get_int(cp, 'DEFAULT', 'pipeline_bulk_size') or 100
         self.subscribe_server = self.config_get_string(cp, self.subscribe_mq, 'server')
         self.subscribe_port = self.config_get_string(cp, self.subscribe_mq, 'port')
         self.subscribe_password = self.config_get_string(cp, self.subscribe_mq, 'password')
@@ -1,24 +1,62 @@
-import requests
+import os
+import logging
+import threading
+
 from elasticsearch import Elasticsearch
+from elasticsearch.connection_pool import RoundRobinSelector, RandomSelector, LatencySelector
 
 from seafes.config import seafes_config
 
+logger = logging.getLogger('seafes')
+
+SELECTORS = {
+    'round_robin': RoundRobinSelector,
+    'random': RandomSelector,
+    'latency': LatencySelector,
+}
+
+_es = None
+_es_pid = None
+_es_lock = threading.Lock()
+
+def es_create_conn():
+    """Create a new client from the [INDEX FILES] options in seafevents.conf.
+    Use ``es_get_conn`` unless a separate connection pool is really needed.
+    """
+    kw = {
+        'maxsize': seafes_config.es_maxsize,
+        'timeout': seafes_config.es_timeout,
+        'http_compress': seafes_config.es_http_compress,
+        'sniff_on_start': seafes_config.es_sniff_on_start,
+        'sniff_on_connection_fail': seafes_config.es_sniff_on_connection_fail,
+        'selector_class': SELECTORS[seafes_config.es_selector],
+    }
+    if seafes_config.es_sniffer_timeout > 0:
+        kw['sniffer_timeout'] = seafes_config.es_sniffer_timeout
+    return Elasticsearch(seafes_config.hosts, **kw)
+
 def es_get_conn():
-    es = Elasticsearch(['{}:{}'.format(seafes_config.host, seafes_config.port)], maxsize=50, timeout=30)
-    return es
+    """Return the elasticsearch client shared by the whole process.
+
+    The client is thread safe and keeps a pool of keep-alive connections to
+    each node, so it is created once and reused. A forked child creates its
+    own, the sockets of its parent can't be shared.
+    """
+    global _es, _es_pid
+    pid = os.getpid()
+    if _es is None or _es_pid != pid:
+        with _es_lock:
+            if _es is None or _es_pid != pid:
+                logger.debug('connecting to elasticsearch %s', seafes_config.hosts)
+                _es = es_create_conn()
+                _es_pid = pid
+    return _es
 
-def es_get_status():
-    """ return True if es server work normal, otherwise return false
+def es_get_connection_stats():
+    """Return the per node latency stats of the shared client, when it
+    uses the ``latency`` selector, otherwise None.
     """
-    protocol = ['http', 'https']
-    urls = []
-    for p in protocol:
-        urls.append(p + '://' + str(seafes_config.host) + ':' + str(seafes_config.port) + '/repofiles?pretty')
-    alive = False
-    try:
-        for url in urls:
-            if requests.get(url, timeout=10).status_code == 200:
-                alive = True
-    except:
-        pass
-    return alive
+    selector = getattr(es_get_conn().transport.connection_pool, 'selector', None)
+    if not isinstance(selector, LatencySelector):
+        return None
+    return selector.get_stats()
@@ -1,6 +1,7 @@
 # coding: UTF-8
 
 import os
+import time
 import tempfile
 import subprocess
 import logging
@@ -12,17 +13,41 @@ from io import BytesIO
 from .utils import run
 from .constants import text_suffixes, office_suffixes, ZERO_OBJ_ID
 from .config import seafes_config
+from .metrics import counter, histogram, index_stage_seconds
 
 from seafobj import fs_mgr
 
 logger = logging.getLogger('seafes')
 
+extract_seconds = histogram('seafes_extract_seconds',
+                            'Time spent extracting the text of files, by suffix.', ['suffix'],
+                            buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 600))
+extract_files = counter('seafes_extract_files_total',
+                        'Files whose text was to be extracted, by suffix and result.', ['suffix', 'result'])
+
+# exit code of the ``timeout`` command when it killed the extractor
+TIMEOUT_EXIT_CODE = 124
+
+
+class ExtractError(Exception):
+    def __init__(self, msg, reason='error'):
+        Exception.__init__(self, msg)
+        self.reason = reason
+
+def check_exit_code(name, code):
+    if code == TIMEOUT_EXIT_CODE:
+        raise ExtractError('%s timed out after %d minutes' % (name, seafes_config.content_extract_time),
+                           reason='timeout')
+    if code != 0:
+        raise ExtractError('%s exited with code %s' % (name, code))
+
 class ZipString(ZipFile):
     def __init__(self, content):
         ZipFile.__init__(self, BytesIO(content))
 
 def extract_html_text(content):
-    return re.sub('<(.|\n)*?>', ' ', content)
+    # the raw bytes of the file, decoded later by ``fix_encoding``
+    return re.sub(b'<(.|\n)*?>', b' ', content)
 
 def extract_poi_text(content):
     cwd = os.path.dirname(os.path.abspath(__file__))
@@ -39,7 +64,7 @@ def extract_poi_text(content):
 
         content += data
 
-    p.wait()
+    check_exit_code('poi', p.wait())
 
     return content
 
@@ -53,16 +78,11 @@ def extract_pdf_text(content):
             output.write(content)
 
         cmd = ['timeout', str(seafes_config.content_extract_time * 60), 'pdftotext', pdf_name, txt_name]
-        if run(cmd) != 0:
-            content = None
-        else:
-            with open(txt_name, 'rb') as fp:
-                content = fp.read()
+        check_exit_code('pdftotext', run(cmd))
+        with open(txt_name, 'rb') as fp:
+            content = fp.read()
 
         return content
-    except Exception as e:
-        logger.error('error when extracting pdf: %s', e)
-        return None
     finally:
         temp_pdf.close()
         temp_txt.close()
@@ -161,32 +181,76 @@ def is_text_office(filename):
     return is_text_file(filename) or is_office_pdf(filename)
 
 class Extractor(object):
-    def __init__(self, func, file_size_limit):
+    def __init__(self, func, file_size_limit, quarantine=None, suffix=None):
         self.func = func
+        self.suffix = suffix
         self.file_size_limit = file_size_limit
+        self.quarantine = quarantine
+        # set when the content could not be extracted this time, but may be
+        # next time: the extraction failed or the file is quarantined
+        self.failed = False
 
     def extract(self, repo_id, version, obj_id, path):
+        content = self.fetch(repo_id, version, obj_id, path)
+        if content is None:
+            return None
+        return self.extract_content(repo_id, obj_id, path, content)
+
+    def fetch(self, repo_id, version, obj_id, path):
+        """Return the raw content of the file, None if it should not or
+        can't be extracted.
+        """
         if obj_id == ZERO_OBJ_ID:
             return None
 
-        f = fs_mgr.load_seafile(repo_id, version, obj_id)
-        if self.file_size_limit < f.size:
-            logger.warning("file %s size exceeds limit", path)
+        if self.quarantine and self.quarantine.is_quarantined(obj_id):
+            logger.info('%s %s is quarantined, skip extracting its content', repo_id, path)
+            extract_files.inc(suffix=self.suffix, result='quarantined')
+            self.failed = True
             return None
-        content = f.get_content(limit=self.file_size_limit)
+
+        with index_stage_seconds.time(stage='fetch_file'):
+            f = fs_mgr.load_seafile(repo_id, version, obj_id)
+            if self.file_size_limit < f.size:
+                logger.warning("file %s size exceeds limit", path)
+                extract_files.inc(suffix=self.suffix, result='too_large')
+                return None
+            content = f.get_content(limit=self.file_size_limit)
         if not content:
             # An empty file
+            extract_files.inc(suffix=self.suffix, result='empty')
             return None
+        return content
+
+    def extract_content(self, repo_id, obj_id, path, content):
+        """Extract the text of the raw ``content`` returned by ``fetch``."""
+        start = time.time()
         try:
             logger.info('extracting %s %s...', repo_id, path)
             content = self.func(content)
             logger.info('successfully extracted %s', path)
         except Exception as e:
             logger.error('failed to extract %s: %s', path, e)
+            duration = time.time() - start
+            extract_seconds.observe(duration, suffix=self.suffix)
+            extract_files.inc(suffix=self.suffix, result=getattr(e, 'reason', 'error'))
+            self.record_failure(repo_id, obj_id, path, e, duration)
+            self.failed = True
             return None
+        extract_seconds.observe(time.time() - start, suffix=self.suffix)
+        extract_files.inc(suffix=self.suffix, result='ok')
 
         return self.fix_encoding(repo_id, path, content)
 
+    def record_failure(self, repo_id, obj_id, path, error, duration):
+        if not self.quarantine:
+            return
+        reason = getattr(error, 'reason', 'error')
+        try:
+            self.quarantine.record_failure(obj_id, repo_id, path, reason, duration, str(error))
+        except Exception as e:
+            logger.warning('failed to record extraction failure of %s: %s', path, e)
+
     def fix_encoding(self, repo_id, path, content):
         if not content:
             return None
@@ -207,7 +271,7 @@ class Extractor(object):
 
 class ExtractorFactory(object):
     @classmethod
-    def get_extractor(cls, filename):
+    def get_extractor(cls, filename, quarantine=None):
         if not cls.should_extract(filename):
             return None
 
@@ -215,7 +279,7 @@ class ExtractorFactory(object):
         func = EXTRACT_TEXT_FUNCS.get(suffix, None)
         if not func:
             return None
-        return Extractor(func, cls.get_file_size_limit(filename))
+        return Extractor(func, cls.get_file_size_limit(filename), quarantine, suffix)
 
     @classmethod
     def should_extract(cls, filename):
@@ -3,7 +3,9 @@
 import logging
 
 from .commit_differ import CommitDiffer
+from .config import seafes_config
 from .indexes import RepoStatusIndex, RepoFilesIndex
+from .metrics import counter, gauge, index_stage_seconds
 
 from seafobj import commit_mgr
 from seafobj.exceptions import GetObjectError
@@ -12,14 +14,23 @@ logger = logging.getLogger('seafes')
 
 MAX_ERRORS_ALLOWED = 1000
 
+repos_updated = counter('seafes_repos_updated_total',
+                        'Repos handled by the index updater, by result: updated, uptodate or error.', ['result'])
+files_changed = counter('seafes_files_changed_total',
+                        'Changes found by diffing commits, by kind.', ['kind'])
+repos_in_flight = gauge('seafes_index_repos_in_flight', 'Repos being indexed right now.')
+
 class FileIndexUpdater(object):
     '''Update the repo file info index'''
 
-    def __init__(self, es_conn):
+    def __init__(self, es_conn, pipeline=None):
         self.es_conn = es_conn
 
-        self.status_index = RepoStatusIndex(es_conn)
+        self.status_index = RepoStatusIndex(es_conn, seafes_config.status_flush_interval)
         self.files_index = RepoFilesIndex(es_conn)
+        self.files_index.prepare_indexing()
+        # an ``IndexPipeline`` indexing the added and modified files, if set
+        self.pipeline = pipeline
         self.error_counter = 0
 
     def update_files_index(self, repo_id, old_commit_id, new_commit_id):
@@ -27,20 +38,21 @@ class FileIndexUpdater(object):
             return
 
         old_root = None
-        if old_commit_id:
+        with index_stage_seconds.time(stage='fetch_commit'):
+            if old_commit_id:
+                try:
+                    old_commit = commit_mgr.load_commit(repo_id, 0, old_commit_id)
+                    old_root = old_commit.root_id
+                except GetObjectError as e:
+                    logger.debug(e)
+                    old_root = None
+
             try:
-                old_commit = commit_mgr.load_commit(repo_id, 0, old_commit_id)
-                old_root = old_commit.root_id
+                new_commit = commit_mgr.load_commit(repo_id, 0, new_commit_id)
             except GetObjectError as e:
-                logger.debug(e)
-                old_root = None
-
-        try:
-            new_commit = commit_mgr.load_commit(repo_id, 0, new_commit_id)
-        except GetObjectError as e:
-            # new commit should exists in the obj store
-            logger.warning(e)
-            return
+                # new commit should exists in the obj store
+                logger.warning(e)
+                return
 
         new_root = new_commit.root_id
         version = new_commit.get_version()
@@ -51,7 +63,12 @@ class FileIndexUpdater(object):
             return
 
         differ = CommitDiffer(repo_id, version, old_root, new_root)
-        added_files, deleted_files, added_dirs, deleted_dirs, modified_files = differ.diff(new_commit.ctime)
+        with index_stage_seconds.time(stage='diff'):
+            added_files, deleted_files, added_dirs, deleted_dirs, modified_files = differ.diff(new_commit.ctime)
+        for kind, changes in (('added_file', added_files), ('deleted_file', deleted_files),
+                              ('added_dir', added_dirs), ('deleted_dir', deleted_dirs),
+                              ('modified_file', modified_files)):
+            files_changed.inc(len(changes), kind=kind)
 
         # if inrecovery:
         #     added_files = filter(lambda x:not es_check_exist(es, repo_id, x), added_files)
@@ -61,11 +78,15 @@ class FileIndexUpdater(object):
         #     logger.warning('skip large changeset: %s files(%s)', total_changed, repo_id)
         #     return
 
-        self.files_index.add_files(repo_id, version, added_files)
+        if self.pipeline:
+            add_files = update_files = self.pipeline.add_files
+        else:
+            add_files, update_files = self.files_index.add_files, self.files_index.update_files
+        add_files(repo_id, version, added_files)
         self.files_index.delete_files(repo_id, deleted_files)
         self.files_index.add_dirs(repo_id, version, added_dirs)
         self.files_index.delete_dirs(repo_id, deleted_dirs)
-        self.files_index.update_files(repo_id, version, modified_files)
+        update_files(repo_id, version, modified_files)
 
     def check_recovery(self, repo_id):
         status = self.status_index.get_repo_status(repo_id)
@@ -77,6 +98,15 @@ class FileIndexUpdater(object):
             self.status_index.finish_update_repo(repo_id, new)
 
     def update_repo(self, repo_id, latest_commit_id):
+        with repos_in_flight.track_inprogress():
+            try:
+                updated = self._update_repo(repo_id, latest_commit_id)
+            except Exception:
+                repos_updated.inc(result='error')
+                raise
+        repos_updated.inc(result='updated' if updated else 'uptodate')
+
+    def _update_repo(self, repo_id, latest_commit_id):
         self.check_recovery(repo_id)
 
         status = self.status_index.get_repo_status(repo_id)
@@ -89,5 +119,7 @@ class FileIndexUpdater(object):
             self.status_index.begin_update_repo(repo_id, old, new)
             self.update_files_index(repo_id, old, new)
             self.status_index.finish_update_repo(repo_id, new)
+            return True
         else:
             logger.debug('Repo %s already uptodate', repo_id)
+            return False
@@ -0,0 +1,124 @@
+# coding: UTF-8
+
+import logging
+
+from seafobj import commit_mgr, fs_mgr
+from seafobj.exceptions import GetObjectError
+
+from .indexes import RepoStatusIndex
+from .repo_data import repo_data
+
+logger = logging.getLogger('seafes')
+
+
+class FreshnessChecker(object):
+    '''Tell which search results still match the current state of their
+    repos, so that a results page can be validated with one call instead of
+    one stat per hit.
+
+    A repo whose head commit is the commit it was last indexed at has all its
+    results fresh, and costs one head lookup. In the other repos the
+    ``obj_id`` of each file result is compared with the object currently at
+    its path, resolving paths from the head commit in the object store. Dir
+    results are fresh as long as the dir exists: the ``obj_id`` of a dir
+    document is only written when the dir is added, it changes with any
+    change below the dir. Dirs loaded along the way are reused within one
+    ``check`` call.
+    '''
+
+    def __init__(self, es):
+        self.es = es
+
+    def check(self, results):
+        """Return a list of booleans, True for each entry of ``results``
+        (as returned by ``search_files``) that is still fresh.
+        """
+        repo_ids = sorted(set(r['repo_id'] for r in results))
+        indexed = self._get_indexed_commits(repo_ids)
+
+        repos = {}
+        for repo_id in repo_ids:
+            head = repo_data.get_repo_head_commit(repo_id)
+            if head is not None and head == indexed.get(repo_id):
+                repos[repo_id] = True
+            elif head is None:
+                repos[repo_id] = None
+            else:
+                repos[repo_id] = _RepoTree(repo_id, head)
+
+        ret = []
+        for r in results:
+            repo = repos[r['repo_id']]
+            if repo is True or repo is None:
+                ret.append(bool(repo))
+            elif r['fullpath'].endswith('/'):
+                ret.append(repo.get_obj_id(r['fullpath']) is not None)
+            else:
+                ret.append(r.get('obj_id') is not None and
+                           repo.get_obj_id(r['fullpath']) == r['obj_id'])
+        return ret
+
+    def _get_indexed_commits(self, repo_ids):
+        if not repo_ids:
+            return {}
+        resp = self.es.mget(index=RepoStatusIndex.INDEX_NAME, doc_type=RepoStatusIndex.MAPPING_TYPE,
+                            body={'ids': repo_ids}, _source_include=['commit', 'updatingto'])
+        ret = {}
+        for doc in resp['docs']:
+            source = doc.get('_source')
+            # a repo being updated is only partly indexed at any commit.
+            if source and not source.get('updatingto'):
+                ret[doc['_id']] = source.get('commit')
+        return ret
+
+
+class _RepoTree(object):
+    def __init__(self, repo_id, commit_id):
+        self.repo_id = repo_id
+        self.commit_id = commit_id
+        self._loaded = False
+        self._version = None
+        self._dirs = {} # dir path -> SeafDir, or None if missing
+
+    def _load_commit(self):
+        self._loaded = True
+        try:
+            commit = commit_mgr.load_commit(self.repo_id, 0, self.commit_id)
+        except GetObjectError as e:
+            logger.warning(e)
+            self._dirs['/'] = None
+            return
+        self._version = commit.get_version()
+        self._dirs['/'] = fs_mgr.load_seafdir(self.repo_id, self._version, commit.root_id)
+
+    def _get_dir(self, path):
+        if path in self._dirs:
+            return self._dirs[path]
+        parent_path, name = path.rstrip('/').rsplit('/', 1)
+        parent = self._get_dir(parent_path or '/')
+        seafdir = None
+        if parent is not None:
+            dent = parent.lookup_dent(name)
+            if dent is not None and dent.is_dir():
+                seafdir = fs_mgr.load_seafdir(self.repo_id, self._version, dent.id)
+        self._dirs[path] = seafdir
+        return seafdir
+
+    def get_obj_id(self, path):
+        """Return the id of the object at ``path``, dirs ending with '/', or
+        None if it does not exist.
+        """
+        if not self._loaded:
+            self._load_commit()
+        if path.endswith('/'):
+            seafdir = self._get_dir(path.rstrip('/') or '/')
+            return seafdir.obj_id if seafdir is not None else None
+
+        dir_path, name = path.rsplit('/', 1)
+        parent = self._get_dir(dir_path or '/')
+        if parent is None:
+            return None
+        dent = parent.lookup_dent(name)
+        if dent is None or dent.is_dir():
+            return None
+        return dent.id
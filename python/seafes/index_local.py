@@ -1,5 +1,6 @@
 import os
 import sys
+import glob
 import time
 import queue
 import logging
@@ -12,14 +13,22 @@ from .config import seafes_config
 
 from seafes.utils import init_logging
 from seafes.connection import es_get_conn
-from seafes.indexes import RepoStatusIndex, RepoFilesIndex
+from seafes.indexes import RepoStatusIndex, RepoFilesIndex, RepoACLIndex, ExtractQuarantineIndex, \
+    RepoContentsIndex
 from seafes.file_index_updater import FileIndexUpdater
+from seafes.index_migrator import IndexMigrator
+from seafes.repo_snapshot import RepoIndexSnapshot
+from seafes.sharding import Shard, shard_of
+from seafes.segment_maintenance import MergeWindow, SegmentMaintenance
+from seafes.metrics import index_queue_depth, start_metrics_server
 from seafes.repo_data import repo_data
 
 MAX_ERRORS_ALLOWED = 1000
+PROGRESS_LOG_INTERVAL = 100
 logger = logging.getLogger('seafes')
 
 UPDATE_FILE_LOCK = os.path.join(os.path.dirname(__file__), 'update.lock')
+MIGRATE_FILE_LOCK = os.path.join(os.path.dirname(__file__), 'migrate.lock')
 lockfile = None
 NO_TASKS = False
 
@@ -27,19 +36,28 @@ NO_TASKS = False
 class IndexLocal(object):
     """ Independent update index.
     """
-    def __init__(self, es):
+    def __init__(self, es, shard=None):
         self.fileindexupdater = FileIndexUpdater(es)
+        self.shard = shard
         self.error_counter = 0
+        self.done_counter = 0
+        self.total_counter = 0
+        self.counter_lock = threading.Lock()
         self.worker_list = []
 
     def clear_worker(self):
         for th in self.worker_list:
             th.join()
         logger.info("All worker threads has stopped.")
+        try:
+            self.fileindexupdater.status_index.flush()
+        except Exception as e:
+            logger.warning('failed to write the status of updated repos: %s', e)
 
     def run(self):
         time_start = time.time()
         repos_queue = queue.Queue(0)
+        index_queue_depth.set_function(repos_queue.qsize)
         for i in range(seafes_config.index_workers):
             thread_name = "worker" + str(i)
             logger.info("starting %s worker threads for indexing" 
@@ -48,30 +66,27 @@ class IndexLocal(object):
             t.start()
             self.worker_list.append(t)
 
-        start, count = 0, 1000
         repos = {}
-        while True:
-            global NO_TASKS
-            try:
-                repo_commits = repo_data.get_repo_id_commit_id(start, count)
-            except Exception as e:
-                logger.error("Error: %s" % e)
-                NO_TASKS = True
-                self.clear_worker()
-                return
-            else:
-                if len(repo_commits) == 0:
-                    NO_TASKS = True
-                    break
-                for repo_id, commit_id in repo_commits:
-                    repos_queue.put((repo_id, commit_id))
-                    repos[repo_id] = commit_id
-                start += 1000
+        global NO_TASKS
+        try:
+            for repo_id, commit_id in self.iter_repo_commits():
+                if self.shard and not self.shard.contains(repo_id):
+                    continue
+                repos_queue.put((repo_id, commit_id))
+                repos[repo_id] = commit_id
+                self.total_counter += 1
+        except Exception as e:
+            logger.error("Error: %s" % e)
+            NO_TASKS = True
+            self.clear_worker()
+            return
+        NO_TASKS = True
 
         self.clear_worker()
         logger.info("index updated, total time %s seconds" % str(time.time() - time_start))
         try:
             self.clear_deleted_repo(list(repos.keys()))
+            self.clear_unused_contents()
         except (ConnectionError, ConnectionTimeout):
             logger.warning('Elasticsearch Server Not Available')
             self.incr_error()
@@ -85,6 +100,17 @@ class IndexLocal(object):
             logger.exception('Delete Repo Error: %s' % e)
             self.incr_error()
 
+    def iter_repo_commits(self):
+        """Yield (repo id, head commit id) of all the repos to update."""
+        start, count = 0, 1000
+        while True:
+            repo_commits = repo_data.get_repo_id_commit_id(start, count)
+            if len(repo_commits) == 0:
+                return
+            for repo_id, commit_id in repo_commits:
+                yield repo_id, commit_id
+            start += count
+
     def thread_task(self, repos_queue):
         while True:
             try:
@@ -115,6 +141,7 @@ class IndexLocal(object):
                 except:
                     logger.exception('Index Repo Error: %s' % repo_id, exc_info=True)
                     self.incr_error()
+                self.incr_done()
 
         logger.info(
             "%s worker updated at %s time" 
@@ -130,6 +157,8 @@ class IndexLocal(object):
     def clear_deleted_repo(self, repos):
         logger.info("start to clear deleted repo")
         repo_all = [e.get('id') for e in self.fileindexupdater.status_index.get_all_repos_from_index()]
+        if self.shard:
+            repo_all = [repo_id for repo_id in repo_all if self.shard.contains(repo_id)]
 
         repo_deleted = set(repo_all) - set(repos)
         logger.info("%d repos need to be deleted."% len(repo_deleted))
@@ -138,9 +167,26 @@ class IndexLocal(object):
             logger.info('Repo %s has been deleted from index.' % repo)
         logger.info("deleted repo has been cleared")
 
+    def clear_unused_contents(self):
+        files_index = self.fileindexupdater.files_index
+        # the objects are shared by all the repos, collect them only once
+        if not files_index.contents_index or (self.shard and self.shard.index != 0):
+            return
+        logger.info("start to clear unused file contents")
+        files_index.contents_index.collect_garbage(files_index.INDEX_NAME)
+
     def incr_error(self):
         self.error_counter += 1
 
+    def incr_done(self):
+        with self.counter_lock:
+            self.done_counter += 1
+            done = self.done_counter
+        if done % PROGRESS_LOG_INTERVAL == 0:
+            logger.info('%s%d of %d repos updated, %d errors',
+                        'shard %s: ' % self.shard if self.shard else '',
+                        done, self.total_counter, self.error_counter)
+
     def delete_repo(self, repo_id):
         if len(repo_id) != 36:
             return
@@ -148,17 +194,20 @@ class IndexLocal(object):
         self.fileindexupdater.files_index.delete_repo(repo_id)
 
 
-def start_index_local():
-    if not check_concurrent_update():
+def start_index_local(args=None):
+    shard = getattr(args, 'shard', None)
+    if not check_concurrent_update(get_update_lock(shard)):
         return 
 
     try:
-        index_local = IndexLocal(es_get_conn())
+        index_local = IndexLocal(es_get_conn(), shard)
     except Exception as e:
         logger.error("Index process init error: %s." % e)
         return
 
     logger.info("Index process initialized.")
+    start_metrics_server(getattr(args, 'metrics_port', None) or seafes_config.metrics_port,
+                         seafes_config.metrics_addr)
     index_local.run()
 
     logger.info('\n\nIndex updated, statistic report:\n')
@@ -166,13 +215,92 @@ def start_index_local():
     logger.info('[dir read]    %s', fs_mgr.dir_read_count())
     logger.info('[file read]   %s', fs_mgr.file_read_count())
     logger.info('[block read]  %s', block_mgr.read_count())
+    if shard:
+        logger.info('[shard]       %s: %d repos, %d errors', shard,
+                    index_local.total_counter, index_local.error_counter)
+
+def show_status(args):
+    """Print, for each of ``args.shards`` shards, how many repos are indexed
+    at their head commit. Only reads the seafile database and the repo_head
+    index, so it can run anywhere while the shards are being updated.
+    """
+    status = RepoStatusIndex(es_get_conn()).get_all_repo_status()
+    summary = [dict(total=0, done=0, updating=0, pending=0) for _ in range(args.shards)]
+
+    start, count = 0, 1000
+    while True:
+        repo_commits = repo_data.get_repo_id_commit_id(start, count)
+        if not repo_commits:
+            break
+        for repo_id, commit_id in repo_commits:
+            item = summary[shard_of(repo_id, args.shards)]
+            item['total'] += 1
+            repo_status = status.get(repo_id)
+            if repo_status is not None and repo_status.need_recovery():
+                item['updating'] += 1
+            elif repo_status is not None and repo_status.from_commit == commit_id:
+                item['done'] += 1
+            else:
+                item['pending'] += 1
+        start += count
 
-def delete_indices():
+    print('%-8s %10s %10s %10s %10s' % ('shard', 'repos', 'indexed', 'updating', 'pending'))
+    for i, item in enumerate(summary):
+        print('%-8s %10d %10d %10d %10d' % ('%d/%d' % (i, args.shards), item['total'],
+                                             item['done'], item['updating'], item['pending']))
+
+def delete_indices(args=None): # pylint: disable=unused-argument
     es = es_get_conn()
-    for idx in (RepoStatusIndex.INDEX_NAME, RepoFilesIndex.INDEX_NAME):
-        if es.indices.exists(idx):
-            logger.warning('deleting index %s', idx)
-            es.indices.delete(idx)
+    for index_class in (RepoStatusIndex, RepoFilesIndex, RepoACLIndex, RepoContentsIndex, ExtractQuarantineIndex):
+        index_class.delete_index(es)
+
+def migrate_indices(args):
+    if not do_lock(MIGRATE_FILE_LOCK):
+        logger.error('another migrate task is running, quit now')
+        return
+
+    migrator = IndexMigrator(es_get_conn(), slices=args.slices)
+    migrator.migrate(keep_old=args.keep_old)
+
+def export_repos(args):
+    snapshot = RepoIndexSnapshot(es_get_conn())
+    snapshot.export(args.repos, args.output)
+
+def import_repos(args):
+    if not check_concurrent_update():
+        return
+
+    snapshot = RepoIndexSnapshot(es_get_conn())
+    snapshot.import_(args.input, force=args.force)
+
+def handle_quarantine(args):
+    quarantine = ExtractQuarantineIndex(es_get_conn(), seafes_config.extract_max_attempts)
+    if args.clear:
+        quarantine.clear(args.obj_ids or None)
+        return
+
+    print('%-40s %8s %8s %10s  %s' % ('object', 'attempts', 'reason', 'duration', 'file'))
+    for obj in quarantine.list_objects():
+        print('%-40s %8d %8s %9.1fs  %s %s' % (obj['obj_id'], obj.get('attempts', 0), obj.get('reason'),
+                                             obj.get('duration') or 0, obj.get('repo'), obj.get('path')))
+
+def merge_indices(args):
+    window = MergeWindow.parse(seafes_config.merge_window) if seafes_config.merge_window else None
+    maintenance = SegmentMaintenance(es_get_conn(), window)
+
+    print('%-24s %12s %12s %8s %10s %8s' % ('index', 'docs', 'deleted', 'ratio', 'segments', 'merge'))
+    for stat in maintenance.get_index_stats():
+        print('%-24s %12d %12d %7.1f%% %10d %8s' % (stat['index'], stat['docs'], stat['deleted'],
+                                                   stat['deleted_ratio'] * 100, stat['segments'],
+                                                   'yes' if maintenance.needs_merge(stat) else 'no'))
+    if not args.dry_run:
+        maintenance.run(ignore_window=args.ignore_window)
+
+def shard_type(spec):
+    try:
+        return Shard.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 def main():
     parser = argparse.ArgumentParser()
@@ -191,13 +319,98 @@ def main():
 
     # update index of filename and text/markdown file content
     parser_update = subparsers.add_parser('update', help='update seafile index')
+    parser_update.add_argument(
+        '--shard',
+        type=shard_type,
+        help='only update the repos in shard i of N, given as i/N (0 <= i < N)')
+    parser_update.add_argument(
+        '--metrics-port',
+        type=int,
+        help='serve prometheus metrics on this port, overrides metrics_port in seafevents.conf')
     parser_update.set_defaults(func=start_index_local)
 
+    # status
+    parser_status = subparsers.add_parser('status',
+                                          help='show how many repos are indexed, per shard')
+    parser_status.add_argument(
+        '--shards',
+        default=1,
+        type=int,
+        help='number of shards the repos are split into')
+    parser_status.set_defaults(func=show_status)
+
     # clear
     parser_clear = subparsers.add_parser('clear',
                                          help='clear all index')
     parser_clear.set_defaults(func=delete_indices)
 
+    # migrate
+    parser_migrate = subparsers.add_parser('migrate',
+                                           help='rebuild the file index with the current mapping, without re-extracting files')
+    parser_migrate.add_argument(
+        '--slices',
+        default=4,
+        type=int,
+        help='number of parallel scroll slices used to copy documents')
+    parser_migrate.add_argument(
+        '--keep-old',
+        action='store_true',
+        help='keep the old index after the alias is switched')
+    parser_migrate.set_defaults(func=migrate_indices)
+
+    # export
+    parser_export = subparsers.add_parser('export',
+                                          help='export the index of some repos to a gzip\'d NDJSON file')
+    parser_export.add_argument(
+        '--repos',
+        nargs='+',
+        required=True,
+        help='ids of the repos to export')
+    parser_export.add_argument(
+        '--output',
+        required=True,
+        help='path of the file to write, e.g. repos.ndjson.gz')
+    parser_export.set_defaults(func=export_repos)
+
+    # import
+    parser_import = subparsers.add_parser('import',
+                                          help='import the repos in a file written by export')
+    parser_import.add_argument(
+        '--input',
+        required=True,
+        help='path of the file to read')
+    parser_import.add_argument(
+        '--force',
+        action='store_true',
+        help='import a repo even if its indexed commit is not found on this server')
+    parser_import.set_defaults(func=import_repos)
+
+    # quarantine
+    parser_quarantine = subparsers.add_parser('quarantine',
+                                              help='list the files whose content failed to be extracted')
+    parser_quarantine.add_argument(
+        '--clear',
+        action='store_true',
+        help='remove the given objects (all if none is given) from the quarantine')
+    parser_quarantine.add_argument(
+        'obj_ids',
+        nargs='*',
+        help='object ids to clear')
+    parser_quarantine.set_defaults(func=handle_quarantine)
+
+    # merge
+    parser_merge = subparsers.add_parser('merge',
+                                         help='expunge deleted docs from the indices which have many of them')
+    parser_merge.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='only show the stats of the indices')
+    parser_merge.add_argument(
+        '--ignore-window',
+        action='store_true',
+        help='merge even outside of merge_window')
+    parser_merge.set_defaults(func=merge_indices)
+
     if len(sys.argv) == 1:
         print(parser.format_help())
         return
@@ -209,7 +422,7 @@ def main():
 
     logger.info('index office pdf: %s', seafes_config.index_office_pdf)
 
-    args.func()
+    args.func(args)
 
 def do_lock(fn):
     if os.name == 'nt':
@@ -251,12 +464,70 @@ def do_lock_linux(fn):
     except portalocker.LockException:
         return False
 
-def check_concurrent_update():
+def do_unlock():
+    """Release the lock taken by ``do_lock``."""
+    global lockfile
+    if lockfile is None:
+        return
+    if os.name == 'nt':
+        import ctypes
+        if lockfile != -1:
+            ctypes.windll.kernel32.CloseHandle(lockfile)
+    else:
+        lockfile.close()
+    lockfile = None
+
+def is_locked(fn):
+    """Return whether the lock file ``fn`` is held by another task."""
+    if not os.path.exists(fn):
+        return False
+    if os.name == 'nt':
+        import ctypes
+        handle = ctypes.windll.kernel32.CreateFileW(fn, 0x40000000, 0, None, 4, 0, None)
+        if handle == -1:
+            return True
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return False
+
+    from . import portalocker
+    with open(fn, 'a') as f:
+        try:
+            portalocker.lock(f, portalocker.LOCK_NB | portalocker.LOCK_EX)
+        except portalocker.LockException:
+            return True
+        portalocker.unlock(f)
+    return False
+
+def get_update_lock(shard=None):
+    if shard is None:
+        return UPDATE_FILE_LOCK
+    return os.path.join(os.path.dirname(__file__), 'update-%d-of-%d.lock' % (shard.index, shard.count))
+
+def get_excluding_update_locks(lock_file):
+    """Return the held lock files of the updates an update holding
+    ``lock_file`` must not run with: an update of all repos and the updates
+    of shards exclude each other.
+    """
+    if lock_file == UPDATE_FILE_LOCK:
+        others = glob.glob(os.path.join(os.path.dirname(__file__), 'update-*-of-*.lock'))
+    else:
+        others = [UPDATE_FILE_LOCK]
+    return [fn for fn in sorted(others) if is_locked(fn)]
+
+def check_concurrent_update(lock_file=UPDATE_FILE_LOCK):
     '''Use a lock file to ensure only one task can be running'''
-    if not do_lock(UPDATE_FILE_LOCK):
+    if not do_lock(lock_file):
         logger.error('another index task is running, quit now')
         return False
 
+    # each update holds its own lock before checking the others, so two
+    # updates starting at once can't both miss each other.
+    held = get_excluding_update_locks(lock_file)
+    if held:
+        logger.error('another index task holds %s, quit now', os.path.basename(held[0]))
+        do_unlock()
+        return False
+
     return True
 
 if __name__ == "__main__":
@@ -11,6 +11,8 @@ from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, Request
 from seafes.mq import get_mq
 from seafes.utils import init_logging
 from seafes.utils.clear_deleted_repo_indices import clear_deleted_repo_indices
+from seafes.connection import es_get_conn
+from seafes.segment_maintenance import MergeWindow, SegmentMaintenance
 logger = logging.getLogger('seafes')
 
 
@@ -25,6 +27,11 @@ def start():
         clear_task = ClearInvalidData()
         logger.info("Clear process initialized.")
         clear_task.start()
+
+        if seafes_config.merge_window:
+            merge_task = SegmentMaintenanceTask(MergeWindow.parse(seafes_config.merge_window))
+            logger.info("Segment maintenance process initialized.")
+            merge_task.start()
     except Exception as e:
         logger.info(e)
 
@@ -118,6 +125,33 @@ class ClearInvalidData(Thread):
         self.s.enter((24 - time.gmtime().tm_hour) * 60 * 60, 0, self.clear, ())
         self.s.run()
 
+class SegmentMaintenanceTask(Thread):
+    """ Expunge deleted docs from the indices in the merge window, checking
+    again every ``RETRY_INTERVAL`` seconds while the window is open.
+    """
+    RETRY_INTERVAL = 10 * 60
+
+    def __init__(self, window):
+        Thread.__init__(self)
+        self.daemon = True
+        self.window = window
+
+    def run(self):
+        logger.info('segment maintenance runs in %s' % self.window)
+        while True:
+            wait = self.window.seconds_until_open()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                SegmentMaintenance(es_get_conn(), self.window).run()
+            except (ConnectionError, ConnectionTimeout):
+                logger.warning('Elasticsearch Server Not Available')
+            except TransportError as e:
+                logger.warning('Trans Error: %s' % e)
+            except Exception as e:
+                logger.error('Error in segment maintenance: %s' % e)
+            time.sleep(self.RETRY_INTERVAL)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+# coding: UTF-8
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch.helpers import bulk as es_bulk, scan
+from elasticsearch_dsl import Search
+
+from .indexes import RepoStatusIndex, RepoFilesIndex
+
+logger = logging.getLogger('seafes')
+
+
+class IndexMigrator(object):
+    '''Move the ``repofiles`` index to a new physical index built with the
+    current mapping and settings, without re-extracting any file content.
+
+    The steps are:
+    (1) create ``repofiles_v<N+1>`` with the current mapping, refresh and
+        replicas disabled for fast bulk loading
+    (2) copy all documents from the old index with a sliced parallel scroll,
+        filling fields added to the mapping since they were indexed
+    (3) catch up: repos whose status in ``repo_head`` changed during the copy
+        are copied again, until a round finds nothing new
+    (4) switch the ``repofiles`` alias to the new index in one atomic request
+    (5) repos changed between the last catch-up round and the switch get their
+        checkpoint rewound in ``repo_head``, so the normal recovery of
+        ``FileIndexUpdater`` re-applies those changes to the new index
+
+    Indexing may keep running during the whole migration. An update that is
+    still in flight when step (5) runs may overwrite the rewound checkpoint
+    with its own ``finish_update_repo``; stop the indexers before the switch
+    if that must not happen.
+    '''
+
+    def __init__(self, es, slices=4, max_catchup_rounds=5):
+        self.es = es
+        self.slices = slices
+        self.max_catchup_rounds = max_catchup_rounds
+
+        self.status_index = RepoStatusIndex(es)
+        self.files_index = RepoFilesIndex(es)
+
+    def migrate(self, keep_old=False):
+        indices = RepoFilesIndex.get_physical_indices(self.es)
+        if len(indices) != 1:
+            raise RuntimeError('%s should point to exactly one index, found %s'
+                               % (RepoFilesIndex.INDEX_NAME, indices))
+        source = indices[0]
+        target = RepoFilesIndex.physical_index_name(RepoFilesIndex.get_index_version(source) + 1)
+        logger.info('migrating %s from %s to %s', RepoFilesIndex.INDEX_NAME, source, target)
+
+        if self.es.indices.exists(index=target):
+            # left over by an interrupted migration, it is not in use.
+            logger.warning('deleting unfinished index %s', target)
+            self.es.indices.delete(index=target)
+        self.files_index.create_physical_index(target, self.files_index.index_settings)
+        origin_settings = self._disable_refresh(source, target)
+
+        snapshot = self.status_index.get_all_repo_status()
+        self.es.indices.refresh(index=source)
+        self.copy_documents(source, target)
+
+        for i in range(self.max_catchup_rounds):
+            self.es.indices.refresh(index=source)
+            self.es.indices.refresh(index=target)
+            current = self.status_index.get_all_repo_status()
+            changed = self._get_changed_repos(snapshot, current)
+            snapshot = current
+            logger.info('catch-up round %d: %d repos changed during copy', i + 1, len(changed))
+            if not changed:
+                break
+            for repo_id in changed:
+                self.copy_repo(source, target, repo_id)
+
+        self.es.indices.put_settings(index=target, body={'index': origin_settings})
+        self.es.indices.refresh(index=target)
+
+        self.switch_alias(source, target, keep_old)
+
+        current = self.status_index.get_all_repo_status()
+        self.rewind_repos(snapshot, current)
+        logger.info('%s migrated to %s', RepoFilesIndex.INDEX_NAME, target)
+
+    def _disable_refresh(self, source, target):
+        settings = self.es.indices.get_settings(index=source)[source]['settings']['index']
+        origin_settings = {
+            'refresh_interval': settings.get('refresh_interval', '1s'),
+            'number_of_replicas': settings.get('number_of_replicas', '1'),
+        }
+        self.es.indices.put_settings(index=target, body={
+            'index': {'refresh_interval': '-1', 'number_of_replicas': 0}
+        })
+        return origin_settings
+
+    def _copy(self, source, target, query):
+        def _actions():
+            for hit in scan(self.es, query=query, index=source, scroll='5m'):
+                yield {
+                    '_index': target,
+                    '_type': hit['_type'],
+                    '_id': hit['_id'],
+                    '_source': self.files_index.upgrade_document(hit['_source']),
+                }
+
+        return es_bulk(self.es, _actions(), chunk_size=500,
+                       max_chunk_bytes=10 * 1024 * 1024, stats_only=True)
+
+    def copy_documents(self, source, target):
+        if self.slices <= 1:
+            count = self._copy(source, target, None)[0]
+        else:
+            queries = [{'slice': {'id': i, 'max': self.slices}} for i in range(self.slices)]
+            with ThreadPoolExecutor(max_workers=self.slices) as executor:
+                results = list(executor.map(lambda q: self._copy(source, target, q), queries))
+            count = sum(r[0] for r in results)
+        logger.info('%d documents copied from %s to %s', count, source, target)
+
+    def copy_repo(self, source, target, repo_id):
+        Search(using=self.es, index=target).query('term', repo=repo_id).delete()
+        self._copy(source, target, {'query': {'term': {'repo': repo_id}}})
+
+    def _get_changed_repos(self, old, new):
+        changed = []
+        for repo_id in set(old) | set(new):
+            s1, s2 = old.get(repo_id), new.get(repo_id)
+            if s1 is None or s2 is None or s2.need_recovery() or \
+               (s1.from_commit, s1.to_commit) != (s2.from_commit, s2.to_commit):
+                changed.append(repo_id)
+        return changed
+
+    def switch_alias(self, source, target, keep_old):
+        alias = RepoFilesIndex.INDEX_NAME
+        if source == alias:
+            # A legacy index can't be the target of an alias with its own
+            # name, it has to be removed first. This leaves a short window
+            # without the index (indexers should be stopped, or a write may
+            # auto-create a concrete index under that name), later
+            # migrations are atomic.
+            self.es.indices.delete(index=source)
+            self.es.indices.put_alias(index=target, name=alias)
+            return
+
+        self.es.indices.update_aliases(body={
+            'actions': [
+                {'remove': {'index': source, 'alias': alias}},
+                {'add': {'index': target, 'alias': alias}},
+            ]
+        })
+        if not keep_old:
+            self.es.indices.delete(index=source)
+
+    def rewind_repos(self, old, new):
+        for repo_id in self._get_changed_repos(old, new):
+            status = new.get(repo_id)
+            if status is None:
+                continue
+            latest = status.to_commit or status.from_commit
+            indexed = old[repo_id].from_commit if repo_id in old else None
+            if latest is None or latest == indexed:
+                continue
+            logger.info('rewind repo %s to %s for recovery', repo_id, indexed)
+            self.status_index.begin_update_repo(repo_id, indexed, latest)
@@ -0,0 +1,157 @@
+# coding: UTF-8
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .extract import ExtractorFactory
+
+logger = logging.getLogger('seafes')
+
+
+class IndexPipeline(object):
+    '''Index the added and modified files of repos in a pipeline driven by an
+    asyncio event loop, instead of fetching, extracting and writing one file
+    after the other:
+
+    - ``fetch_workers`` threads read file contents from the object storage,
+      ahead of the files being extracted,
+    - ``extract_workers`` threads run the extractors,
+    - the documents are written with bulk requests of ``bulk_size`` actions,
+      up to ``write_workers`` of them in flight. Files are upserted, so they
+      are not looked up in the index first.
+
+    At most ``fetch_workers + 2 * extract_workers`` files are between
+    fetching and being handed to a bulk request at any time: a file keeps its
+    place until its action is in a batch, and a full batch waits for a free
+    bulk request before taking more actions. So the fetched contents held in
+    memory are bounded by these files, plus ``bulk_size`` actions per repo
+    being indexed, plus the ``write_workers`` bulk requests in flight. The
+    limits are shared by all the repos being indexed.
+
+    seafobj, the extractors and the elasticsearch client are blocking, so
+    each stage runs them in its own thread pool, and the event loop schedules
+    the stages. The loop runs in its own thread; ``add_files`` can be called
+    from any number of threads, e.g. the threads of ``IndexWorker``.
+    '''
+
+    def __init__(self, files_index, fetch_workers=8, extract_workers=4, write_workers=2, bulk_size=100):
+        self.files_index = files_index
+        self.files_index.prepare_indexing()
+        self.bulk_size = bulk_size
+        self.fetch_executor = ThreadPoolExecutor(fetch_workers, thread_name_prefix='pipeline_fetch')
+        self.extract_executor = ThreadPoolExecutor(extract_workers, thread_name_prefix='pipeline_extract')
+        self.write_executor = ThreadPoolExecutor(write_workers, thread_name_prefix='pipeline_write')
+        self.max_files_in_flight = fetch_workers + 2 * extract_workers
+        self.max_writes_in_flight = write_workers
+
+        self.loop = asyncio.new_event_loop()
+        t = threading.Thread(target=self.loop.run_forever, name='index_pipeline')
+        t.daemon = True
+        t.start()
+        self._call(self._init_limits())
+
+    async def _init_limits(self):
+        # created in the loop, they belong to it
+        self.files_in_flight = asyncio.Semaphore(self.max_files_in_flight)
+        self.writes_in_flight = asyncio.Semaphore(self.max_writes_in_flight)
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def add_files(self, repo_id, version, files):
+        """Index newly added or modified files, like
+        ``RepoFilesIndex.add_files``. Blocks until they are all written.
+        """
+        files = [f for f in files if len((repo_id + f[0]).encode('utf-8')) <= 512]
+        if files:
+            self._call(self.index_files(repo_id, version, files))
+
+    async def index_files(self, repo_id, version, files):
+        batch = _BulkBatch(self)
+        tasks = []
+        for path, obj_id, mtime, size in files:
+            # don't fetch further ahead than the limit allows
+            await self.files_in_flight.acquire()
+            tasks.append(self.loop.create_task(
+                self._index_file(repo_id, version, path, obj_id, mtime, size, batch)))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        results.extend(await batch.close())
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.warning('%s: %d of %d files failed to be indexed', repo_id, len(errors), len(files))
+            raise errors[0]
+
+    async def _index_file(self, repo_id, version, path, obj_id, mtime, size, batch):
+        try:
+            content = await self._get_content(repo_id, version, path, obj_id)
+            await batch.add(self.files_index.make_file_action(repo_id, path, content, obj_id, mtime, size))
+        finally:
+            # released only once the action is in the batch, so that no more
+            # files are fetched while the batch waits for a bulk request
+            self.files_in_flight.release()
+
+    async def _get_content(self, repo_id, version, path, obj_id):
+        contents_index = self.files_index.contents_index
+        if contents_index:
+            # the content is stored once per object in ``repocontents``
+            await self.loop.run_in_executor(self.extract_executor, contents_index.add_file,
+                                            repo_id, version, path, obj_id, self.files_index.quarantine)
+            return None
+
+        extractor = ExtractorFactory.get_extractor(os.path.basename(path), self.files_index.quarantine)
+        if extractor is None:
+            return None
+        raw = await self.loop.run_in_executor(self.fetch_executor, extractor.fetch,
+                                              repo_id, version, obj_id, path)
+        if raw is None:
+            return None
+        return await self.loop.run_in_executor(self.extract_executor, extractor.extract_content,
+                                               repo_id, obj_id, path, raw)
+
+
+class _BulkBatch(object):
+    '''Collect the bulk actions of one ``index_files`` call, sending a bulk
+    request whenever ``bulk_size`` of them are collected.
+    '''
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.actions = []
+        self.writes = []
+        # held by a full batch while it waits for a free bulk request, so
+        # that the other files wait with it instead of piling up actions
+        self.lock = asyncio.Lock()
+
+    async def add(self, action):
+        async with self.lock:
+            self.actions.append(action)
+            if len(self.actions) >= self.pipeline.bulk_size:
+                await self._flush()
+
+    async def flush(self):
+        async with self.lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self.actions:
+            return
+        await self.pipeline.writes_in_flight.acquire()
+        actions, self.actions = self.actions, []
+        self.writes.append(self.pipeline.loop.create_task(self._write(actions)))
+
+    async def _write(self, actions):
+        try:
+            await self.pipeline.loop.run_in_executor(self.pipeline.write_executor,
+                                                     self.pipeline.files_index.bulk, actions)
+        finally:
+            self.pipeline.writes_in_flight.release()
+
+    async def close(self):
+        """Send the remaining actions and wait for all the requests, return
+        their results (exceptions included).
+        """
+        await self.flush()
+        return await asyncio.gather(*self.writes, return_exceptions=True)
@@ -10,16 +10,21 @@ from redis.exceptions import ConnectionError as NoMQAvailable, ResponseError, Ti
 from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, RequestError, TransportError
 
 from .config import seafes_config
-from seafes.connection import es_get_conn, es_get_status
+from seafes.connection import es_get_conn
 from seafes.file_index_updater import FileIndexUpdater
+from seafes.index_pipeline import IndexPipeline
+from seafes.indexes import RepoFilesIndex
+from seafes.circuit_breaker import get_circuit_breaker, SUCCESS, FAILURE
 from seafes.utils import init_logging
 from seafes.repo_data import repo_data
 from seafes.mq import get_mq
+from seafes.metrics import index_queue_depth, start_metrics_server
 
 MAX_ERRORS_ALLOWED = 1000
 logger = logging.getLogger('seafes')
 locked_keys = set()  # record the repos which are updating by worker threads
 should_stop = threading.Event()
+indexworker = None
 
 class RefreshLockDaemon(object):
     def __init__(self):
@@ -61,9 +66,17 @@ class IndexWorker(object):
     """ The handler for redis message queue
     """
     def __init__(self, es, should_stop):
-        self.FileIndexUpdater = FileIndexUpdater(es)
+        pipeline = None
+        if seafes_config.index_pipeline:
+            pipeline = IndexPipeline(RepoFilesIndex(es),
+                                     fetch_workers=seafes_config.pipeline_fetch_workers,
+                                     extract_workers=seafes_config.pipeline_extract_workers,
+                                     write_workers=seafes_config.pipeline_write_workers,
+                                     bulk_size=seafes_config.pipeline_bulk_size)
+        self.FileIndexUpdater = FileIndexUpdater(es, pipeline)
         self.should_stop = should_stop
         self.LOCK_TIMEOUT = 1800  # 30 minutes
+        self.breaker = get_circuit_breaker(seafes_config.index_slave_workers)
 
     def _get_lock_key(self, repo_id):
         """Return lock key in redis.
@@ -83,19 +96,34 @@ class IndexWorker(object):
         logger.info('%s starting work' % threading.current_thread().name)
         try:
             while not should_stop.isSet():
+                # don't take tasks while elasticsearch is unavailable
+                if not self.breaker.wait_allowed(timeout=30):
+                    continue
                 try:
                     res = mq.brpop('index_task', timeout=30)
-                    if res is not None:
-                        key, value = res
-                        msg = value.split('\t')
-                        if len(msg) != 3:
-                            logger.info('Bad message: %s' % str(msg))
-                        else:
-                            repo_id, commit_id = msg[1], msg[2]
-                            self.worker_task_handler(mq, repo_id, commit_id,
-                                                     should_stop)
                 except (ResponseError, NoMQAvailable, TimeoutError) as e:
                     logger.error('The connection to the redis server failed: %s' % e)
+                    continue
+                if res is None:
+                    continue
+                key, value = res
+                if not self.breaker.acquire(timeout=30):
+                    # the circuit opened meanwhile, put the task back in front
+                    mq.rpush('index_task', value)
+                    continue
+                outcome = None
+                try:
+                    msg = value.split('\t')
+                    if len(msg) != 3:
+                        logger.info('Bad message: %s' % str(msg))
+                    else:
+                        repo_id, commit_id = msg[1], msg[2]
+                        outcome = self.worker_task_handler(mq, repo_id, commit_id,
+                                                           should_stop)
+                except (ResponseError, NoMQAvailable, TimeoutError) as e:
+                    logger.error('The connection to the redis server failed: %s' % e)
+                finally:
+                    self.breaker.release(outcome)
         except Exception as e:
             logger.error('%s Handle Worker Task Error' % threading.current_thread().name)
             logger.error(e, exc_info=True)
@@ -103,6 +131,9 @@ class IndexWorker(object):
             time.sleep(0.3)
 
     def worker_task_handler(self, mq, repo_id, commit_id, should_stop):
+        """Return the outcome of the update for the circuit breaker.
+        """
+        outcome = None
         # Python cannot kill threads, so stop it generate more locked key.
         if not should_stop.isSet():
             # set key-value if does not exist which will expire 30 minutes later
@@ -113,7 +144,7 @@ class IndexWorker(object):
                             (threading.currentThread().getName(), repo_id))
                 lock_key = self._get_lock_key(repo_id)
                 locked_keys.add(lock_key)
-                self.update_repo(mq, repo_id)
+                outcome = self.update_repo(mq, repo_id)
                 try:
                     locked_keys.remove(lock_key)
                 except KeyError:
@@ -124,17 +155,22 @@ class IndexWorker(object):
             else:
                 # the repo is updated by other thread, push back to the queue
                 self.add_to_undo_task(mq, repo_id, commit_id)
+        return outcome
+
+    def get_head_commit(self, repo_id):
+        return repo_data.get_repo_head_commit(repo_id)
 
     def update_repo(self, mq, repo_id):
-        commit_id = repo_data.get_repo_head_commit(repo_id)
+        commit_id = self.get_head_commit(repo_id)
         if not commit_id:
             # invalid repo without head commit id
             logger.error("invalid repo : %s " % repo_id)
-            return
+            return None
         try:
             self.FileIndexUpdater.update_repo(repo_id, commit_id)
         except Exception as e:
-            self.handle_exception(mq, repo_id, commit_id, e)
+            return self.handle_exception(mq, repo_id, commit_id, e)
+        return SUCCESS
 
     def add_to_undo_task(self, mq, repo_id, commit_id):
         """Push task back to the end of the queue.
@@ -147,13 +183,19 @@ class IndexWorker(object):
         time.sleep(0.5)
 
     def handle_exception(self, mq, repo_id, commit_id, e):
-        """ if es server unreachable, process will wait until es server work normal,
-            otherwise will record log then skip this task.
+        """ if es server unreachable, overloaded (429) or failing (5xx), push
+            the task back and report the failure to the circuit breaker, which
+            pauses all workers once es looks down. otherwise will record log
+            then skip this task.
         """
         if isinstance(e, ConnectionError) or isinstance(e, ConnectionTimeout):
             logger.warning('elasticsearch server not available')
-            self.wait_es_alive()
             self.add_to_undo_task(mq, repo_id, commit_id)
+            return FAILURE
+        elif isinstance(e, TransportError) and is_unavailable_status(e.status_code):
+            logger.warning('elasticsearch server unavailable: %s' % e)
+            self.add_to_undo_task(mq, repo_id, commit_id)
+            return FAILURE
         elif isinstance(e, RequestError):
             logger.warning('Request Error: %s' % e)
         elif isinstance(e, TransportError):
@@ -161,20 +203,11 @@ class IndexWorker(object):
         else:
             logger.exception('Index Repo %s Commit %s Error' % (repo_id, commit_id))
             logger.exception(e)
+            return None
+        return SUCCESS
 
-    def wait_es_alive(self):
-        count = 0
-        logger.warning('%s try reconnecting to elasticsearch server.' % threading.current_thread().name)
-        while True:
-            if es_get_status():
-                logger.warning('Elasticsearch server reconnected successfully.')
-                return
-            else:
-                time.sleep(2)
-                count += 1
-                if count > 100:
-                    logger.info('still can not be connected')
-                    count = 0
+def is_unavailable_status(status_code):
+    return isinstance(status_code, int) and (status_code == 429 or status_code >= 500)
 
 def clear(should_stop):
     seafes_config.load_index_slave_conf()
@@ -192,6 +225,13 @@ def clear(should_stop):
     for key in locked_keys:
         mq.delete(key)
         logger.info("redis lock key %s has been deleted" % key)
+    # write the buffered status of the updated repos, the ones still being
+    # updated are recovered by the next update
+    if indexworker is not None:
+        try:
+            indexworker.FileIndexUpdater.status_index.flush()
+        except Exception as e:
+            logger.warning('failed to write the status of updated repos: %s', e)
     # sys.exit
     logger.info("Exit the process")
     os._exit(0)
@@ -213,6 +253,14 @@ def start():
 
     RefreshLockDaemon().start()
 
+    mq = get_mq(seafes_config.subscribe_mq,
+                seafes_config.subscribe_server,
+                seafes_config.subscribe_port,
+                seafes_config.subscribe_password)
+    index_queue_depth.set_function(lambda: mq.llen('index_task'))
+    start_metrics_server(seafes_config.metrics_port, seafes_config.metrics_addr)
+
+    global indexworker
     try:
         indexworker = IndexWorker(es_get_conn(), should_stop)
         logger.info("Index worker process initialized.")
@@ -1,3 +1,6 @@
 
 from .repo_status import RepoStatusIndex
 from .repo_files import RepoFilesIndex
+from .repo_acl import RepoACLIndex
+from .extract_quarantine import ExtractQuarantineIndex
+from .repo_contents import RepoContentsIndex
@@ -3,8 +3,13 @@ import logging
 
 from elasticsearch.helpers import bulk as es_bulk
 
+from ..metrics import counter, index_stage_seconds
+
 logger = logging.getLogger('seafes')
 
+bulk_actions = counter('seafes_es_bulk_actions_total',
+                       'Bulk actions sent to elasticsearch, by index and result.', ['index', 'result'])
+
 
 class SeafileIndexBase(object):
     def __init__(self, es):
@@ -16,32 +21,82 @@ class SeafileIndexBase(object):
         """
         self.es = es
 
+    @classmethod
+    def physical_index_name(cls, version):
+        """Name of the versioned physical index behind the ``INDEX_NAME``
+        alias, e.g. ``repofiles_v2``.
+        """
+        return '%s_v%d' % (cls.INDEX_NAME, version)
+
+    @classmethod
+    def get_index_version(cls, index):
+        """Return the version of a physical index. An index created before
+        versioning was introduced (named ``INDEX_NAME`` itself) is version 0.
+        """
+        prefix = cls.INDEX_NAME + '_v'
+        if index.startswith(prefix) and index[len(prefix):].isdigit():
+            return int(index[len(prefix):])
+        return 0
+
+    @classmethod
+    def get_physical_indices(cls, es):
+        """Return the names of the concrete indices ``INDEX_NAME`` resolves
+        to, whether it is an alias or a (legacy) concrete index.
+        """
+        if not es.indices.exists(index=cls.INDEX_NAME):
+            return []
+        return sorted(es.indices.get(index=cls.INDEX_NAME).keys())
+
+    def create_physical_index(self, index, index_settings=None):
+        body = {}
+        if index_settings:
+            body['settings'] = index_settings
+        self.es.indices.create(index=index, body=body)
+
+        self.es.indices.put_mapping(
+            index=index,
+            doc_type=self.MAPPING_TYPE,
+            body=self.MAPPING
+        )
+
     def create_index_if_missing(self, index_settings=None):
         if not self.es.indices.exists(index=self.INDEX_NAME):
-            body = {}
-            if index_settings:
-                body['settings'] = index_settings
-            self.es.indices.create(index=self.INDEX_NAME, body=body)
-
-            self.es.indices.put_mapping(
-                index=self.INDEX_NAME,
-                doc_type=self.MAPPING_TYPE,
-                body=self.MAPPING
-            )
+            # Data lives in a versioned physical index and is always accessed
+            # through the alias, so the mapping can later be changed by
+            # migrating to a new version without search downtime.
+            index = self.physical_index_name(1)
+            self.create_physical_index(index, index_settings)
+            self.es.indices.put_alias(index=index, name=self.INDEX_NAME)
 
             self.es.indices.refresh(index=self.INDEX_NAME)
 
+    @classmethod
+    def delete_index(cls, es):
+        for index in cls.get_physical_indices(es):
+            logger.warning('deleting index %s', index)
+            es.indices.delete(index=index)
+
     def refresh(self):
-        self.es.indices.refresh(index=self.INDEX_NAME)
+        with index_stage_seconds.time(stage='refresh'):
+            self.es.indices.refresh(index=self.INDEX_NAME)
 
     def bulk(self, actions, **kw):
         kw.setdefault('chunk_size', 100)
         kw.setdefault('max_chunk_bytes', 5 * 1024 * 1024)
         kw.setdefault('raise_on_error', False)
         ignore_not_found = kw.pop('ignore_not_found', False)
-        _, errors = es_bulk(self.es, actions, **kw)
+        ignore_conflicts = kw.pop('ignore_conflicts', False)
+        with index_stage_seconds.time(stage='es_write'):
+            success, errors = es_bulk(self.es, actions, **kw)
+        bulk_actions.inc(success, index=self.INDEX_NAME, result='ok')
         if errors:
-            if ignore_not_found and all([e.get('delete', {}).get('status') == 404 for e in errors]):
+            bulk_actions.inc(len(errors), index=self.INDEX_NAME, result='error')
+            if ignore_conflicts:
+                # versioned actions on docs changed since they were read
+                errors = [e for e in errors if list(e.values())[0].get('status') != 409]
+            if not errors:
+                pass
+            elif ignore_not_found and all([e.get('delete', {}).get('status') == 404 for e in errors]):
                 # This could happen, e.g. when:
                 # 1. user deletes two files file2 and file2 in repo A
                 # 2. ES server fails when we're updating index for repo A, file1 is deleted from index but file2 is not
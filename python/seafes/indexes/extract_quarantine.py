@@ -0,0 +1,122 @@
+# coding: utf8
+import time
+import logging
+
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch.helpers import scan
+
+from .base import SeafileIndexBase
+
+logger = logging.getLogger('seafes')
+
+
+class ExtractQuarantineIndex(SeafileIndexBase):
+    '''The extract-quarantine index records the files whose content failed to
+    be extracted: the extractor raised, crashed or was killed after
+    ``content_extract_time``.
+
+    Once a file failed ``max_attempts`` times it is quarantined: its content
+    is no longer extracted, only its name is indexed, so it doesn't cost an
+    extraction timeout on every update or recovery of its repo.
+
+    The elasticsearch document id is the file object id, so a quarantined
+    file is skipped in every repo and at every path it appears, and a new
+    version of it (a new object) is extracted again.
+    '''
+
+    INDEX_NAME = 'extract_quarantine'
+    MAPPING_TYPE = 'object'
+    MAPPING = {
+        '_source': {
+            'enabled': True
+        },
+        'properties': {
+            'repo': {
+                'type': 'keyword',
+                'index': False
+            },
+            'path': {
+                'type': 'keyword',
+                'index': False
+            },
+            'reason': {
+                'type': 'keyword'
+            },
+            'error': {
+                'type': 'text',
+                'index': False
+            },
+            'duration': {
+                'type': 'float',
+                'index': False
+            },
+            'attempts': {
+                'type': 'integer'
+            },
+            'last_failure': {
+                'type': 'long'
+            },
+        },
+    }
+
+    def __init__(self, es, max_attempts):
+        super(ExtractQuarantineIndex, self).__init__(es)
+        self.create_index_if_missing()
+        self.max_attempts = max_attempts
+
+    def is_quarantined(self, obj_id):
+        try:
+            doc = self.es.get(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE,
+                              id=obj_id, _source_include=['attempts'])
+        except NotFoundError:
+            return False
+        return doc['_source'].get('attempts', 0) >= self.max_attempts
+
+    def record_failure(self, obj_id, repo_id, path, reason, duration, error=None):
+        """Count one more failed extraction of ``obj_id``, ``reason`` being
+        ``timeout`` or ``error``.
+        """
+        doc = {
+            'repo': repo_id,
+            'path': path,
+            'reason': reason,
+            'error': error,
+            'duration': duration,
+            'last_failure': int(time.time()),
+        }
+        upsert = dict(doc, attempts=1)
+        body = {
+            'script': {
+                'lang': 'painless',
+                'inline': 'ctx._source.putAll(params.doc); ctx._source.attempts += 1;',
+                'params': {'doc': doc},
+            },
+            'upsert': upsert,
+        }
+        self.es.update(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=obj_id,
+                       body=body, retry_on_conflict=3)
+
+    def list_objects(self):
+        """Return all recorded objects, most failed first."""
+        resp = scan(self.es,
+                    query={"query": {"match_all": {}}},
+                    index=self.INDEX_NAME,
+                    doc_type=self.MAPPING_TYPE)
+        ret = [dict(entry['_source'], obj_id=entry['_id']) for entry in resp]
+        ret.sort(key=lambda e: (-e.get('attempts', 0), -e.get('last_failure', 0)))
+        return ret
+
+    def clear(self, obj_ids=None):
+        """Remove ``obj_ids`` from the quarantine, or all objects if None, so
+        they are extracted again the next time they are indexed.
+        """
+        if obj_ids is None:
+            self.es.delete_by_query(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE,
+                                    body={"query": {"match_all": {}}}, conflicts='proceed')
+        else:
+            for obj_id in obj_ids:
+                try:
+                    self.es.delete(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=obj_id)
+                except NotFoundError:
+                    logger.warning('object %s is not in the quarantine', obj_id)
+        self.refresh()
@@ -0,0 +1,150 @@
+# coding: utf8
+import time
+import hashlib
+import logging
+import threading
+
+from .base import SeafileIndexBase
+
+logger = logging.getLogger('seafes')
+
+# How long a document is trusted to exist without checking it.
+DOC_TTL = 300
+# A document not used for this long is deleted when the user gets another.
+UNUSED_DOC_TTL = 24 * 3600
+
+# ids of the documents last known to be stored -> expire time, shared by all
+# the instances of the process. Expired ids are dropped once there are
+# ``MAX_STORED_DOCS``.
+MAX_STORED_DOCS = 10000
+_stored_docs = {}
+_stored_docs_lock = threading.Lock()
+
+
+class RepoACLIndex(SeafileIndexBase):
+    '''The repo-acl index stores the scopes a user can search in: the id of
+    each accessible repo, and ``<origin repo id>/<origin path>`` for each
+    shared sub-folder (virtual repo).
+
+    Searches reference the document with a terms lookup on the ``repo_dirs``
+    field of ``repofiles``, instead of sending one clause per repo in every
+    query.
+
+    The elasticsearch document id is the username joined with the digest of
+    the scopes, so a document never changes: searches of the same user with
+    different scopes, in the same ``_msearch`` or in other processes, each
+    reference their own document. ``used`` is the last time (in seconds,
+    updated at most every ``DOC_TTL``) a search used the document; when a
+    user gets a new document, the ones not used for ``UNUSED_DOC_TTL`` are
+    deleted.
+
+    The ids of the stored documents are cached by the process for
+    ``DOC_TTL`` seconds, so that a search doesn't need to write when the
+    scopes haven't changed.
+    '''
+
+    INDEX_NAME = 'repo_acl'
+    MAPPING_TYPE = 'acl'
+    MAPPING = {
+        '_source': {
+            'enabled': True
+        },
+        'properties': {
+            'username': {
+                'type': 'keyword',
+                'index': True
+            },
+            'scopes': {
+                'type': 'keyword',
+                'index': False
+            },
+            'used': {
+                'type': 'long'
+            }
+        },
+    }
+
+    def __init__(self, es):
+        super(RepoACLIndex, self).__init__(es)
+        self.create_index_if_missing()
+
+    @staticmethod
+    def make_scopes(repos_map):
+        scopes = set()
+        for repo in repos_map.values():
+            if repo.origin_repo_id:
+                scopes.add(repo.origin_repo_id + repo.origin_path.rstrip('/'))
+            else:
+                scopes.add(repo.id)
+        return sorted(scopes)
+
+    @staticmethod
+    def get_digest(scopes):
+        return hashlib.sha1('\n'.join(scopes).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_doc_id(cls, username, scopes):
+        return username + ':' + cls.get_digest(scopes)
+
+    def get_lookup(self, doc_id):
+        """Return the terms lookup which references the document ``doc_id``.
+        """
+        return {
+            'index': self.INDEX_NAME,
+            'type': self.MAPPING_TYPE,
+            'id': doc_id,
+            'path': 'scopes',
+        }
+
+    def ensure_user_acl(self, username, scopes):
+        """Make sure the document of ``username`` with ``scopes`` is stored,
+        and return its id.
+
+        Get is realtime in ES, so a terms lookup sees a new document without
+        a refresh.
+        """
+        doc_id = self.get_doc_id(username, scopes)
+        now = time.time()
+        with _stored_docs_lock:
+            expire = _stored_docs.get(doc_id)
+        if expire is not None and expire > now:
+            return doc_id
+
+        body = {
+            'script': {
+                'lang': 'painless',
+                'inline': 'if (ctx._source.used == null || ctx._source.used < params.now - params.ttl) { '
+                          '  ctx._source.used = params.now } else { ctx.op = "none" }',
+                'params': {'now': int(now), 'ttl': DOC_TTL},
+            },
+            'upsert': {'username': username, 'scopes': scopes, 'used': int(now)},
+        }
+        resp = self.es.update(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=doc_id,
+                              body=body, retry_on_conflict=3)
+        if resp.get('result') == 'created':
+            self._delete_unused_docs(username, now)
+        with _stored_docs_lock:
+            if len(_stored_docs) >= MAX_STORED_DOCS:
+                for key in [k for k, v in _stored_docs.items() if v <= now]:
+                    del _stored_docs[key]
+            _stored_docs[doc_id] = now + DOC_TTL
+        return doc_id
+
+    def _delete_unused_docs(self, username, now):
+        try:
+            self.es.delete_by_query(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, body={
+                'query': {'bool': {'filter': [
+                    {'term': {'username': username}},
+                    {'range': {'used': {'lt': int(now) - UNUSED_DOC_TTL}}},
+                ]}},
+            }, params={'conflicts': 'proceed'})
+        except Exception as e:
+            logger.warning('failed to delete unused acl documents of %s: %s', username, e)
+
+    def delete_user_acl(self, username):
+        with _stored_docs_lock:
+            for doc_id in [d for d in _stored_docs if d.rsplit(':', 1)[0] == username]:
+                del _stored_docs[doc_id]
+        self.es.delete_by_query(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, body={
+            'query': {'term': {'username': username}},
+        }, params={'conflicts': 'proceed'})
@@ -0,0 +1,274 @@
+# coding: utf8
+import os
+import time
+import logging
+
+from elasticsearch.exceptions import NotFoundError, ConflictError
+from elasticsearch.helpers import scan
+from elasticsearch_dsl import Search
+
+from .base import SeafileIndexBase
+
+from ..extract import ExtractorFactory
+from ..config import seafes_config
+from ..search_log import record_search
+
+logger = logging.getLogger('seafes')
+
+
+class RepoContentsIndex(SeafileIndexBase):
+    '''With ``dedup_content`` enabled, the extracted content of a file is
+    stored once per file object in this index instead of on every
+    ``repofiles`` document of the object, so a document copied into many
+    repos or paths is only extracted, analyzed and term-vectored once.
+
+    The elasticsearch document id is the file object id. ``repos`` lists the
+    repos the object was indexed in, and ``suffixes`` the suffixes of its
+    file names. They narrow down the objects a search looks at, access is
+    always checked on the ``repofiles`` documents. ``seen`` is the last time
+    (in seconds, updated at most every ``SEEN_UPDATE_INTERVAL``) a file of
+    the object was indexed.
+
+    Documents are not deleted with the files, an object that is added again
+    soon doesn't need to be extracted again. A deleted repo is removed from
+    ``repos`` by ``remove_repo``, and objects left without repos are deleted.
+    ``collect_garbage``, run after full updates, fixes up ``repos`` of the
+    objects not seen for ``GC_GRACE_PERIOD`` from the ``repofiles``
+    documents, and deletes the ones no file refers to any more.
+
+    Objects without content (empty, too large, nothing extracted) are
+    recorded too, without ``content``, so their other copies don't fetch
+    them again. Failed extractions are not recorded, they are retried (or
+    quarantined) like without dedup.
+
+    Only the indexer creates the index, see ``RepoFilesIndex.prepare_indexing``,
+    searches ignore it until it exists.
+    '''
+
+    INDEX_NAME = 'repocontents'
+    MAPPING_TYPE = 'content'
+    MAPPING = {
+        '_source': {
+            'enabled': True
+        },
+        'properties': {
+            'repos': {
+                'type': 'keyword',
+                'index': True,
+            },
+            'suffixes': {
+                'type': 'keyword',
+                'index': True,
+            },
+            'content': {
+                'type': 'text',
+                'index': True,
+                'term_vector': 'with_positions_offsets'
+            },
+            'seen': {
+                'type': 'long',
+            },
+        },
+    }
+
+    SEEN_UPDATE_INTERVAL = 3600
+    # an object is only collected when none of its files was indexed for
+    # this long, so files being indexed meanwhile are never left without it
+    GC_GRACE_PERIOD = 24 * 3600
+    GC_BATCH_SIZE = 500
+
+    def __init__(self, es):
+        super(RepoContentsIndex, self).__init__(es)
+        self.language_index_optimization()
+
+    def language_index_optimization(self):
+        # Analyze content the same way as ``repofiles`` does.
+        if seafes_config.lang:
+            if seafes_config.lang != 'chinese':
+                self.MAPPING['properties']['content']['analyzer'] = seafes_config.lang
+            else:
+                self.MAPPING['properties']['content']['analyzer'] = 'ik_smart'
+                self.MAPPING['properties']['content']['search_analyzer'] = 'ik_smart'
+
+    def add_repo_ref(self, obj_id, repo_id, suffix=None):
+        """Record that ``obj_id`` is in ``repo_id``, with a file name ending
+        in ``suffix``. Return False if the content of ``obj_id`` is not in
+        the index.
+        """
+        body = {'script': self._make_add_repo_script(repo_id, [suffix] if suffix else [])}
+        try:
+            self.es.update(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=obj_id,
+                           body=body, retry_on_conflict=3)
+        except NotFoundError:
+            return False
+        return True
+
+    def _make_add_repo_script(self, repo_id, suffixes):
+        return {
+            'lang': 'painless',
+            'inline': 'boolean changed = false; '
+                      'if (!ctx._source.repos.contains(params.repo)) { '
+                      '  ctx._source.repos.add(params.repo); changed = true } '
+                      'if (ctx._source.suffixes == null) { ctx._source.suffixes = new ArrayList() } '
+                      'for (s in params.suffixes) { '
+                      '  if (!ctx._source.suffixes.contains(s)) { ctx._source.suffixes.add(s); changed = true } } '
+                      'if (ctx._source.seen == null || ctx._source.seen < params.now - params.interval) { '
+                      '  ctx._source.seen = params.now; changed = true } '
+                      'if (!changed) { ctx.op = "none" }',
+            'params': {'repo': repo_id, 'suffixes': suffixes, 'now': int(time.time()),
+                       'interval': self.SEEN_UPDATE_INTERVAL},
+        }
+
+    def make_import_action(self, repo_id, obj_id, source):
+        """Return the bulk action which adds ``obj_id``, with the ``content``
+        and ``suffixes`` in ``source`` exported from another index, to
+        ``repo_id``.
+        """
+        suffixes = source.get('suffixes') or []
+        return {
+            '_op_type': 'update',
+            '_index': self.INDEX_NAME,
+            '_type': self.MAPPING_TYPE,
+            '_id': obj_id,
+            '_retry_on_conflict': 3,
+            'script': self._make_add_repo_script(repo_id, suffixes),
+            'upsert': {'repos': [repo_id], 'suffixes': suffixes, 'content': source.get('content'),
+                       'seen': int(time.time())},
+        }
+
+    def get_objects(self, obj_ids):
+        """Return ``{obj_id: source}`` of the objects of ``obj_ids`` which
+        are in the index, with their ``content`` and ``suffixes``.
+        """
+        if not obj_ids or not self.es.indices.exists(index=self.INDEX_NAME):
+            return {}
+        resp = self.es.mget(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, body={'ids': obj_ids},
+                            _source_include=['content', 'suffixes'])
+        return dict((doc['_id'], doc['_source']) for doc in resp['docs'] if doc.get('found'))
+
+    def add_file(self, repo_id, version, path, obj_id, quarantine=None):
+        """Extract and index the content of a file, unless the content of
+        its object is indexed already.
+        """
+        extractor = ExtractorFactory.get_extractor(os.path.basename(path), quarantine)
+        if extractor is None:
+            return
+        if self.add_repo_ref(obj_id, repo_id, extractor.suffix):
+            return
+
+        content = extractor.extract(repo_id, version, obj_id, path)
+        if not content and extractor.failed:
+            return
+        try:
+            self.es.index(index=self.INDEX_NAME,
+                          doc_type=self.MAPPING_TYPE,
+                          body={'repos': [repo_id], 'suffixes': [extractor.suffix], 'content': content or None,
+                                'seen': int(time.time())},
+                          id=obj_id,
+                          op_type='create')
+        except ConflictError:
+            # added by another repo meanwhile, don't replace its refs
+            self.add_repo_ref(obj_id, repo_id, extractor.suffix)
+
+    def remove_repo(self, repo_id):
+        """Remove ``repo_id`` from the objects in it, and delete the objects
+        left without repos.
+        """
+        if not self.es.indices.exists(index=self.INDEX_NAME):
+            return
+        self.es.update_by_query(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, body={
+            'query': {'term': {'repos': repo_id}},
+            'script': {
+                'lang': 'painless',
+                'inline': 'ctx._source.repos.removeIf(r -> r == params.repo)',
+                'params': {'repo': repo_id},
+            },
+        }, params={'conflicts': 'proceed', 'refresh': 'true'})
+        # an object a repo added meanwhile has another version and is kept
+        self.es.delete_by_query(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, body={
+            'query': {'bool': {'must_not': {'exists': {'field': 'repos'}}}},
+        }, params={'conflicts': 'proceed'})
+
+    def collect_garbage(self, files_index):
+        """Set ``repos`` of the objects not seen for ``GC_GRACE_PERIOD`` to
+        the repos whose documents in ``files_index`` (the ``repofiles``
+        index name) refer to them, and delete the objects no document refers
+        to. Return the number of deleted objects.
+        """
+        if not self.es.indices.exists(index=self.INDEX_NAME):
+            return 0
+        deadline = int(time.time()) - self.GC_GRACE_PERIOD
+        query = {'query': {'bool': {'should': [
+            {'range': {'seen': {'lt': deadline}}},
+            {'bool': {'must_not': {'exists': {'field': 'seen'}}}},
+        ]}}}
+        deleted = 0
+        batch = []
+        for hit in scan(self.es, query=query, index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE,
+                        _source_include=['repos'], version=True):
+            batch.append(hit)
+            if len(batch) == self.GC_BATCH_SIZE:
+                deleted += self._collect_batch(files_index, batch)
+                batch = []
+        if batch:
+            deleted += self._collect_batch(files_index, batch)
+        logger.info('deleted %d unreferenced objects from %s', deleted, self.INDEX_NAME)
+        return deleted
+
+    def _collect_batch(self, files_index, hits):
+        search = Search(using=self.es, index=files_index) \
+                 .filter('terms', obj_id=[hit['_id'] for hit in hits])[0:0]
+        search.aggs.bucket('objects', 'terms', field='obj_id', size=len(hits)) \
+                   .bucket('repos', 'terms', field='repo', size=1000)
+        resp = search.execute()
+        refs = dict((b.key, sorted(r.key for r in b.repos.buckets))
+                    for b in resp.aggregations.objects.buckets)
+
+        actions = []
+        for hit in hits:
+            repos = refs.get(hit['_id'])
+            # not applied if the object was added to a repo meanwhile
+            action = {'_index': self.INDEX_NAME, '_type': self.MAPPING_TYPE, '_id': hit['_id'],
+                      '_version': hit['_version']}
+            if not repos:
+                action['_op_type'] = 'delete'
+            elif repos != sorted(hit['_source'].get('repos') or []):
+                action.update({'_op_type': 'update', 'doc': {'repos': repos}})
+            else:
+                continue
+            actions.append(action)
+        if actions:
+            self.bulk(actions, ignore_not_found=True, ignore_conflicts=True)
+        return len([a for a in actions if a['_op_type'] == 'delete'])
+
+    def search_objects(self, query, size, repo_ids=None, obj_ids=None, suffixes=None):
+        """Return ``(obj_id, score)`` of the best ``size`` objects matching
+        ``query``, in ``repo_ids``, among ``obj_ids`` and with a file name
+        ending in one of ``suffixes``, if given.
+        """
+        search = Search(using=self.es, index=self.INDEX_NAME).query(query).source(False) \
+                 .params(ignore_unavailable=True)[0:size]
+        if repo_ids:
+            search = search.filter('terms', repos=repo_ids)
+        if obj_ids is not None:
+            search = search.filter('ids', values=obj_ids)
+        if suffixes:
+            search = search.filter('terms', suffixes=suffixes)
+        logger.debug(search.to_dict())
+        start = time.time()
+        resp = search.execute()
+        record_search('content', search, time.time() - start, resp.took, len(repo_ids or []))
+        return [(e['_id'], e['_score']) for e in resp.hits.hits]
+
+    def get_highlights(self, query, obj_ids, highlight, repos_count):
+        """Return ``{obj_id: [fragment, ...]}`` of ``query`` in the content
+        of ``obj_ids``. ``highlight`` adds the highlighting to the search.
+        """
+        search = Search(using=self.es, index=self.INDEX_NAME).query(query) \
+                 .filter('ids', values=obj_ids).source(False).params(ignore_unavailable=True)[0:len(obj_ids)]
+        search = highlight(search)
+        logger.debug(search.to_dict())
+        start = time.time()
+        resp = search.execute()
+        record_search('content_highlight', search, time.time() - start, resp.took, repos_count)
+        return dict((e['_id'], e.get('highlight', {}).get('content', [])) for e in resp.hits.hits)
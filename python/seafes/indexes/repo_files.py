@@ -1,22 +1,41 @@
 # coding: UTF-8
 
 import os
+import json
+import time
+import base64
 import logging
+import threading
 from operator import or_
 
 from elasticsearch.exceptions import NotFoundError
 from elasticsearch_dsl import Q, Search
+from elasticsearch_dsl.response import Response
 
 from .base import SeafileIndexBase
+from .repo_acl import RepoACLIndex
+from .extract_quarantine import ExtractQuarantineIndex
+from .repo_contents import RepoContentsIndex
 
 from ..extract import get_file_suffix, ExtractorFactory
 from ..config import seafes_config
+from ..search_cache import get_search_cache
+from ..search_log import record_search, should_profile
+from ..metrics import index_stage_seconds
 
 from ..repo_data import repo_data
 from functools import reduce
 
 logger = logging.getLogger('seafes')
 
+REPO_DIRS_CHECK_INTERVAL = 300
+
+# Whether ``repo_dirs`` is mapped as a keyword in all the physical indices,
+# as the terms lookup of ``acl_lookup`` needs, and until when it is known.
+_repo_dirs_mapped = None
+_repo_dirs_checked_until = 0
+_repo_dirs_lock = threading.Lock()
+
 
 class RepoFilesIndex(SeafileIndexBase):
     INDEX_NAME = 'repofiles'
@@ -34,6 +53,12 @@ class RepoFilesIndex(SeafileIndexBase):
                 'type': 'keyword',
                 'index': True,
             },
+            # repo id joined with each dir containing the entry (and the dir
+            # itself for dirs), e.g. ['<repo>', '<repo>/a', '<repo>/a/b'].
+            'repo_dirs': {
+                'type': 'keyword',
+                'index': True,
+            },
             'filename': {
                 'type': 'text',
                 'index': True,
@@ -45,6 +70,17 @@ class RepoFilesIndex(SeafileIndexBase):
                     },
                 },
             },
+            # prefixes of the filename for ``suggest_filenames``, in the scopes
+            # of ``repo_dirs``.
+            'filename_suggest': {
+                'type': 'completion',
+                'analyzer': 'seafile_file_name_suggest_analyzer',
+                'contexts': [{
+                    'name': 'repo_dirs',
+                    'type': 'category',
+                    'path': 'repo_dirs',
+                }],
+            },
             'suffix': {
                 'type': 'keyword',
                 'index': True,
@@ -63,13 +99,45 @@ class RepoFilesIndex(SeafileIndexBase):
             },
             'size': {
                 'type': 'long'
+            },
+            # id of the indexed file/dir object, returned with search results
+            # so callers can tell whether a hit is stale, and joined with
+            # ``repocontents`` when ``dedup_content`` is enabled.
+            'obj_id': {
+                'type': 'keyword',
+                'index': True,
             }
         },
     }
 
+    # Aggregations ``search_files_with_facets`` can return along with the hits.
+    FACETS = ('suffix', 'is_dir', 'size', 'mtime')
+    FACET_SUFFIX_SIZE = 20
+    FACET_SIZE_RANGES = (
+        ('lt_1m', None, 1024 * 1024),
+        ('1m_10m', 1024 * 1024, 10 * 1024 * 1024),
+        ('10m_100m', 10 * 1024 * 1024, 100 * 1024 * 1024),
+        ('gte_100m', 100 * 1024 * 1024, None),
+    )
+    # seconds covered by each bucket of the mtime histogram (30 days)
+    FACET_MTIME_INTERVAL = 30 * 24 * 3600
+
+    SUGGEST_ANALYZER = {
+        'seafile_file_name_suggest_analyzer': {
+            'type': 'custom',
+            'tokenizer': 'keyword',
+            'filter': [
+                'lowercase',
+            ],
+        }
+    }
+    # a filename is also suggested from the start of each of its words
+    SUGGEST_SEPARATORS = ' _-.'
+    SUGGEST_MAX_INPUTS = 10
+
     index_settings = {
         'analysis': {
-            'analyzer': {
+            'analyzer': dict({
                 'seafile_file_name_ngram_analyzer': {
                     'type': 'custom',
                     'tokenizer': 'seafile_file_name_ngram_tokenizer',
@@ -77,7 +145,7 @@ class RepoFilesIndex(SeafileIndexBase):
                         'lowercase',
                     ],
                 }
-            },
+            }, **SUGGEST_ANALYZER),
             'tokenizer': {
                 'seafile_file_name_ngram_tokenizer': {
                     'type': 'nGram',
@@ -97,6 +165,19 @@ class RepoFilesIndex(SeafileIndexBase):
         super(RepoFilesIndex, self).__init__(es)
         self.language_index_optimization()
         self.create_index_if_missing(index_settings=self.index_settings)
+        self.acl_index = RepoACLIndex(es) if seafes_config.acl_lookup else None
+        self.quarantine = None
+        self.contents_index = RepoContentsIndex(es) if seafes_config.dedup_content else None
+        self.search_cache = get_search_cache()
+
+    def prepare_indexing(self):
+        """Set up what only indexing files needs, the extraction quarantine
+        and the contents index, so that searches don't pay for it.
+        """
+        if seafes_config.extract_max_attempts > 0:
+            self.quarantine = ExtractQuarantineIndex(self.es, seafes_config.extract_max_attempts)
+        if self.contents_index:
+            self.contents_index.create_index_if_missing()
 
     def language_index_optimization(self):
         if seafes_config.lang:
@@ -107,7 +188,7 @@ class RepoFilesIndex(SeafileIndexBase):
             else:
                 # For chinese we don't need the ngram analyzer for file name.
                 self.MAPPING['properties']['filename'].pop('fields', None)
-                self.index_settings = {}
+                self.index_settings = {'analysis': {'analyzer': self.SUGGEST_ANALYZER}}
 
                 # Use the ik_smart analyzer to do coarse-grained chinese
                 # tokenization for search keywords.
@@ -119,6 +200,41 @@ class RepoFilesIndex(SeafileIndexBase):
     def is_chinese(self):
         return seafes_config.lang == 'chinese'
 
+    @staticmethod
+    def get_repo_dirs(repo_id, path, is_dir):
+        names = [e for e in path.split('/') if e]
+        if not is_dir:
+            names = names[:-1]
+        repo_dirs = [repo_id]
+        for name in names:
+            repo_dirs.append(repo_dirs[-1] + '/' + name)
+        return repo_dirs
+
+    @classmethod
+    def get_filename_suggest(cls, filename):
+        if not filename:
+            return None
+        # words of the suffix are not worth suggesting
+        stem_len = filename.rfind('.')
+        if stem_len <= 0:
+            stem_len = len(filename)
+        inputs = [filename]
+        for i in range(1, stem_len):
+            if filename[i - 1] in cls.SUGGEST_SEPARATORS and filename[i] not in cls.SUGGEST_SEPARATORS:
+                inputs.append(filename[i:])
+                if len(inputs) >= cls.SUGGEST_MAX_INPUTS:
+                    break
+        return {'input': inputs}
+
+    def upgrade_document(self, doc):
+        """Fill fields added to the mapping after ``doc`` was indexed.
+        """
+        if 'repo_dirs' not in doc:
+            doc['repo_dirs'] = self.get_repo_dirs(doc['repo'], doc['path'], doc.get('is_dir', False))
+        if 'filename_suggest' not in doc:
+            doc['filename_suggest'] = self.get_filename_suggest(doc.get('filename'))
+        return doc
+
     def add_files(self, repo_id, version, files):
         '''Index newly added files. For text files, also index their content.'''
         for path, obj_id, mtime, size in files:
@@ -135,10 +251,18 @@ class RepoFilesIndex(SeafileIndexBase):
     def add_file_to_index(self, repo_id, version, path, obj_id, mtime, size):
         """Add/update a file to/in index.
         """
-        extractor = ExtractorFactory.get_extractor(os.path.basename(path))
-        content = extractor.extract(repo_id, version, obj_id, path) if extractor else None
-        filename = os.path.basename(path)
+        if self.contents_index:
+            # the content is stored once per object in ``repocontents``
+            self.contents_index.add_file(repo_id, version, path, obj_id, self.quarantine)
+            content = None
+        else:
+            extractor = ExtractorFactory.get_extractor(os.path.basename(path), self.quarantine)
+            content = extractor.extract(repo_id, version, obj_id, path) if extractor else None
 
+        with index_stage_seconds.time(stage='es_write'):
+            self._write_file(repo_id, path, content, obj_id, mtime, size)
+
+    def _write_file(self, repo_id, path, content, obj_id, mtime, size):
         try:
             eid = self.find_file_eid(repo_id, path)
         except:
@@ -148,27 +272,44 @@ class RepoFilesIndex(SeafileIndexBase):
             raise
         if eid:
             # This file already exists in index, we update it
-            self.partial_update_file_content(eid, content, mtime, size)
+            self.partial_update_file_content(eid, content, mtime, size, obj_id)
         else:
             # This file does not exist in index
-            suffix = get_file_suffix(filename)
-
-            data = {
-                'repo': repo_id,
-                'path': path,
-                'filename': filename,
-                'suffix': suffix,
-                'content': content,
-                'is_dir': False,
-                'mtime': mtime,
-                'size': size,
-                # 'tags': get_repo_file_tags(repo_id, path),
-            }
             self.es.index(index=self.INDEX_NAME,
                           doc_type=self.MAPPING_TYPE,
-                          body=data,
+                          body=self.make_file_doc(repo_id, path, content, obj_id, mtime, size),
                           id=repo_id + path)
 
+    def make_file_doc(self, repo_id, path, content, obj_id, mtime, size):
+        filename = os.path.basename(path)
+        return {
+            'repo': repo_id,
+            'path': path,
+            'repo_dirs': self.get_repo_dirs(repo_id, path, False),
+            'filename': filename,
+            'filename_suggest': self.get_filename_suggest(filename),
+            'suffix': get_file_suffix(filename),
+            'content': content,
+            'is_dir': False,
+            'mtime': mtime,
+            'size': size,
+            'obj_id': obj_id,
+            # 'tags': get_repo_file_tags(repo_id, path),
+        }
+
+    def make_file_action(self, repo_id, path, content, obj_id, mtime, size):
+        """Return a bulk action adding the file, or updating it if it is
+        indexed already, without looking it up first.
+        """
+        return {
+            '_op_type': 'update',
+            '_index': self.INDEX_NAME,
+            '_type': self.MAPPING_TYPE,
+            '_id': repo_id + path,
+            'doc': self.make_file_doc(repo_id, path, content, obj_id, mtime, size),
+            'doc_as_upsert': True,
+        }
+
     def update_repo_name_index(self, repo_id, version, obj_id):
         if not repo_data.get_repo_name_mtime_size(repo_id):
             return
@@ -192,19 +333,23 @@ class RepoFilesIndex(SeafileIndexBase):
         data = {
             'repo': repo_id,
             'path': path,
+            'repo_dirs': self.get_repo_dirs(repo_id, path, True),
             'filename': filename,
+            'filename_suggest': self.get_filename_suggest(filename),
             'suffix': None,
             'content': None,
             'is_dir': True,
             'mtime': mtime,
-            'size': size
+            'size': size,
+            'obj_id': obj_id,
         }
-        self.es.index(
-            index=self.INDEX_NAME,
-            doc_type=self.MAPPING_TYPE,
-            body=data,
-            id=eid
-        )
+        with index_stage_seconds.time(stage='es_write'):
+            self.es.index(
+                index=self.INDEX_NAME,
+                doc_type=self.MAPPING_TYPE,
+                body=data,
+                id=eid
+            )
 
     def find_file_eid(self, repo_id, path):
         eid = repo_id + path
@@ -214,11 +359,12 @@ class RepoFilesIndex(SeafileIndexBase):
         except NotFoundError:
             return None
 
-    def partial_update_file_content(self, eid, content, mtime, size):
+    def partial_update_file_content(self, eid, content, mtime, size, obj_id=None):
         doc = {
             'content': content,
             'mtime': mtime,
-            'size': size
+            'size': size,
+            'obj_id': obj_id,
         }
 
         self.es.update(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=eid, body=dict(doc=doc))
@@ -260,6 +406,8 @@ class RepoFilesIndex(SeafileIndexBase):
 
         self.delete_by_repo(repo_id)
         self.refresh()
+        if self.contents_index:
+            self.contents_index.remove_repo(repo_id)
 
     def delete_by_repo(self, repo_id):
         """Delete all the docs of a repo.
@@ -270,9 +418,230 @@ class RepoFilesIndex(SeafileIndexBase):
             'term', repo=repo_id)
         s.delete()
 
-    def search_files(self, repos_map, search_path, keyword, obj_desc=None, start=0, size=10):
-        result = self.do_search(repos_map, search_path, keyword, obj_desc, start, size)
+    def search_files(self, repos_map, search_path, keyword, obj_desc=None, start=0, size=10,
+                     username=None):
+        ret, total, _, _ = self._search_files_cached(repos_map, search_path, keyword, obj_desc,
+                                                     start, size, username)
+        return ret, total
+
+    def search_files_by_cursor(self, repos_map, search_path, keyword, obj_desc=None, cursor=None,
+                               size=10, username=None):
+        """Like ``search_files``, but pages with an opaque cursor instead of
+        an offset, so the cost of a page does not grow with its depth.
 
+        Pass ``cursor=None`` for the first page, then the returned cursor for
+        each following page. Returns ``(results, total, next_cursor)``,
+        ``next_cursor`` is None after the last page.
+        """
+        ret, total, next_cursor, _ = self._search_files_cached(
+            repos_map, search_path, keyword, obj_desc, cursor or '', size, username, by_cursor=True)
+        return ret, total, next_cursor
+
+    def search_files_with_facets(self, repos_map, search_path, keyword, obj_desc=None, start=0,
+                                 size=10, username=None, facets=FACETS):
+        """Like ``search_files``, and also count the matching entries by
+        each of ``facets`` in the same request.
+
+        Returns ``(results, total, facets)``, where ``facets`` maps each facet
+        name to a list of buckets ``{'key': ..., 'count': ...}``. The buckets
+        of ``size`` and ``mtime`` also have ``range``, which can be passed
+        back as ``size_range``/``time_range`` in ``obj_desc``. ``mtime`` is a
+        histogram of ``FACET_MTIME_INTERVAL`` buckets, oldest first, keyed
+        by the start of the bucket; empty buckets are left out.
+        """
+        facets = [f for f in facets if f in self.FACETS]
+        ret, total, _, facets = self._search_files_cached(repos_map, search_path, keyword, obj_desc,
+                                                          start, size, username, facets=facets)
+        return ret, total, facets
+
+    @staticmethod
+    def encode_cursor(sort_values):
+        data = json.dumps(sort_values, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (ValueError, TypeError, UnicodeError):
+            raise ValueError('invalid search cursor: %s' % cursor)
+        if not isinstance(sort_values, list):
+            raise ValueError('invalid search cursor: %s' % cursor)
+        return sort_values
+
+    def _search_files_cached(self, repos_map, search_path, keyword, obj_desc, start, size, username,
+                             by_cursor=False, facets=None):
+        self._clean_repos_map(repos_map)
+        cache_key = self._get_cache_key(repos_map, search_path, keyword, obj_desc, start, size, facets)
+        if cache_key:
+            cached = self.search_cache.get(cache_key)
+            if cached is not None:
+                return cached[0], cached[1], cached[2], cached[3]
+
+        if by_cursor:
+            search_after = self.decode_cursor(start) if start else []
+            ret, total, next_cursor, facets_ret = self._search_files(
+                repos_map, search_path, keyword, obj_desc, 0, size, username, search_after)
+        else:
+            ret, total, next_cursor, facets_ret = self._search_files(
+                repos_map, search_path, keyword, obj_desc, start, size, username, facets=facets)
+
+        if cache_key:
+            self._set_cache(cache_key, repos_map, (ret, total, next_cursor, facets_ret))
+        return ret, total, next_cursor, facets_ret
+
+    def _get_cache_key(self, repos_map, search_path, keyword, obj_desc, start, size, facets=None):
+        if not self.search_cache:
+            return None
+        scopes_digest = RepoACLIndex.get_digest(sorted(repos_map.keys()) + RepoACLIndex.make_scopes(repos_map))
+        return self.search_cache.make_key(scopes_digest, search_path, keyword, obj_desc, start, size,
+                                          facets)
+
+    def _set_cache(self, cache_key, repos_map, value):
+        repo_ids = set(repos_map.keys())
+        repo_ids.update(repo.origin_repo_id for repo in repos_map.values() if repo.origin_repo_id)
+        self.search_cache.set(cache_key, value, sorted(repo_ids))
+
+    def suggest_filenames(self, repos_map, prefix, search_path=None, size=10):
+        """Return the entries whose filename (or a word in it) starts with
+        ``prefix``, for search-as-you-type.
+
+        It's served by the completion suggester, which is much cheaper than
+        ``search_files``, and only restricted to ``repos_map`` and
+        ``search_path``: no other filters, content matching or highlighting.
+        """
+        prefix = prefix.strip()
+        self._clean_repos_map(repos_map)
+        if not prefix or not repos_map:
+            return []
+
+        body = {
+            '_source': ['repo', 'path', 'filename', 'is_dir'],
+            'suggest': {
+                'filename': {
+                    'prefix': prefix,
+                    'completion': {
+                        'field': 'filename_suggest',
+                        'size': size,
+                        'contexts': {
+                            'repo_dirs': self._get_suggest_contexts(repos_map, search_path),
+                        },
+                    },
+                },
+            },
+        }
+        logger.debug(body)
+        start = time.time()
+        resp = self.es.search(index=self.INDEX_NAME, body=body)
+        record_search('suggest', body, time.time() - start, resp.get('took'), len(repos_map))
+
+        ret = []
+        for suggestion in resp.get('suggest', {}).get('filename', []):
+            for option in suggestion.get('options', []):
+                d = option['_source']
+                ret.append({
+                    'repo_id': d['repo'],
+                    'fullpath': d['path'],
+                    'name': d['filename'],
+                    'is_dir': d.get('is_dir', False),
+                })
+        return ret
+
+    def _get_suggest_contexts(self, repos_map, search_path):
+        if len(repos_map) == 1 and search_path and search_path.strip('/'):
+            repo = list(repos_map.values())[0]
+            if repo.origin_repo_id:
+                scope = repo.origin_repo_id + repo.origin_path.rstrip('/')
+            else:
+                scope = repo.id
+            return [scope + '/' + search_path.strip('/')]
+        return RepoACLIndex.make_scopes(repos_map)
+
+    def search_files_multi(self, scopes, keyword, obj_desc=None, start=0, size=10, username=None):
+        """Search ``keyword`` in several scopes with one ``_msearch`` request.
+
+        Each scope is a dict with ``repos_map`` and optionally
+        ``search_path`` and ``obj_desc`` (defaults to the shared
+        ``obj_desc``), e.g. the current folder, the current library and all
+        libraries of the user.
+
+        Returns a list with one dict per scope, in the same order:
+        ``{'results': [...], 'total': N, 'error': None}``. A scope that fails
+        gets an empty result and the error message, without affecting the
+        other scopes.
+        """
+        out = [None] * len(scopes)
+        pending = [] # (index in scopes, cache key, repos_map, page search)
+        for i, scope in enumerate(scopes):
+            try:
+                repos_map = scope['repos_map']
+                search_path = scope.get('search_path', None)
+                scope_desc = scope.get('obj_desc', obj_desc)
+                self._clean_repos_map(repos_map)
+                cache_key = self._get_cache_key(repos_map, search_path, keyword, scope_desc, start, size)
+                if cache_key:
+                    cached = self.search_cache.get(cache_key)
+                    if cached is not None:
+                        out[i] = {'results': cached[0], 'total': cached[1], 'error': None}
+                        continue
+                _, page_search = self._build_page_search(repos_map, search_path, keyword, scope_desc,
+                                                         start, size, username)
+                page_search = self._add_highlight(page_search, seafes_config.highlight)
+                pending.append((i, cache_key, repos_map, page_search))
+            except Exception as e:
+                logger.warning('failed to build search of scope %d: %s', i, e)
+                out[i] = self._make_scope_error(e)
+
+        if not pending:
+            return out
+
+        body = []
+        for _, _, _, page_search in pending:
+            if should_profile():
+                page_search = page_search.extra(profile=True)
+            body.append({'index': self.INDEX_NAME})
+            body.append(page_search.to_dict())
+        logger.debug(body)
+        start = time.time()
+        try:
+            responses = self.es.msearch(body=body)['responses']
+        except Exception as e:
+            logger.warning('failed to run multi search: %s', e)
+            for i, _, _, _ in pending:
+                out[i] = self._make_scope_error(e)
+            return out
+        took = max(resp.get('took', 0) for resp in responses) if responses else None
+        profiles = [resp['profile'] for resp in responses if 'profile' in resp]
+        record_search('multi', body, time.time() - start, took,
+                      sum(len(p[2]) for p in pending), profiles or None)
+
+        for (i, cache_key, repos_map, page_search), resp in zip(pending, responses):
+            if resp.get('error'):
+                error = resp['error']
+                logger.warning('search of scope %d failed: %s', i, error)
+                out[i] = {'results': [], 'total': 0,
+                          'error': error.get('reason', str(error)) if isinstance(error, dict) else str(error)}
+                continue
+            result = Response(page_search, resp)
+            if self.contents_index:
+                self._add_content_highlights(result, keyword, repos_map)
+            ret, total, next_cursor, facets_ret = self._parse_result(result, size)
+            if cache_key:
+                self._set_cache(cache_key, repos_map, (ret, total, next_cursor, facets_ret))
+            out[i] = {'results': ret, 'total': total, 'error': None}
+        return out
+
+    @staticmethod
+    def _make_scope_error(e):
+        return {'results': [], 'total': 0, 'error': str(e)}
+
+    def _search_files(self, repos_map, search_path, keyword, obj_desc, start, size, username,
+                      search_after=None, facets=None):
+        result = self.do_search(repos_map, search_path, keyword, obj_desc, start, size, username,
+                                search_after, facets)
+        return self._parse_result(result, size, search_after, facets)
+
+    def _parse_result(self, result, size, search_after=None, facets=None):
         def get_entries(result):
             def _expand(v):
                 return v[0] if isinstance(v, list) else v
@@ -308,11 +677,77 @@ class RepoFilesIndex(SeafileIndexBase):
                 'score': entry['_score'],
                 'content_highlight': content_highlight,
                 'is_dir': is_dir,
+                'mtime': d.get('mtime', None),
+                'size': d.get('size', None),
+                'suffix': d.get('suffix', None),
+                # stale-check token, None for entries indexed before it was
+                # recorded, see ``seafes.freshness``.
+                'obj_id': d.get('obj_id', None),
             }
             ret.append(r)
-        return ret, total
 
-    def _make_keyword_query(self, keyword):
+        next_cursor = None
+        hits = result.hits.hits
+        if search_after is not None and hits and len(hits) == size:
+            next_cursor = self.encode_cursor(hits[-1]['sort'])
+
+        facets_ret = self._get_facets(result, facets) if facets else None
+        return ret, total, next_cursor, facets_ret
+
+    def _add_facets(self, search, facets):
+        """Add the aggregations of ``facets`` to ``search`` in place."""
+        if 'suffix' in facets:
+            search.aggs.bucket('suffix', 'terms', field='suffix', size=self.FACET_SUFFIX_SIZE)
+        if 'is_dir' in facets:
+            search.aggs.bucket('is_dir', 'terms', field='is_dir')
+        if 'size' in facets:
+            ranges = [self._make_agg_range(key, lo, hi) for key, lo, hi in self.FACET_SIZE_RANGES]
+            search.aggs.bucket('size', 'range', field='size', ranges=ranges)
+        if 'mtime' in facets:
+            # mtime is indexed in seconds into a date field, which reads them
+            # as milliseconds, so the interval is given in "milliseconds" too
+            # and the keys are seconds, the same unit as ``time_range``.
+            search.aggs.bucket('mtime', 'date_histogram', field='mtime',
+                               interval='%dms' % self.FACET_MTIME_INTERVAL, min_doc_count=1)
+        return search
+
+    @staticmethod
+    def _make_agg_range(key, lo, hi):
+        r = {'key': key}
+        if lo is not None:
+            r['from'] = lo
+        if hi is not None:
+            r['to'] = hi
+        return r
+
+    def _get_facets(self, result, facets):
+        aggs = result.to_dict().get('aggregations', {})
+        ret = {}
+        for name in facets:
+            buckets = aggs.get(name, {}).get('buckets', [])
+            if name == 'is_dir':
+                ret[name] = [{'key': b.get('key_as_string') == 'true', 'count': b['doc_count']}
+                             for b in buckets]
+            elif name == 'mtime':
+                ret[name] = [{'key': int(b['key']),
+                              'range': [int(b['key']), int(b['key']) + self.FACET_MTIME_INTERVAL - 1],
+                              'count': b['doc_count']}
+                             for b in buckets]
+            elif name == 'size':
+                ret[name] = [{'key': b['key'],
+                              'range': [self._get_range_bound(b.get('from')),
+                                        self._get_range_bound(b.get('to'))],
+                              'count': b['doc_count']}
+                             for b in buckets]
+            else:
+                ret[name] = [{'key': b['key'], 'count': b['doc_count']} for b in buckets]
+        return ret
+
+    @staticmethod
+    def _get_range_bound(value):
+        return int(value) if value is not None else None
+
+    def _make_keyword_query(self, keyword, fields=('filename', 'content')):
         match_query_kwargs = {'minimum_should_match': '-25%'}
 
         def _make_match_query(field, key_word, **kw):
@@ -330,15 +765,15 @@ class RepoFilesIndex(SeafileIndexBase):
             match_query_kwargs['analyzer'] = 'ik_smart'
             phrase_list = keyword.split(' ')
             for phrase in phrase_list:
-                if phrase.startswith('"') and phrase.endswith('"') or phrase.startswith('“') and phrase.endswith('”'):
-                    searches.append(_make_phrase_match_query('filename', phrase, **match_query_kwargs))
-                    searches.append(_make_phrase_match_query('content', phrase, **match_query_kwargs))
-                else:
-                    searches.append(_make_match_query('filename', phrase, **match_query_kwargs))
-                    searches.append(_make_match_query('content', phrase, **match_query_kwargs))
+                for field in fields:
+                    if phrase.startswith('"') and phrase.endswith('"') or phrase.startswith('“') and phrase.endswith('”'):
+                        searches.append(_make_phrase_match_query(field, phrase, **match_query_kwargs))
+                    else:
+                        searches.append(_make_match_query(field, phrase, **match_query_kwargs))
         else:
-            searches.append(_make_match_query('filename', keyword, **match_query_kwargs))
-            searches.append(_make_match_query('content', keyword, **match_query_kwargs))
+            for field in fields:
+                searches.append(_make_match_query(field, keyword, **match_query_kwargs))
+        if not self.is_chinese() and 'filename' in fields:
             # See https://www.elastic.co/guide/en/elasticsearch/guide/2.x/ngrams-compound-words.html
             # for how to specify the ngram minimum_should_match in a match query.
             search_in_file_name_ngram = Q({
@@ -353,6 +788,11 @@ class RepoFilesIndex(SeafileIndexBase):
 
         return Q('bool', should=searches)
 
+    def _clean_repos_map(self, repos_map):
+        for key in list(repos_map.keys()):
+            if not repos_map[key] or not hasattr(repos_map[key], 'origin_repo_id'):
+                repos_map.pop(key)
+
     def _add_repo_filter(self, search, repo_id):
         search = search.filter('term', repo=repo_id)
         return search
@@ -384,6 +824,32 @@ class RepoFilesIndex(SeafileIndexBase):
 
         return search
 
+    def _add_acl_lookup_filter(self, search, repos_map, username):
+        if not self._is_repo_dirs_mapped():
+            # an index created before ``repo_dirs``, until it is migrated
+            return self._add_repos_filter(search, repos_map)
+        scopes = RepoACLIndex.make_scopes(repos_map)
+        doc_id = self.acl_index.ensure_user_acl(username, scopes)
+        return search.filter('terms', repo_dirs=self.acl_index.get_lookup(doc_id))
+
+    def _is_repo_dirs_mapped(self):
+        global _repo_dirs_mapped, _repo_dirs_checked_until
+        with _repo_dirs_lock:
+            if time.time() < _repo_dirs_checked_until:
+                return _repo_dirs_mapped
+            resp = self.es.indices.get_field_mapping(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE,
+                                                     fields='repo_dirs')
+            mapped = bool(resp) and all(
+                index.get('mappings', {}).get(self.MAPPING_TYPE, {}).get('repo_dirs', {})
+                .get('mapping', {}).get('repo_dirs', {}).get('type') == 'keyword'
+                for index in resp.values())
+            if not mapped and _repo_dirs_mapped is not False:
+                logger.warning('repo_dirs is not mapped in %s, search without acl_lookup '
+                               'until it is migrated (index_local migrate)', self.INDEX_NAME)
+            _repo_dirs_mapped = mapped
+            _repo_dirs_checked_until = time.time() + REPO_DIRS_CHECK_INTERVAL
+            return mapped
+
     def _add_suffix_filter(self, search, suffixes):
         if suffixes:
             if isinstance(suffixes, list):
@@ -439,16 +905,9 @@ class RepoFilesIndex(SeafileIndexBase):
         search = search.filter('range', size=search_content)
         return search
 
-    def do_search(self, repos_map, search_path, keyword, obj_desc, start, size):
-        """Search files with providing ``keyword``.
-
-        Arguments:
-        - `self`:
-        - `repos_map`: A directory of repo_id and repo_obj.
-        - `keyword`: A search keyword provided by user.
-        - `suffixes`: A list of file suffixes need to be searched.
-        - `start`: How many initial results should be skipped.
-        - `size`:  How many results should be returned.
+    def build_search(self, repos_map, search_path, keyword, obj_desc, username=None):
+        """Build the search of ``keyword`` in ``repos_map``, with all filters
+        applied but without pagination and highlighting.
         """
         if isinstance(obj_desc, dict):
             suffixes = obj_desc.get('suffixes', None)
@@ -464,9 +923,10 @@ class RepoFilesIndex(SeafileIndexBase):
         search = Search(using=self.es, index=self.INDEX_NAME)
 
         # clean invalid repo
-        for key in list(repos_map.keys()):
-            if not repos_map[key] or not hasattr(repos_map[key], 'origin_repo_id'):
-                repos_map.pop(key)
+        self._clean_repos_map(repos_map)
+
+        # whether the search is narrower than whole repos and suffixes
+        scoped = self.is_valid_range(time_range) or self.is_valid_range(size_range)
 
         # Constraints on the search environment
         if len(repos_map) == 1:
@@ -478,11 +938,16 @@ class RepoFilesIndex(SeafileIndexBase):
 
             search = self._add_repo_filter(search, repo_id)
             search = self._add_path_filter(search, search_path)
+            scoped = scoped or bool(search_path)
         elif len(repos_map) > 1:
-            search = self._add_repos_filter(search, repos_map)
+            if self.acl_index and username:
+                search = self._add_acl_lookup_filter(search, repos_map, username)
+                scoped = True
+            else:
+                search = self._add_repos_filter(search, repos_map)
+                scoped = scoped or any(repo.origin_repo_id for repo in repos_map.values())
 
         # Constraints on what you're searching for
-        keyword_query = self._make_keyword_query(keyword)
         search = self._add_suffix_filter(search, suffixes)
         search = self._add_obj_type_filter(search, obj_type)
 
@@ -490,16 +955,186 @@ class RepoFilesIndex(SeafileIndexBase):
 
         search = self._add_size_range_filter(search, size_range)
 
-        search = search.query(keyword_query).source(
-            include=['repo', 'path', 'filename', 'is_dir'])[start:start + size]
+        keyword_query = self._make_keyword_query(keyword)
+        if self.contents_index and obj_type != 'dir':
+            content_query = self._make_content_objects_query(keyword, repos_map, suffixes,
+                                                             search if scoped else None)
+            if content_query is not None:
+                keyword_query = Q('bool', should=keyword_query.should + [content_query])
+
+        return search.query(keyword_query)
+
+    def _make_content_objects_query(self, keyword, repos_map, suffixes, scope_search=None):
+        """With ``dedup_content``, find the objects in ``repocontents`` whose
+        content matches ``keyword``, and return a query matching the entries
+        of those objects, each scored by its content match. Return None if no
+        content matches.
+
+        Only the best ``dedup_max_content_hits`` objects are looked for. For
+        a search of whole repos they are looked for in the repos and with the
+        suffixes searched. ``scope_search`` is the filtered search of a
+        narrower scope (a path, a virtual repo, shared dirs, time or size
+        ranges): the objects are looked for among the ones of the files in
+        the scope, unless it has more than ``dedup_max_scope_objects``.
+        """
+        query = self._make_keyword_query(keyword, fields=('content',))
+        if scope_search is not None:
+            obj_ids = self._get_scope_objects(scope_search, repos_map)
+            if obj_ids is not None:
+                if not obj_ids:
+                    return None
+                objects = self.contents_index.search_objects(query, seafes_config.dedup_max_content_hits,
+                                                             obj_ids=obj_ids)
+                return self._make_objects_query(objects)
+
+        if suffixes and not isinstance(suffixes, list):
+            suffixes = [suffixes]
+        repo_ids = sorted(set(repo.origin_repo_id or repo.id for repo in repos_map.values()))
+        objects = self.contents_index.search_objects(
+            query, seafes_config.dedup_max_content_hits, repo_ids=repo_ids,
+            suffixes=[x.lower() for x in suffixes] if suffixes else None)
+        return self._make_objects_query(objects)
+
+    def _get_scope_objects(self, scope_search, repos_map):
+        """Return the object ids of the files matched by ``scope_search``,
+        None if there are more than ``dedup_max_scope_objects``.
+        """
+        search = scope_search.filter('term', is_dir=False)[0:0]
+        search.aggs.bucket('objects', 'terms', field='obj_id', size=seafes_config.dedup_max_scope_objects)
+        resp = self._execute(search, 'content_scope', repos_map)
+        objects = resp.aggregations.objects
+        if objects.sum_other_doc_count:
+            logger.debug('more than %d objects in the search scope, look for content in whole repos',
+                         seafes_config.dedup_max_scope_objects)
+            return None
+        return [b.key for b in objects.buckets]
+
+    @staticmethod
+    def _make_objects_query(objects):
+        if not objects:
+            return None
+        return Q('bool', should=[Q('constant_score', filter=Q('term', obj_id=obj_id), boost=score)
+                                 for obj_id, score in objects])
+
+    def _add_content_highlights(self, resp, keyword, repos_map):
+        """With ``dedup_content``, highlight the content of the hits of
+        ``resp`` from ``repocontents``, in place.
+        """
+        hits = resp.hits.hits
+        obj_ids = sorted(set(e.get('_source', {}).get('obj_id') for e in hits) - set([None]))
+        if not obj_ids:
+            return
 
-        search = search.highlight('content', type=seafes_config.highlight).highlight_options(
+        if seafes_config.two_phase_search:
+            highlight = lambda search: self._add_highlight(
+                search, 'fvh',
+                fragment_size=seafes_config.highlight_fragment_size,
+                number_of_fragments=seafes_config.highlight_fragments)
+        else:
+            highlight = lambda search: self._add_highlight(search, seafes_config.highlight)
+        highlights = self.contents_index.get_highlights(
+            self._make_keyword_query(keyword, fields=('content',)), obj_ids, highlight, len(repos_map))
+
+        for e in hits:
+            fragments = highlights.get(e.get('_source', {}).get('obj_id'))
+            if fragments and not e.get('highlight', {}).get('content'):
+                e['highlight'] = dict(e.get('highlight', {}), content=fragments)
+
+    def _add_highlight(self, search, highlighter, **kw):
+        return search.highlight('content', type=highlighter, **kw).highlight_options(
             pre_tags=['<b>'],
             post_tags=['</b>'],
             encoder='html',
             require_field_match=True
         )
 
+    def do_search(self, repos_map, search_path, keyword, obj_desc, start, size, username=None,
+                  search_after=None, facets=None):
+        """Search files with providing ``keyword``.
+
+        Arguments:
+        - `self`:
+        - `repos_map`: A directory of repo_id and repo_obj.
+        - `keyword`: A search keyword provided by user.
+        - `suffixes`: A list of file suffixes need to be searched.
+        - `start`: How many initial results should be skipped.
+        - `size`:  How many results should be returned.
+        - `username`: The user who searches. When ``acl_lookup`` is enabled
+          the repos of the user are referenced by a terms lookup.
+        - `search_after`: Sort values of the last hit of the previous page.
+          When given (``[]`` for the first page), results are paged with
+          ``search_after`` and ``start`` is ignored.
+        - `facets`: Names of aggregations in ``FACETS`` to compute over all
+          the matching entries.
+        """
+        search, page_search = self._build_page_search(repos_map, search_path, keyword, obj_desc,
+                                                      start, size, username, search_after, facets)
+
+        if seafes_config.two_phase_search:
+            resp = self._do_two_phase_search(search, page_search, repos_map)
+        else:
+            search = self._add_highlight(page_search, seafes_config.highlight)
+            resp = self._execute(search, 'search', repos_map)
+
+        if self.contents_index:
+            self._add_content_highlights(resp, keyword, repos_map)
+        return resp
+
+    def _execute(self, search, api, repos_map):
+        """Execute ``search``, recording its latency, and logging it when it
+        is slow (see ``seafes.search_log``).
+        """
+        if should_profile():
+            search = search.extra(profile=True)
         logger.debug(search.to_dict())
+        start = time.time()
         resp = search.execute()
+        record_search(api, search, time.time() - start, resp.took, len(repos_map),
+                      resp.to_dict().get('profile'))
+        return resp
+
+    def _build_page_search(self, repos_map, search_path, keyword, obj_desc, start, size, username=None,
+                           search_after=None, facets=None):
+        """Return the filtered search and the search of the requested page,
+        see ``do_search`` for the arguments.
+        """
+        search = self.build_search(repos_map, search_path, keyword, obj_desc, username)
+        search = search.source(include=['repo', 'path', 'filename', 'is_dir', 'mtime', 'size',
+                                        'suffix', 'obj_id'])
+
+        if search_after is None:
+            page_search = search[start:start + size]
+        else:
+            # _uid breaks ties between equal scores, ES 5 can't sort on _id.
+            page_search = search.sort({'_score': {'order': 'desc'}}, {'_uid': {'order': 'asc'}})[0:size]
+            if search_after:
+                page_search = page_search.extra(search_after=search_after)
+
+        if facets:
+            page_search = self._add_facets(page_search, facets)
+        return search, page_search
+
+    def _do_two_phase_search(self, search, page_search, repos_map):
+        """Rank without highlighting first, then highlight only the hits of
+        the returned page with the fast vector highlighter, which uses the
+        term vectors of ``content`` instead of re-analyzing it.
+        """
+        resp = self._execute(page_search, 'rank', repos_map)
+
+        hits = resp.hits.hits
+        if not hits:
+            return resp
+
+        ids = [e['_id'] for e in hits]
+        highlight_search = search.filter('ids', values=ids).source(False)[0:len(ids)]
+        highlight_search = self._add_highlight(
+            highlight_search, 'fvh',
+            fragment_size=seafes_config.highlight_fragment_size,
+            number_of_fragments=seafes_config.highlight_fragments)
+
+        highlight_resp = self._execute(highlight_search, 'highlight', repos_map)
+
+        highlights = dict((e['_id'], e.get('highlight', {})) for e in highlight_resp.hits.hits)
+        for e in hits:
+            e['highlight'] = highlights.get(e['_id'], {})
         return resp
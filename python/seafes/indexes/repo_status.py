@@ -1,10 +1,13 @@
 # coding: utf8
+import time
 import logging
+import threading
 
 from elasticsearch.exceptions import NotFoundError
 from elasticsearch.helpers import scan
 
 from .base import SeafileIndexBase
+from ..search_cache import get_search_cache
 
 logger = logging.getLogger('seafes')
 
@@ -30,6 +33,20 @@ class RepoStatusIndex(SeafileIndexBase):
 
     The elasticsearch document id for each repo in repo_head index is its repo
     id.
+
+    With ``flush_interval`` > 0, status changes are buffered and written with
+    bulk requests, without refreshing the index, instead of one update and
+    one refresh each. Status reads are realtime gets, which don't need a
+    refresh, and see the buffered changes. ``begin_update_repo`` returns once
+    (2) is stored, before the repo is touched: when no flush is running it
+    flushes at once, otherwise it waits for the running flush and the next
+    one writes all the changes buffered meanwhile (group commit).
+    ``finish_update_repo`` returns at once, its change is written with the
+    next flush, at the latest after ``flush_interval`` seconds: if the
+    process dies before, the repo is left in (2) and recovered by the next
+    update. Call ``flush`` before exiting. ``get_all_repos_from_index`` and
+    ``get_all_repo_status`` scan the index, which is not realtime, so they
+    refresh it first.
     '''
 
     INDEX_NAME = 'repo_head'
@@ -54,9 +71,23 @@ class RepoStatusIndex(SeafileIndexBase):
         },
     }
 
-    def __init__(self, es):
+    def __init__(self, es, flush_interval=0):
         super(RepoStatusIndex, self).__init__(es)
         self.create_index_if_missing()
+        self.search_cache = get_search_cache()
+
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = {} # repo_id -> doc, to be written by the next flush
+        self._writing = {} # the docs being written by the running flush
+        self._flushing = False
+        self._batch = 0 # number of the batch collected in ``_pending``
+        self._written = -1 # number of the last batch written
+        self._failed = {} # batch number -> error, for the waiting begin_update_repo
+        if flush_interval > 0:
+            t = threading.Thread(target=self._flush_loop, name='repo_status_flush')
+            t.daemon = True
+            t.start()
 
     def get_repo_status(self, repo_id):
         """Query status of a repo form ``repo_head`` index, add this repo if
@@ -70,12 +101,14 @@ class RepoStatusIndex(SeafileIndexBase):
             A ``RepoStatus`` instance and a flag indicates whether this repo
             is corrupted.
         """
-        try:
-            # we use repo_id as the doucment id of repo_head index
-            doc = self.es.get(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=repo_id)
-            doc = doc['_source']
-        except NotFoundError:
-            doc = None
+        doc = self._get_buffered(repo_id)
+        if doc is None:
+            try:
+                # we use repo_id as the doucment id of repo_head index
+                doc = self.es.get(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=repo_id)
+                doc = doc['_source']
+            except NotFoundError:
+                doc = None
 
         commit_id = updatingto = None
         if doc is not None:
@@ -88,6 +121,10 @@ class RepoStatusIndex(SeafileIndexBase):
             'commit': None,
             'updatingto': None
         }
+        if self.flush_interval > 0:
+            with self._cond:
+                self._pending.setdefault(repo_id, data)
+            return RepoStatus(repo_id, commit_id, updatingto)
         try:
             self.es.index(
                 index=self.INDEX_NAME,
@@ -107,6 +144,9 @@ class RepoStatusIndex(SeafileIndexBase):
             'commit': old_commit_id,
             'updatingto': new_commit_id,
         }
+        if self.flush_interval > 0:
+            self._wait_written(self._buffer(repo_id, doc))
+            return
         self.es.update(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=repo_id, body=dict(doc=doc))
         self.refresh()
 
@@ -115,22 +155,143 @@ class RepoStatusIndex(SeafileIndexBase):
             'commit': commit_id,
             'updatingto': None,
         }
+        if self.flush_interval > 0:
+            # the search cache is invalidated when it is written
+            self._buffer(repo_id, doc)
+            return
         self.es.update(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=repo_id, body=dict(doc=doc))
         self.refresh()
+        if self.search_cache:
+            self.search_cache.invalidate_repo(repo_id)
+
+    def _get_buffered(self, repo_id):
+        with self._cond:
+            doc = self._pending.get(repo_id) or self._writing.get(repo_id)
+            return dict(doc) if doc is not None else None
+
+    def _buffer(self, repo_id, doc):
+        """Buffer ``doc`` of ``repo_id``, replacing a buffered one, and
+        return the number of the batch it will be written with.
+        """
+        with self._cond:
+            self._pending[repo_id] = doc
+            return self._batch
+
+    def _wait_written(self, batch):
+        while True:
+            with self._cond:
+                while self._written < batch and self._flushing:
+                    self._cond.wait()
+                if self._written >= batch:
+                    error = self._failed.get(batch)
+                    break
+                # no flush is running, write the batch now, together with
+                # the changes buffered by the other threads meanwhile
+                batch_docs = self._take_pending()
+            try:
+                self._write(*batch_docs)
+            except Exception:
+                pass # recorded in ``_failed``
+        if error is not None:
+            raise error
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning('failed to write repo status: %s', e)
+
+    def flush(self):
+        """Write the buffered status changes with one bulk request.
+        """
+        with self._cond:
+            while self._flushing:
+                # buffered docs must not be written before the running flush
+                self._cond.wait()
+            batch_docs = self._take_pending()
+        self._write(*batch_docs)
+
+    def _take_pending(self):
+        # called with ``_cond`` held
+        self._flushing = True
+        batch = self._batch
+        self._batch += 1
+        self._writing, self._pending = self._pending, {}
+        return batch, self._writing
+
+    def _write(self, batch, docs):
+        error = None
+        try:
+            if docs:
+                self.bulk([{
+                    '_op_type': 'update',
+                    '_index': self.INDEX_NAME,
+                    '_type': self.MAPPING_TYPE,
+                    '_id': repo_id,
+                    'doc': doc,
+                    'doc_as_upsert': True,
+                } for repo_id, doc in docs.items()])
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            self._writing = {}
+            self._flushing = False
+            if error is not None:
+                # retried by the next flush, unless changed since
+                for repo_id, doc in docs.items():
+                    self._pending.setdefault(repo_id, doc)
+                self._failed[batch] = error
+            self._failed.pop(batch - 100, None)
+            self._written = max(self._written, batch)
+            self._cond.notify_all()
+
+        if error is not None:
+            raise error
+        if self.search_cache:
+            for repo_id, doc in docs.items():
+                if doc['updatingto'] is None:
+                    self.search_cache.invalidate_repo(repo_id)
 
     def delete_repo(self, repo_id):
         if len(repo_id) != 36:
             return
 
+        with self._cond:
+            # a buffered status would add the repo back when it is written
+            while repo_id in self._writing:
+                self._cond.wait()
+            self._pending.pop(repo_id, None)
+
         self.es.delete(index=self.INDEX_NAME, doc_type=self.MAPPING_TYPE, id=repo_id)
         self.refresh()
+        if self.search_cache:
+            self.search_cache.invalidate_repo(repo_id)
 
         logger.debug('delete_repo called on %s', repo_id)
 
     def get_all_repos_from_index(self):
+        # buffered writes don't refresh the index, and scan is not realtime
+        self.refresh()
         resp = scan(self.es,
                 query={"query": {"match_all": {}}},
                 index=self.INDEX_NAME,
                 doc_type=self.MAPPING_TYPE
         )
         return [{'id': entry['_id']} for entry in resp]
+
+    def get_all_repo_status(self):
+        self.refresh()
+        resp = scan(self.es,
+                query={"query": {"match_all": {}}},
+                index=self.INDEX_NAME,
+                doc_type=self.MAPPING_TYPE
+        )
+        ret = {}
+        for entry in resp:
+            doc = entry.get('_source', {})
+            ret[entry['_id']] = RepoStatus(entry['_id'], doc.get('commit', None),
+                                           doc.get('updatingto', None))
+        return ret
@@ -0,0 +1,242 @@
+# coding: UTF-8
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger('seafes')
+
+
+class Counter(object):
+    '''Monotonic counter, labelled like a prometheus counter.
+    '''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} # label values -> value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, _escape_help(self.documentation)),
+            '# TYPE %s counter' % self.name,
+        ]
+        for key, value in sorted(self.collect().items()):
+            lines.append('%s%s %r' % (self.name, _format_labels(list(zip(self.labelnames, key))), float(value)))
+        return '\n'.join(lines)
+
+
+class Gauge(object):
+    '''Value that goes up and down. Instead of being set, it can read its
+    value from a function each time it is collected, e.g. the size of a queue.
+    '''
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._value = 0
+        self._func = None
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, func):
+        self._func = func
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def collect(self):
+        func = self._func
+        if func is not None:
+            try:
+                return func()
+            except Exception as e:
+                logger.debug('failed to collect %s: %s', self.name, e)
+                return None
+        with self._lock:
+            return self._value
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, _escape_help(self.documentation)),
+            '# TYPE %s gauge' % self.name,
+        ]
+        value = self.collect()
+        if value is not None:
+            lines.append('%s %r' % (self.name, float(value)))
+        return '\n'.join(lines)
+
+
+class Histogram(object):
+    '''Latency histogram with cumulative buckets, labelled like a prometheus
+    histogram.
+    '''
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {} # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = data
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][i] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            return dict((key, (list(data[0]), data[1], data[2]))
+                        for key, data in self._values.items())
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, _escape_help(self.documentation)),
+            '# TYPE %s histogram' % self.name,
+        ]
+        for key, (buckets, total, count) in sorted(self.collect().items()):
+            labels = list(zip(self.labelnames, key))
+            for bound, value in zip(self.buckets, buckets):
+                lines.append('%s_bucket%s %d' % (self.name, _format_labels(labels + [('le', repr(float(bound)))]), value))
+            lines.append('%s_bucket%s %d' % (self.name, _format_labels(labels + [('le', '+Inf')]), count))
+            lines.append('%s_sum%s %r' % (self.name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), count))
+        return '\n'.join(lines)
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape_label(value)) for name, value in labels)
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def _get_metric(cls, name, *args, **kw):
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, *args, **kw)
+        elif not isinstance(_metrics[name], cls):
+            raise ValueError('metric %s is already registered as a %s' % (name, type(_metrics[name]).__name__))
+        return _metrics[name]
+
+def histogram(name, documentation, labelnames=(), **kw):
+    """Return the process wide histogram called ``name``, create it on first
+    use.
+    """
+    return _get_metric(Histogram, name, documentation, labelnames, **kw)
+
+def counter(name, documentation, labelnames=()):
+    return _get_metric(Counter, name, documentation, labelnames)
+
+def gauge(name, documentation):
+    return _get_metric(Gauge, name, documentation)
+
+def get_metrics():
+    with _metrics_lock:
+        return list(_metrics.values())
+
+def render_metrics():
+    """Return all metrics of this process in the prometheus text format."""
+    return '\n'.join(m.render() for m in get_metrics()) + '\n'
+
+
+# shared by the modules of the indexer
+index_stage_seconds = histogram('seafes_index_stage_seconds',
+                                'Time spent in each stage of indexing: fetch_commit, diff (including '
+                                'fetch_dir), fetch_file, es_write, refresh.', ['stage'])
+index_queue_depth = gauge('seafes_index_queue_depth', 'Repos waiting to be indexed.')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        logger.debug('metrics: ' + format, *args)
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port, addr='127.0.0.1'):
+    """Serve the metrics of this process at ``http://addr:port/metrics`` from
+    a daemon thread, by default only to the local host. Return the server, or
+    None if ``port`` is 0 or can't be bound; indexing goes on without the
+    endpoint then.
+    """
+    if not port:
+        return None
+    try:
+        server = _MetricsServer((addr, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning('failed to start metrics server on %s:%s: %s', addr, port, e)
+        return None
+    t = threading.Thread(target=server.serve_forever, name='metrics_server')
+    t.daemon = True
+    t.start()
+    logger.info('serving metrics on %s:%s', addr, port)
+    return server
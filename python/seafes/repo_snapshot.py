@@ -0,0 +1,195 @@
+# coding: UTF-8
+
+import gzip
+import json
+import logging
+
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch.helpers import scan
+
+from seafobj import commit_mgr
+from seafobj.exceptions import GetObjectError
+
+from .indexes import RepoStatusIndex, RepoFilesIndex, RepoContentsIndex
+
+logger = logging.getLogger('seafes')
+
+FORMAT_VERSION = 2
+# version 1 had no content lines
+SUPPORTED_VERSIONS = (1, 2)
+
+
+class RepoIndexSnapshot(object):
+    '''Export the index of some repos to a gzip'd NDJSON file, and import it
+    into another (or the same) cluster, without re-extracting file content.
+
+    For each repo the file has a ``repo`` line with its ``repo_head``
+    checkpoint, one ``doc`` line per document in ``repofiles``, one
+    ``content`` line per object of its files in ``repocontents`` (see
+    ``dedup_content``), and an ``end`` line with the number of documents.
+    Content objects are imported only if ``dedup_content`` is enabled on
+    this server, otherwise a warning is logged and only file names are
+    searchable in the files whose content was stored that way.
+
+    On import the checkpoint commit must exist in the object storage of this
+    server, so that incremental indexing can go on from it. While a repo is
+    imported its checkpoint is ``None -> commit``: if the import is
+    interrupted, the normal recovery rebuilds that repo from scratch.
+    '''
+
+    def __init__(self, es, chunk_size=500):
+        self.es = es
+        self.chunk_size = chunk_size
+        self.status_index = RepoStatusIndex(es)
+        self.files_index = RepoFilesIndex(es)
+        self.contents_index = self.files_index.contents_index or RepoContentsIndex(es)
+
+    def export(self, repo_ids, path):
+        count = 0
+        with gzip.open(path, 'wt', encoding='utf-8') as fp:
+            self._write(fp, {'type': 'header', 'version': FORMAT_VERSION})
+            for repo_id in repo_ids:
+                if self.export_repo(fp, repo_id):
+                    count += 1
+        logger.info('%d repos exported to %s', count, path)
+
+    def export_repo(self, fp, repo_id):
+        try:
+            doc = self.es.get(index=RepoStatusIndex.INDEX_NAME, doc_type=RepoStatusIndex.MAPPING_TYPE,
+                              id=repo_id)['_source']
+        except NotFoundError:
+            logger.warning('repo %s is not indexed, skip', repo_id)
+            return False
+        commit = doc.get('commit', None)
+        if not commit:
+            logger.warning('repo %s has no indexed commit, skip', repo_id)
+            return False
+
+        self._write(fp, {'type': 'repo', 'repo': repo_id, 'commit': commit,
+                         'updatingto': doc.get('updatingto', None)})
+        count = 0
+        obj_ids = set()
+        for hit in scan(self.es, query={'query': {'term': {'repo': repo_id}}},
+                        index=RepoFilesIndex.INDEX_NAME, scroll='5m'):
+            self._write(fp, {'type': 'doc', '_id': hit['_id'], '_type': hit['_type'],
+                             '_source': hit['_source']})
+            if not hit['_source'].get('is_dir') and hit['_source'].get('obj_id'):
+                obj_ids.add(hit['_source']['obj_id'])
+            count += 1
+        contents = self.export_contents(fp, sorted(obj_ids))
+        self._write(fp, {'type': 'end', 'repo': repo_id, 'count': count})
+        logger.info('repo %s exported at commit %s, %d documents, %d content objects',
+                    repo_id, commit, count, contents)
+        return True
+
+    def export_contents(self, fp, obj_ids):
+        count = 0
+        for i in range(0, len(obj_ids), self.chunk_size):
+            objects = self.contents_index.get_objects(obj_ids[i:i + self.chunk_size])
+            for obj_id, source in sorted(objects.items()):
+                self._write(fp, {'type': 'content', '_id': obj_id, '_source': source})
+                count += 1
+        return count
+
+    def _write(self, fp, obj):
+        fp.write(json.dumps(obj, ensure_ascii=False))
+        fp.write('\n')
+
+    def import_(self, path, force=False):
+        """Import the repos in the file at ``path``. A repo whose checkpoint
+        commit can't be found in the object storage is skipped, unless
+        ``force`` is set.
+        """
+        imported = skipped = 0
+        repo = None
+        actions = []
+        content_actions = []
+        contents_index = self.files_index.contents_index
+        if contents_index:
+            contents_index.create_index_if_missing()
+        with gzip.open(path, 'rt', encoding='utf-8') as fp:
+            for line in fp:
+                obj = json.loads(line)
+                kind = obj.get('type')
+                if kind == 'header':
+                    if obj.get('version') not in SUPPORTED_VERSIONS:
+                        raise RuntimeError('unsupported snapshot version %s' % obj.get('version'))
+                elif kind == 'repo':
+                    repo = obj if self._begin_repo(obj, force) else None
+                    actions = []
+                    content_actions = []
+                    count = contents = 0
+                elif kind == 'doc':
+                    if repo is None:
+                        continue
+                    actions.append({
+                        '_index': RepoFilesIndex.INDEX_NAME,
+                        '_type': obj['_type'],
+                        '_id': obj['_id'],
+                        '_source': self.files_index.upgrade_document(obj['_source']),
+                    })
+                    if len(actions) >= self.chunk_size:
+                        count += self._flush(actions)
+                elif kind == 'content':
+                    if repo is None:
+                        continue
+                    contents += 1
+                    if not contents_index:
+                        continue
+                    content_actions.append(contents_index.make_import_action(
+                        repo['repo'], obj['_id'], obj['_source']))
+                    if len(content_actions) >= self.chunk_size:
+                        self._flush(content_actions, contents_index)
+                elif kind == 'end':
+                    if repo is None:
+                        skipped += 1
+                        continue
+                    count += self._flush(actions)
+                    if contents and not contents_index:
+                        logger.warning('repo %s: dedup_content is disabled, the content of %d objects '
+                                       'is not imported, only their file names can be searched',
+                                       repo['repo'], contents)
+                    # write the objects before the repo is marked as imported
+                    self._flush(content_actions, contents_index)
+                    self._finish_repo(repo, count, obj['count'])
+                    imported += 1
+                    repo = None
+        if repo is not None:
+            raise RuntimeError('snapshot is truncated, repo %s is incomplete' % repo['repo'])
+        logger.info('%d repos imported from %s, %d skipped', imported, path, skipped)
+
+    def _begin_repo(self, obj, force):
+        repo_id, commit = obj['repo'], obj['commit']
+        try:
+            commit_mgr.load_commit(repo_id, 0, commit)
+        except GetObjectError:
+            if not force:
+                logger.warning('commit %s of repo %s not found, skip', commit, repo_id)
+                return False
+            logger.warning('commit %s of repo %s not found, import anyway', commit, repo_id)
+
+        self.status_index.get_repo_status(repo_id)
+        self.status_index.begin_update_repo(repo_id, None, commit)
+        self.files_index.delete_by_repo(repo_id)
+        return True
+
+    def _flush(self, actions, index=None):
+        if not actions:
+            return 0
+        count = len(actions)
+        (index or self.files_index).bulk(actions)
+        del actions[:]
+        return count
+
+    def _finish_repo(self, obj, count, expected):
+        repo_id = obj['repo']
+        if count != expected:
+            # leave the checkpoint as is, recovery will rebuild the repo.
+            logger.error('repo %s: %d documents imported, %d expected', repo_id, count, expected)
+            return
+        if obj.get('updatingto'):
+            # it was being updated when exported, resume that update
+            self.status_index.begin_update_repo(repo_id, obj['commit'], obj['updatingto'])
+        else:
+            self.status_index.finish_update_repo(repo_id, obj['commit'])
+        logger.info('repo %s imported at commit %s, %d documents', repo_id, obj['commit'], count)
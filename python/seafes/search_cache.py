@@ -0,0 +1,188 @@
+# coding: UTF-8
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from .config import seafes_config
+from .metrics import counter
+
+logger = logging.getLogger('seafes')
+
+cache_lookups = counter('seafes_search_cache_lookups_total',
+                        'Search cache lookups, by result (hit or miss).', ['result'])
+cache_invalidations = counter('seafes_search_cache_invalidations_total',
+                              'Repos whose search cache entries were invalidated.')
+
+
+class SearchCacheBase(object):
+    '''Cache of ``RepoFilesIndex.search_files`` results.
+
+    Each entry records the repos it was computed from, and is dropped when any
+    of them gets a new indexed commit (see
+    ``RepoStatusIndex.finish_update_repo``). Entries also expire after
+    ``ttl`` seconds, which bounds the staleness of a result that was computed
+    while one of its repos was being updated.
+
+    Backends implement ``_get``, ``_set`` and ``_invalidate_repo``.
+    '''
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(scopes_digest, search_path, keyword, obj_desc, start, size, facets=None):
+        normalized = {
+            'scopes': scopes_digest,
+            'path': search_path,
+            'keyword': ' '.join(keyword.split()),
+            'obj_desc': obj_desc or {},
+            'start': start,
+            'size': size,
+            'facets': sorted(facets or []),
+        }
+        data = json.dumps(normalized, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            value = self._get(key)
+        except Exception as e:
+            logger.warning('failed to get search cache: %s', e)
+            value = None
+        cache_lookups.inc(result='miss' if value is None else 'hit')
+        return value
+
+    def set(self, key, value, repo_ids):
+        try:
+            self._set(key, value, repo_ids)
+        except Exception as e:
+            logger.warning('failed to set search cache: %s', e)
+
+    def invalidate_repo(self, repo_id):
+        cache_invalidations.inc()
+        try:
+            self._invalidate_repo(repo_id)
+        except Exception as e:
+            logger.warning('failed to invalidate search cache of repo %s: %s', repo_id, e)
+
+
+class MemorySearchCache(SearchCacheBase):
+    '''LRU cache in the memory of the searching process.
+
+    Repos are indexed by seafevents, in another process than the searches of
+    seahub, so the entries are in practice only dropped by the ttl: a search
+    may return results up to ``ttl`` seconds older than the index. Use the
+    redis backend for invalidation on updates.
+    '''
+    def __init__(self, ttl, max_entries):
+        super(MemorySearchCache, self).__init__(ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (expire_at, value, repo_ids)
+        self._repo_keys = {}          # repo_id -> set of keys
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set(self, key, value, repo_ids):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, value, repo_ids)
+            for repo_id in repo_ids:
+                self._repo_keys.setdefault(repo_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _invalidate_repo(self, repo_id):
+        with self._lock:
+            for key in self._repo_keys.pop(repo_id, set()):
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for repo_id in entry[2]:
+            keys = self._repo_keys.get(repo_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._repo_keys[repo_id]
+
+
+class RedisSearchCache(SearchCacheBase):
+    '''Cache shared by all processes through redis.
+
+    An entry is stored at ``seafes:search:<key>``, and its key is added to the
+    set ``seafes:search:repo:<repo_id>`` of every repo it depends on, so
+    invalidating a repo deletes exactly the entries that contain it.
+    '''
+    ENTRY_PREFIX = 'seafes:search:'
+    REPO_PREFIX = 'seafes:search:repo:'
+
+    def __init__(self, ttl, mq):
+        super(RedisSearchCache, self).__init__(ttl)
+        self.mq = mq
+
+    def _get(self, key):
+        data = self.mq.get(self.ENTRY_PREFIX + key)
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def _set(self, key, value, repo_ids):
+        entry_key = self.ENTRY_PREFIX + key
+        pipe = self.mq.pipeline(transaction=False)
+        pipe.set(entry_key, json.dumps(value), ex=self.ttl)
+        for repo_id in repo_ids:
+            pipe.sadd(self.REPO_PREFIX + repo_id, entry_key)
+            pipe.expire(self.REPO_PREFIX + repo_id, self.ttl)
+        pipe.execute()
+
+    def _invalidate_repo(self, repo_id):
+        repo_key = self.REPO_PREFIX + repo_id
+        entry_keys = self.mq.smembers(repo_key)
+        pipe = self.mq.pipeline(transaction=False)
+        for entry_key in entry_keys:
+            pipe.delete(entry_key)
+        pipe.delete(repo_key)
+        pipe.execute()
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache():
+    """Return the process wide search cache, or None if it is disabled by the
+    ``search_cache`` option.
+    """
+    global _search_cache
+    backend = seafes_config.search_cache
+    if not backend:
+        return None
+
+    with _search_cache_lock:
+        if _search_cache is None:
+            if backend == 'redis':
+                from .mq import get_mq
+                mq = get_mq('REDIS', seafes_config.redis_host, seafes_config.redis_port,
+                            seafes_config.redis_password)
+                _search_cache = RedisSearchCache(seafes_config.search_cache_ttl, mq)
+            else:
+                _search_cache = MemorySearchCache(seafes_config.search_cache_ttl,
+                                                  seafes_config.search_cache_size)
+                logger.info('[seafes] memory search cache entries are not invalidated by updates '
+                            'in other processes, they expire after %ds', seafes_config.search_cache_ttl)
+            logger.info('[seafes] use %s search cache', backend)
+    return _search_cache
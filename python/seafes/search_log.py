@@ -0,0 +1,81 @@
+# coding: UTF-8
+
+import json
+import random
+import logging
+import logging.handlers
+import threading
+
+from .config import seafes_config
+from .metrics import histogram
+
+logger = logging.getLogger('seafes')
+
+search_seconds = histogram('seafes_search_seconds',
+                           'Wall-clock latency of search requests, by api.', ['api'])
+search_took_seconds = histogram('seafes_search_took_seconds',
+                                'Time elasticsearch reports (took) for search requests, by api.', ['api'])
+
+PROFILE_LOG_MAX_BYTES = 10 * 1024 * 1024
+PROFILE_LOG_BACKUP_COUNT = 5
+
+_profile_logger = None
+_profile_logger_lock = threading.Lock()
+
+
+def should_profile():
+    """Whether to run a search with ``profile``: profiling makes a search
+    much slower, so only a ``search_profile_rate`` sample is profiled.
+    """
+    return bool(seafes_config.search_profile_log) and random.random() < seafes_config.search_profile_rate
+
+def _get_profile_logger():
+    global _profile_logger
+    with _profile_logger_lock:
+        if _profile_logger is None:
+            handler = logging.handlers.RotatingFileHandler(
+                seafes_config.search_profile_log, maxBytes=PROFILE_LOG_MAX_BYTES,
+                backupCount=PROFILE_LOG_BACKUP_COUNT)
+            handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
+            _profile_logger = logging.getLogger('seafes.search_profile')
+            _profile_logger.addHandler(handler)
+            _profile_logger.setLevel(logging.INFO)
+            _profile_logger.propagate = False
+        return _profile_logger
+
+def _get_body(request):
+    return request.to_dict() if hasattr(request, 'to_dict') else request
+
+def record_search(api, request, wall, took, repos_count, profile=None):
+    """Record a finished search request.
+
+    Arguments:
+    - `api`: Which search it was, e.g. ``search``, ``suggest``.
+    - `request`: The ``Search`` object or the request body, only serialized
+      when it has to be logged.
+    - `wall`: Seconds the request took in this process.
+    - `took`: Milliseconds reported by elasticsearch.
+    - `repos_count`: Number of repos the search was restricted to.
+    - `profile`: The ``profile`` section of the response, if requested.
+    """
+    search_seconds.observe(wall, api=api)
+    if took is not None:
+        search_took_seconds.observe(took / 1000.0, api=api)
+
+    threshold = seafes_config.slow_search_threshold
+    if threshold > 0 and wall >= threshold:
+        logger.warning('slow search (%s): %.3fs, took %sms, %d repos: %s',
+                       api, wall, took, repos_count, json.dumps(_get_body(request)))
+
+    if profile is not None and seafes_config.search_profile_log:
+        try:
+            _get_profile_logger().info(json.dumps({
+                'api': api,
+                'wall': wall,
+                'took': took,
+                'repos': repos_count,
+                'request': _get_body(request),
+                'profile': profile,
+            }))
+        except Exception as e:
+            logger.warning('failed to write search profile: %s', e)
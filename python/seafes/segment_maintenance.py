@@ -0,0 +1,174 @@
+# coding: UTF-8
+"""Expunge deleted documents from the seafes indices.
+
+Deleting repos (``clear_deleted_repo_indices``) or large dirs only marks
+their documents as deleted. Until merges catch up, they still take disk
+space and are visited by searches. ``SegmentMaintenance`` checks the
+deleted-docs ratio and segment counts of each index with the indices stats
+API, and runs a ``forcemerge`` with ``only_expunge_deletes`` on the indices
+that need it, one index at a time, only inside the configured off-peak
+window and while the cluster is not busy.
+"""
+import time
+import logging
+
+from seafes.config import seafes_config
+from seafes.indexes import RepoStatusIndex, RepoFilesIndex, RepoACLIndex, ExtractQuarantineIndex, \
+    RepoContentsIndex
+
+logger = logging.getLogger('seafes')
+
+INDEX_CLASSES = (RepoFilesIndex, RepoContentsIndex, RepoStatusIndex, RepoACLIndex, ExtractQuarantineIndex)
+# elasticsearch 5 can't run a forcemerge in the background, the request
+# returns when the merge is done.
+MERGE_REQUEST_TIMEOUT = 6 * 3600
+
+
+class MergeWindow(object):
+    '''A daily time window in local time, e.g. ``01:00-05:00``. The end may
+    be before the start for a window across midnight, e.g. ``22:00-04:00``.
+    '''
+
+    def __init__(self, start, end):
+        self.start = start # minutes since midnight
+        self.end = end
+
+    @classmethod
+    def parse(cls, spec):
+        try:
+            start, end = [cls._parse_time(e) for e in spec.split('-')]
+        except ValueError:
+            raise ValueError('invalid merge window %r, should be like 01:00-05:00' % spec)
+        return cls(start, end)
+
+    @staticmethod
+    def _parse_time(value):
+        hour, minute = value.strip().split(':')
+        hour, minute = int(hour), int(minute)
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(value)
+        return hour * 60 + minute
+
+    def contains(self, now=None):
+        t = time.localtime(now)
+        minute = t.tm_hour * 60 + t.tm_min
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+    def seconds_until_open(self, now=None):
+        """Seconds until the window opens next, 0 if it is open."""
+        if self.contains(now):
+            return 0
+        t = time.localtime(now)
+        minute = t.tm_hour * 60 + t.tm_min
+        return ((self.start - minute) % (24 * 60)) * 60 - t.tm_sec
+
+    def __str__(self):
+        return '%02d:%02d-%02d:%02d' % (self.start // 60, self.start % 60, self.end // 60, self.end % 60)
+
+
+class SegmentMaintenance(object):
+    '''Arguments default to the ``merge_*`` options of ``[INDEX FILES]``:
+
+    - ``window``: a ``MergeWindow``, merges are only started inside it.
+    - ``deleted_ratio``: an index is merged when deleted documents are at
+      least this fraction of all its documents...
+    - ``max_segments``: ...or when it has at least this many segments per
+      primary shard and some deleted documents. 0 disables this check.
+    - ``max_cpu``: no merge is started while the cpu usage of any node is
+      above this percent, or while any node has queued searches.
+
+    A merge that has started can't be cancelled, when the cluster gets busy
+    no further index is merged.
+    '''
+
+    def __init__(self, es, window=None, deleted_ratio=None, max_segments=None, max_cpu=None):
+        self.es = es
+        self.window = window
+        self.deleted_ratio = seafes_config.merge_deleted_ratio if deleted_ratio is None else deleted_ratio
+        self.max_segments = seafes_config.merge_max_segments if max_segments is None else max_segments
+        self.max_cpu = seafes_config.merge_max_cpu if max_cpu is None else max_cpu
+
+    def get_index_stats(self):
+        """Return a list of dicts, one for each physical seafes index, with
+        ``index``, ``docs``, ``deleted``, ``deleted_ratio``, ``segments``
+        (of the primary shards) and ``segments_per_shard``.
+        """
+        indices = []
+        for index_class in INDEX_CLASSES:
+            indices.extend(index_class.get_physical_indices(self.es))
+        if not indices:
+            return []
+
+        stats = self.es.indices.stats(index=','.join(indices), metric='docs,segments')['indices']
+        settings = self.es.indices.get_settings(index=','.join(indices), name='index.number_of_shards')
+
+        ret = []
+        for index in indices:
+            primaries = stats.get(index, {}).get('primaries', {})
+            docs = primaries.get('docs', {}).get('count', 0)
+            deleted = primaries.get('docs', {}).get('deleted', 0)
+            segments = primaries.get('segments', {}).get('count', 0)
+            shards = int(settings.get(index, {}).get('settings', {}).get('index', {}).get('number_of_shards', 1))
+            ret.append({
+                'index': index,
+                'docs': docs,
+                'deleted': deleted,
+                'deleted_ratio': float(deleted) / (docs + deleted) if docs + deleted else 0.0,
+                'segments': segments,
+                'segments_per_shard': float(segments) / max(shards, 1),
+            })
+        return ret
+
+    def needs_merge(self, stat):
+        if not stat['deleted']:
+            return False
+        if stat['deleted_ratio'] >= self.deleted_ratio:
+            return True
+        return self.max_segments > 0 and stat['segments_per_shard'] >= self.max_segments
+
+    def get_busy_reason(self):
+        """Return why the cluster is too busy to merge, None if it isn't."""
+        nodes = self.es.nodes.stats(metric='os,thread_pool')['nodes']
+        for node in nodes.values():
+            cpu = node.get('os', {}).get('cpu', {}).get('percent', 0)
+            if cpu > self.max_cpu:
+                return 'cpu of node %s is %d%%' % (node.get('name'), cpu)
+            queue = node.get('thread_pool', {}).get('search', {}).get('queue', 0)
+            if queue > 0:
+                return 'node %s has %d queued searches' % (node.get('name'), queue)
+        return None
+
+    def can_merge(self, ignore_window=False):
+        if not ignore_window and self.window is not None and not self.window.contains():
+            logger.info('merge window %s is closed', self.window)
+            return False
+        reason = self.get_busy_reason()
+        if reason:
+            logger.info('cluster is busy, %s', reason)
+            return False
+        return True
+
+    def run(self, dry_run=False, ignore_window=False):
+        """Merge the indices which need it, the most deleted first. Return
+        the names of the merged indices.
+        """
+        stats = [s for s in self.get_index_stats() if self.needs_merge(s)]
+        stats.sort(key=lambda s: s['deleted_ratio'], reverse=True)
+
+        merged = []
+        for stat in stats:
+            logger.info('%s has %d deleted docs (%.1f%%) in %d segments',
+                        stat['index'], stat['deleted'], stat['deleted_ratio'] * 100, stat['segments'])
+            if dry_run:
+                continue
+            if not self.can_merge(ignore_window):
+                logger.info('stop merging, %d indices left', len(stats) - len(merged))
+                break
+            start = time.time()
+            self.es.indices.forcemerge(index=stat['index'], only_expunge_deletes=True,
+                                       request_timeout=MERGE_REQUEST_TIMEOUT)
+            logger.info('expunged deleted docs of %s in %.1fs', stat['index'], time.time() - start)
+            merged.append(stat['index'])
+        return merged
@@ -0,0 +1,39 @@
+# coding: UTF-8
+
+import hashlib
+
+
+class Shard(object):
+    '''One of ``count`` disjoint sets of repos, so that several machines can
+    update the index at once, each one running ``index_local update --shard
+    index/count``.
+
+    A repo belongs to the shard given by the hash of its id, which is the same
+    on every machine and doesn't depend on the order of the repos.
+    '''
+
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError('invalid shard %s/%s' % (index, count))
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a shard spec like ``0/4``."""
+        try:
+            index, count = spec.split('/')
+            return cls(int(index), int(count))
+        except ValueError:
+            raise ValueError('invalid shard "%s", expected i/N with 0 <= i < N' % spec)
+
+    def contains(self, repo_id):
+        return shard_of(repo_id, self.count) == self.index
+
+    def __str__(self):
+        return '%d/%d' % (self.index, self.count)
+
+
+def shard_of(repo_id, count):
+    digest = hashlib.md5(repo_id.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % count
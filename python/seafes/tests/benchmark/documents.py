@@ -0,0 +1,164 @@
+# coding: UTF-8
+"""Deterministic synthetic documents of the formats seafes extracts text
+from. The content is random words from a small vocabulary (with some
+non-ascii words, so that the encoding detection has work to do), wrapped in
+the minimal structure each extractor reads.
+"""
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+WORDS = (
+    'seafile', 'index', 'search', 'library', 'report', 'budget', 'meeting',
+    'quarter', 'project', 'design', 'review', 'client', 'server', 'storage',
+    'backup', 'release', 'version', 'summary', 'draft', 'contract', 'invoice',
+    'données', 'résumé', 'straße', 'größe', 'año', 'niño', '文件', '搜索',
+    '资料库', '报告', 'ファイル', '検索',
+)
+
+
+def make_text(rng, size):
+    """Return about ``size`` bytes (utf-8) of random words, in lines of up
+    to 12 words.
+    """
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word.encode('utf-8')) + 1
+        if len(words) % 12 == 0:
+            words.append('\n')
+    return ' '.join(words)
+
+def _paragraphs(rng, size):
+    return [line.strip() for line in make_text(rng, size).split('\n') if line.strip()]
+
+def _zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files:
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+
+def make_txt(rng, size):
+    return make_text(rng, size).encode('utf-8')
+
+def make_md(rng, size):
+    lines = []
+    for i, para in enumerate(_paragraphs(rng, size)):
+        if i % 5 == 0:
+            lines.append('## ' + para.split(' ', 1)[0])
+        lines.append(para)
+        lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+def make_html(rng, size):
+    body = ''.join('<p class="para">%s</p>\n' % escape(p) for p in _paragraphs(rng, size))
+    return ('<html><head><title>report</title></head><body>\n%s</body></html>' % body).encode('utf-8')
+
+def make_docx(rng, size):
+    runs = ''.join('<w:p><w:r><w:t>%s</w:t></w:r></w:p>' % escape(p) for p in _paragraphs(rng, size))
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                '<w:body>%s</w:body></w:document>' % runs)
+    return _zip([('[Content_Types].xml', '<Types/>'), ('word/document.xml', document)])
+
+def make_pptx(rng, size, slides=10):
+    paras = _paragraphs(rng, size)
+    per_slide = max(1, len(paras) // slides)
+    files = [('[Content_Types].xml', '<Types/>')]
+    for i in range(0, len(paras), per_slide):
+        texts = ''.join('<a:p><a:r><a:t>%s</a:t></a:r></a:p>' % escape(p) for p in paras[i:i + per_slide])
+        files.append(('ppt/slides/slide%d.xml' % (i // per_slide + 1),
+                      '<?xml version="1.0" encoding="UTF-8"?>'
+                      '<p:sld xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+                      'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main">'
+                      '<p:cSld><p:spTree><p:sp><p:txBody>%s</p:txBody></p:sp></p:spTree></p:cSld></p:sld>' % texts))
+    return _zip(files)
+
+def make_xlsx(rng, size):
+    strings = make_text(rng, size).split()
+    shared = ''.join('<si><t>%s</t></si>' % escape(s) for s in strings)
+    rows = ''.join('<row r="%d"><c r="A%d" t="s"><v>%d</v></c></row>' % (i + 1, i + 1, i)
+                   for i in range(len(strings)))
+    return _zip([
+        ('[Content_Types].xml', '<Types/>'),
+        ('xl/sharedStrings.xml', '<?xml version="1.0" encoding="UTF-8"?><sst count="%d">%s</sst>' % (len(strings), shared)),
+        ('xl/worksheets/sheet1.xml', '<?xml version="1.0" encoding="UTF-8"?><worksheet><sheetData>%s</sheetData></worksheet>' % rows),
+    ])
+
+def make_odt(rng, size):
+    paras = ''.join('<text:p>%s</text:p>' % escape(p) for p in _paragraphs(rng, size))
+    content = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+               'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+               '<office:body><office:text>%s</office:text></office:body></office:document-content>' % paras)
+    return _zip([('mimetype', 'application/vnd.oasis.opendocument.text'), ('content.xml', content)])
+
+def make_pdf(rng, size, lines_per_page=50):
+    """A pdf of text pages, with ascii words only (the standard Helvetica
+    font can't show the others).
+    """
+    words = [w for w in WORDS if all(ord(c) < 128 for c in w)]
+    lines = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(words) for _ in range(10))
+        lines.append(line)
+        length += len(line) + 1
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = [] # bodies of objects 1..n
+    page_ids = [3 + 2 * i for i in range(len(pages))]
+    objects.append('<< /Type /Catalog /Pages 2 0 R >>')
+    objects.append('<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join('%d 0 R' % i for i in page_ids), len(pages)))
+    font_id = 3 + 2 * len(pages)
+    for i, page in enumerate(pages):
+        text = ['BT /F1 10 Tf 50 800 Td 12 TL']
+        for line in page:
+            text.append('(%s) Tj T*' % line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)'))
+        text.append('ET')
+        stream = '\n'.join(text)
+        objects.append('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       '/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (font_id, page_ids[i] + 1))
+        objects.append('<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+    objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for i, body in enumerate(objects):
+        offsets.append(out.tell())
+        out.write(('%d 0 obj\n%s\nendobj\n' % (i + 1, body)).encode('latin-1'))
+    xref = out.tell()
+    out.write(('xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)).encode('latin-1'))
+    for offset in offsets:
+        out.write(('%010d 00000 n \n' % offset).encode('latin-1'))
+    out.write(('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+               % (len(objects) + 1, xref)).encode('latin-1'))
+    return out.getvalue()
+
+def make_binary(rng, size):
+    return rng.getrandbits(8 * size).to_bytes(size, 'little') if size else b''
+
+
+MAKERS = {
+    'txt': make_txt,
+    'md': make_md,
+    'html': make_html,
+    'docx': make_docx,
+    'pptx': make_pptx,
+    'xlsx': make_xlsx,
+    'odt': make_odt,
+    'pdf': make_pdf,
+    'bin': make_binary,
+}
+
+def make_document(suffix, rng, size):
+    """Return the content of a ``suffix`` file with about ``size`` bytes of
+    text (office formats are smaller once compressed). Unknown suffixes get
+    random bytes.
+    """
+    return MAKERS.get(suffix, make_binary)(rng, size)
@@ -0,0 +1,149 @@
+# coding: UTF-8
+"""Extractor regression benchmark.
+
+Generates a deterministic corpus of each format in ``EXTRACT_TEXT_FUNCS``
+that can be generated without office software (docx, pptx, xlsx, odt, html,
+txt, and pdf when ``pdftotext`` is installed) in several size classes, and
+times the extractor of each format, including ``fix_encoding``. Reports the
+input throughput and the peak python memory per format and size class.
+
+Save a baseline, then compare later runs against it; the command exits with
+1 when a format got slower than the threshold allows. ``EVENTS_CONFIG_FILE``
+must be set before ``seafes`` is imported:
+
+    export EVENTS_CONFIG_FILE=$PWD/seafes/tests/integration/seafevents.conf
+    python -m seafes.tests.benchmark.extractors --save-baseline extract-baseline.json
+    python -m seafes.tests.benchmark.extractors --baseline extract-baseline.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tracemalloc
+
+from .documents import make_document
+
+FORMATS = ('txt', 'html', 'docx', 'pptx', 'xlsx', 'odt', 'pdf')
+SIZE_CLASSES = (
+    ('small', 4 * 1024),
+    ('medium', 64 * 1024),
+    ('large', 1024 * 1024),
+)
+
+
+def get_formats():
+    formats = list(FORMATS)
+    if shutil.which('pdftotext') is None:
+        formats.remove('pdf')
+    return formats
+
+def make_corpus(formats, files_per_class, seed=0):
+    """Return {(suffix, size class): [content, ...]}, the same for a given
+    seed.
+    """
+    corpus = {}
+    for suffix in formats:
+        for size_class, size in SIZE_CLASSES:
+            rng = random.Random('%s-%s-%s' % (seed, suffix, size_class))
+            corpus[(suffix, size_class)] = [make_document(suffix, rng, size) for _ in range(files_per_class)]
+    return corpus
+
+def extract_all(extractor, name, docs):
+    for content in docs:
+        extractor.fix_encoding('bench', name, extractor.func(content))
+
+def bench_one(extractor, name, docs, repeat):
+    """Return (best seconds over ``repeat`` runs, peak traced bytes)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_all(extractor, name, docs)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    tracemalloc.start()
+    try:
+        extract_all(extractor, name, docs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def run(formats, files_per_class, repeat, seed):
+    from seafes.extract import EXTRACT_TEXT_FUNCS, Extractor
+
+    results = {}
+    corpus = make_corpus(formats, files_per_class, seed)
+    for (suffix, size_class), docs in sorted(corpus.items()):
+        extractor = Extractor(EXTRACT_TEXT_FUNCS[suffix], -1)
+        seconds, peak = bench_one(extractor, 'bench.' + suffix, docs, repeat)
+        input_bytes = sum(len(d) for d in docs)
+        results['%s/%s' % (suffix, size_class)] = {
+            'files': len(docs),
+            'input_bytes': input_bytes,
+            'seconds': round(seconds, 6),
+            'mb_per_sec': round(input_bytes / 1024.0 / 1024 / seconds, 3) if seconds else None,
+            'peak_kb': round(peak / 1024.0, 1),
+        }
+    return results
+
+def compare(results, baseline, threshold):
+    """Return the keys whose throughput dropped more than ``threshold`` (a
+    fraction) below the baseline.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if not base or not base.get('mb_per_sec') or not result.get('mb_per_sec'):
+            continue
+        change = result['mb_per_sec'] / base['mb_per_sec'] - 1
+        result['change'] = round(change, 3)
+        if change < -threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='seafes extractor benchmark')
+    parser.add_argument('--formats', help='comma separated formats, default: %s' % ','.join(FORMATS))
+    parser.add_argument('--files', type=int, default=5, help='files per format and size class')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per format, the best one counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='compare with the results saved in this file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction of throughput a format may lose before it is a regression')
+    parser.add_argument('--save-baseline', help='save the results to this file')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    formats = args.formats.split(',') if args.formats else get_formats()
+    results = run(formats, args.files, args.repeat, args.seed)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp)['results'], args.threshold)
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2, sort_keys=True))
+    else:
+        print('%-16s %6s %10s %10s %10s %10s %8s' % ('format', 'files', 'input KB', 'seconds', 'MB/s', 'peak KB', 'change'))
+        for key, r in sorted(results.items()):
+            change = '%+.1f%%' % (r['change'] * 100) if 'change' in r else ''
+            print('%-16s %6d %10.1f %10.4f %10s %10.1f %8s' % (key, r['files'], r['input_bytes'] / 1024.0,
+                                                          r['seconds'], r['mb_per_sec'], r['peak_kb'], change))
+        if regressions:
+            print('\nregressions (more than %d%% slower): %s' % (args.threshold * 100, ', '.join(regressions)))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fp:
+            json.dump({'results': results}, fp, indent=2, sort_keys=True)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+# coding: UTF-8
+"""A local stand-in for elasticsearch 5.x, answering the requests seafes
+makes while indexing from an in-memory store, and recording every request.
+It can add latency to each request and reject writes with 429, like a busy
+cluster does, so that the indexer can be measured without the cost (and the
+noise) of a real cluster.
+
+Only what indexing needs is implemented: index management, aliases,
+get/index/update/delete, bulk, mget, delete_by_query and scroll searches
+with ``match_all``, ``term``, ``terms``, ``prefix`` and ``bool`` queries.
+Update scripts are not run, an update with a script only applies its
+``upsert``.
+"""
+import json
+import gzip
+import time
+import uuid
+import random
+import threading
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+class _Index(object):
+    def __init__(self, name):
+        self.name = name
+        self.docs = {} # id -> (type, source)
+        self.mappings = {}
+        self.settings = {}
+
+
+def _get_field(source, field):
+    value = source
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _values(value):
+    return value if isinstance(value, list) else [value]
+
+def _term_value(spec):
+    if isinstance(spec, dict):
+        return spec.get('value')
+    return spec
+
+def match_query(query, source):
+    """Return whether ``source`` matches the (simple) query."""
+    if not query or 'match_all' in query:
+        return True
+    if 'term' in query:
+        field, spec = list(query['term'].items())[0]
+        return _term_value(spec) in _values(_get_field(source, field))
+    if 'terms' in query:
+        field, values = list(query['terms'].items())[0]
+        return any(v in values for v in _values(_get_field(source, field)))
+    if 'prefix' in query:
+        field, spec = list(query['prefix'].items())[0]
+        prefix = _term_value(spec)
+        return any(isinstance(v, str) and v.startswith(prefix) for v in _values(_get_field(source, field)))
+    if 'bool' in query:
+        clauses = query['bool']
+        for key in ('must', 'filter'):
+            if not all(match_query(q, source) for q in _values(clauses.get(key, []))):
+                return False
+        if any(match_query(q, source) for q in _values(clauses.get('must_not', []))):
+            return False
+        should = _values(clauses.get('should', []))
+        if should and not any(match_query(q, source) for q in should):
+            return False
+        return True
+    return False
+
+
+class FakeElasticsearch(object):
+    '''Serve on ``http://127.0.0.1:<port>``, a free port if ``port`` is 0.
+
+    - `latency`: seconds added to every request.
+    - `jitter`: up to this many more seconds, at random.
+    - `reject_rate`: fraction of writes rejected with 429. Single document
+      writes are rejected as a whole, bulk requests item by item.
+    '''
+
+    def __init__(self, port=0, latency=0, jitter=0, reject_rate=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.reject_rate = reject_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.indices = {}
+        self.aliases = {} # alias -> index
+        self.scrolls = {}
+        self.requests = [] # (method, api, status, seconds)
+        self.rejected = 0
+
+        handler = type('Handler', (_Handler,), {'es': self})
+        self.server = _Server(('127.0.0.1', port), handler)
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    @property
+    def host(self):
+        return '127.0.0.1:%d' % self.port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake_es')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_stats(self):
+        with self.lock:
+            by_api = Counter(api for _, api, _, _ in self.requests)
+            return {
+                'requests': len(self.requests),
+                'by_api': dict(by_api),
+                'rejected': self.rejected,
+                'docs': sum(len(idx.docs) for idx in self.indices.values()),
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = []
+            self.rejected = 0
+
+    def _record(self, method, api, status, seconds):
+        with self.lock:
+            self.requests.append((method, api, status, seconds))
+
+    def _delay(self):
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _should_reject(self):
+        if self.reject_rate <= 0:
+            return False
+        with self.lock:
+            if self.rng.random() < self.reject_rate:
+                self.rejected += 1
+                return True
+        return False
+
+    # index management
+
+    def resolve(self, name):
+        name = self.aliases.get(name, name)
+        return self.indices.get(name)
+
+    def resolve_many(self, names):
+        if names in ('', '_all', '*'):
+            return list(self.indices.values())
+        ret = []
+        for name in names.split(','):
+            idx = self.resolve(name)
+            if idx is not None:
+                ret.append(idx)
+        return ret
+
+    # request handling, returns (status, body)
+
+    def handle(self, method, path, params, body):
+        parts = [unquote(p) for p in path.strip('/').split('/') if p]
+        with self.lock:
+            return self._dispatch(method, parts, params, body)
+
+    def _dispatch(self, method, parts, params, body): # noqa: C901
+        if not parts:
+            return 200, {'name': 'fake', 'cluster_name': 'seafes-bench',
+                         'version': {'number': '5.6.16'}, 'tagline': 'You Know, for Search'}
+        if parts[0] == '_bulk' or (len(parts) == 2 and parts[1] == '_bulk'):
+            return self.bulk(parts[0] if len(parts) == 2 else None, body)
+        if parts[0] == '_search' and len(parts) > 1 and parts[1] == 'scroll':
+            if method == 'DELETE':
+                return 200, {'succeeded': True}
+            return self.scroll(json.loads(body) if body else {'scroll_id': params.get('scroll_id')})
+        if parts[0] == '_mget':
+            return self.mget(None, body)
+
+        index = parts[0]
+        if len(parts) == 1:
+            if method == 'HEAD':
+                return (200 if self.resolve(index) else 404), None
+            if method == 'PUT':
+                return self.create_index(index, body)
+            if method == 'DELETE':
+                return self.delete_index(index)
+            if method == 'GET':
+                found = self.resolve_many(index)
+                if not found:
+                    return 404, _error('index_not_found_exception', 'no such index')
+                return 200, dict((idx.name, {'settings': idx.settings, 'mappings': idx.mappings,
+                                             'aliases': dict((a, {}) for a, i in self.aliases.items()
+                                                             if i == idx.name)})
+                                 for idx in found)
+        op = parts[1]
+        if op == '_refresh':
+            return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+        if op == '_mapping':
+            idx = self.resolve(index)
+            if idx is None:
+                return 404, _error('index_not_found_exception', 'no such index')
+            idx.mappings[parts[2] if len(parts) > 2 else '_default_'] = json.loads(body or '{}')
+            return 200, {'acknowledged': True}
+        if op == '_alias':
+            if method == 'PUT':
+                self.aliases[parts[2]] = index
+            elif method == 'DELETE':
+                self.aliases.pop(parts[2], None)
+            return 200, {'acknowledged': True}
+        if op == '_search':
+            return self.search(index, params, body)
+        if op == '_delete_by_query':
+            return self.delete_by_query(index, body)
+        if op == '_mget':
+            return self.mget(index, body)
+        if op == '_bulk':
+            return self.bulk(index, body)
+
+        # /index/type/...
+        doc_type = op
+        if len(parts) == 3 and parts[2] in ('_search', '_mget'):
+            return self.search(index, params, body) if parts[2] == '_search' else self.mget(index, body)
+        if len(parts) == 2 and method == 'POST':
+            return self.index_doc(index, doc_type, uuid.uuid4().hex, body)
+        doc_id = parts[2]
+        if len(parts) == 4 and parts[3] == '_update':
+            return self.update_doc(index, doc_type, doc_id, body)
+        if method in ('GET', 'HEAD'):
+            return self.get_doc(index, doc_id, params)
+        if method in ('PUT', 'POST'):
+            return self.index_doc(index, doc_type, doc_id, body)
+        if method == 'DELETE':
+            return self.delete_doc(index, doc_id)
+        return 400, _error('illegal_argument_exception', 'unsupported request')
+
+    def create_index(self, name, body):
+        if name in self.indices or name in self.aliases:
+            return 400, _error('index_already_exists_exception', 'index %s already exists' % name)
+        idx = _Index(name)
+        body = json.loads(body) if body else {}
+        idx.settings = body.get('settings', {})
+        idx.mappings = body.get('mappings', {})
+        self.indices[name] = idx
+        return 200, {'acknowledged': True}
+
+    def delete_index(self, name):
+        found = self.resolve_many(name)
+        if not found:
+            return 404, _error('index_not_found_exception', 'no such index')
+        for idx in found:
+            del self.indices[idx.name]
+            for alias in [a for a, i in self.aliases.items() if i == idx.name]:
+                del self.aliases[alias]
+        return 200, {'acknowledged': True}
+
+    def _index_or_404(self, name):
+        idx = self.resolve(name)
+        if idx is None:
+            raise _NotFound(name)
+        return idx
+
+    def get_doc(self, index, doc_id, params):
+        idx = self._index_or_404(index)
+        doc = idx.docs.get(doc_id)
+        if doc is None:
+            return 404, {'_index': idx.name, '_id': doc_id, 'found': False}
+        ret = {'_index': idx.name, '_type': doc[0], '_id': doc_id, '_version': 1, 'found': True,
+               '_source': _filter_source(doc[1], params.get('_source_include'))}
+        return 200, ret
+
+    def index_doc(self, index, doc_type, doc_id, body):
+        if self._should_reject():
+            return 429, _error('es_rejected_execution_exception', 'rejected execution')
+        idx = self._index_or_404(index)
+        created = doc_id not in idx.docs
+        idx.docs[doc_id] = (doc_type, json.loads(body))
+        return (201 if created else 200), {'_index': idx.name, '_type': doc_type, '_id': doc_id,
+                                           'result': 'created' if created else 'updated', 'created': created}
+
+    def update_doc(self, index, doc_type, doc_id, body):
+        if self._should_reject():
+            return 429, _error('es_rejected_execution_exception', 'rejected execution')
+        idx = self._index_or_404(index)
+        status, result = self._apply_update(idx, doc_type, doc_id, json.loads(body))
+        if status == 404:
+            return 404, _error('document_missing_exception', '[%s][%s]: document missing' % (doc_type, doc_id))
+        return status, {'_index': idx.name, '_type': doc_type, '_id': doc_id, 'result': result}
+
+    def _apply_update(self, idx, doc_type, doc_id, body):
+        doc = idx.docs.get(doc_id)
+        if doc is None:
+            upsert = body.get('upsert')
+            if upsert is None and body.get('doc_as_upsert'):
+                upsert = body.get('doc')
+            if upsert is None:
+                return 404, None
+            idx.docs[doc_id] = (doc_type, dict(upsert))
+            return 201, 'created'
+        if 'doc' in body:
+            source = dict(doc[1])
+            source.update(body['doc'])
+            idx.docs[doc_id] = (doc[0], source)
+            return 200, 'updated'
+        return 200, 'noop'
+
+    def delete_doc(self, index, doc_id):
+        idx = self._index_or_404(index)
+        if idx.docs.pop(doc_id, None) is None:
+            return 404, {'_index': idx.name, '_id': doc_id, 'found': False, 'result': 'not_found'}
+        return 200, {'_index': idx.name, '_id': doc_id, 'found': True, 'result': 'deleted'}
+
+    def bulk(self, default_index, body):
+        lines = [l for l in body.split('\n') if l.strip()]
+        items = []
+        errors = False
+        i = 0
+        while i < len(lines):
+            action = json.loads(lines[i])
+            op, meta = list(action.items())[0]
+            i += 1
+            source = None
+            if op != 'delete':
+                source = json.loads(lines[i])
+                i += 1
+            index = meta.get('_index', default_index)
+            doc_id = meta.get('_id') or uuid.uuid4().hex
+            doc_type = meta.get('_type')
+            item = {'_index': index, '_type': doc_type, '_id': doc_id}
+            idx = self.resolve(index)
+            if self._should_reject():
+                item.update(status=429, error=_error('es_rejected_execution_exception', 'rejected execution')['error'])
+            elif idx is None:
+                item.update(status=404, error=_error('index_not_found_exception', 'no such index')['error'])
+            elif op in ('index', 'create'):
+                if op == 'create' and doc_id in idx.docs:
+                    item.update(status=409, error=_error('version_conflict_engine_exception', 'exists')['error'])
+                else:
+                    item['status'] = 201 if doc_id not in idx.docs else 200
+                    idx.docs[doc_id] = (doc_type, source)
+            elif op == 'delete':
+                item['status'] = 200 if idx.docs.pop(doc_id, None) is not None else 404
+            elif op == 'update':
+                status, _ = self._apply_update(idx, doc_type, doc_id, source)
+                item['status'] = status
+                if status == 404:
+                    item['error'] = _error('document_missing_exception', 'document missing')['error']
+            if item['status'] >= 300 and not (op == 'delete' and item['status'] == 404):
+                errors = True
+            items.append({op: item})
+        return 200, {'took': 1, 'errors': errors, 'items': items}
+
+    def mget(self, index, body):
+        body = json.loads(body)
+        docs = []
+        specs = body.get('docs') or [{'_id': i} for i in body.get('ids', [])]
+        for spec in specs:
+            idx = self.resolve(spec.get('_index', index))
+            doc = idx.docs.get(spec['_id']) if idx is not None else None
+            if doc is None:
+                docs.append({'_index': spec.get('_index', index), '_id': spec['_id'], 'found': False})
+            else:
+                docs.append({'_index': idx.name, '_type': doc[0], '_id': spec['_id'], 'found': True,
+                             '_source': doc[1]})
+        return 200, {'docs': docs}
+
+    def _matching(self, index, query):
+        hits = []
+        for idx in self.resolve_many(index):
+            for doc_id, (doc_type, source) in sorted(idx.docs.items()):
+                if match_query(query, source):
+                    hits.append({'_index': idx.name, '_type': doc_type, '_id': doc_id,
+                                 '_score': 1.0, '_source': source})
+        return hits
+
+    def search(self, index, params, body):
+        body = json.loads(body) if body else {}
+        hits = self._matching(index, body.get('query'))
+        size = int(params.get('size', body.get('size', 10)))
+        start = int(params.get('from', body.get('from', 0)))
+        resp = {'took': 1, 'timed_out': False, '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+                'hits': {'total': len(hits), 'max_score': 1.0, 'hits': hits[start:start + size]}}
+        if 'scroll' in params:
+            scroll_id = uuid.uuid4().hex
+            self.scrolls[scroll_id] = (hits[start + size:], size)
+            resp['_scroll_id'] = scroll_id
+        return 200, resp
+
+    def scroll(self, body):
+        scroll_id = body.get('scroll_id')
+        if scroll_id not in self.scrolls:
+            return 404, _error('search_context_missing_exception', 'no search context found')
+        rest, size = self.scrolls[scroll_id]
+        self.scrolls[scroll_id] = (rest[size:], size)
+        return 200, {'took': 1, '_scroll_id': scroll_id, 'timed_out': False,
+                     '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+                     'hits': {'total': len(rest), 'hits': rest[:size]}}
+
+    def delete_by_query(self, index, body):
+        if self._should_reject():
+            return 429, _error('es_rejected_execution_exception', 'rejected execution')
+        query = json.loads(body).get('query') if body else None
+        deleted = 0
+        for idx in self.resolve_many(index):
+            for doc_id in [i for i, (_, source) in idx.docs.items() if match_query(query, source)]:
+                del idx.docs[doc_id]
+                deleted += 1
+        return 200, {'took': 1, 'timed_out': False, 'deleted': deleted, 'total': deleted,
+                     'failures': []}
+
+
+class _NotFound(Exception):
+    pass
+
+def _error(error_type, reason):
+    return {'error': {'type': error_type, 'reason': reason,
+                      'root_cause': [{'type': error_type, 'reason': reason}]}}
+
+def _filter_source(source, include):
+    if not include:
+        return source
+    fields = include.split(',')
+    return dict((k, v) for k, v in source.items() if k in fields)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    es = None
+
+    def _handle(self):
+        start = time.time()
+        url = urlsplit(self.path)
+        params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        body = body.decode('utf-8')
+
+        self.es._delay()
+        try:
+            status, resp = self.es.handle(self.command, url.path, params, body)
+        except _NotFound as e:
+            status, resp = 404, _error('index_not_found_exception', 'no such index [%s]' % e)
+        except Exception as e:
+            status, resp = 500, _error('exception', str(e))
+
+        data = json.dumps(resp).encode('utf-8') if resp is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+        self.es._record(self.command, _api_name(url.path), status, time.time() - start)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+def _api_name(path):
+    """Name a request by its endpoint, e.g. ``_bulk``, ``_search``, ``doc``."""
+    parts = [p for p in path.split('/') if p]
+    for p in reversed(parts):
+        if p.startswith('_'):
+            return p
+    return {0: 'info', 1: 'index', 2: 'doc'}.get(len(parts), 'doc')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
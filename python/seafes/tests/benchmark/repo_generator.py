@@ -0,0 +1,177 @@
+# coding: UTF-8
+"""Write synthetic repos straight into the object storage seafobj reads,
+with the filesystem backend layout
+``<storage>/{commits,fs,blocks}/<repo_id>/<id[:2]>/<id[2:]>`` and version 1
+objects (commits as json, fs objects as zlib compressed json).
+
+The repos are not added to the seafile database, the benchmark runner hands
+their head commits to the indexer itself.
+"""
+import os
+import json
+import stat
+import uuid
+import zlib
+import random
+import hashlib
+
+from .documents import make_document
+
+DIR_MODE = stat.S_IFDIR | 0o755
+FILE_MODE = stat.S_IFREG | 0o644
+SEAF_METADATA_TYPE_FILE = 1
+SEAF_METADATA_TYPE_DIR = 3
+# fixed, so that commit ids don't depend on when the repos are generated
+BASE_TIME = 1577836800
+
+DEFAULT_FILE_MIX = {'txt': 4, 'md': 1, 'docx': 2, 'pptx': 1, 'xlsx': 1, 'odt': 1, 'html': 1, 'bin': 2}
+
+
+def parse_file_mix(spec):
+    """Parse ``txt:4,docx:2`` into ``{'txt': 4, 'docx': 2}``."""
+    mix = {}
+    for item in spec.split(','):
+        suffix, _, weight = item.strip().partition(':')
+        mix[suffix] = int(weight or 1)
+    return mix
+
+
+class TreeShape(object):
+    '''Each dir down to ``depth`` has ``dirs_per_dir`` sub-dirs, and each dir
+    has ``files_per_dir`` files. File sizes are drawn log-uniformly between
+    ``min_size`` and ``max_size``.
+    '''
+
+    def __init__(self, depth=2, dirs_per_dir=3, files_per_dir=10,
+                 min_size=1024, max_size=256 * 1024, file_mix=None):
+        self.depth = depth
+        self.dirs_per_dir = dirs_per_dir
+        self.files_per_dir = files_per_dir
+        self.min_size = min_size
+        self.max_size = max_size
+        self.file_mix = file_mix or DEFAULT_FILE_MIX
+
+
+class GeneratedRepo(object):
+    def __init__(self, repo_id, commit_id):
+        self.repo_id = repo_id
+        self.commit_id = commit_id
+        self.files = [] # (path, suffix, size)
+        self.dirs = 0
+
+
+class RepoGenerator(object):
+    '''Generate repos deterministically from ``seed``: the same arguments
+    give the same trees, contents and object ids.
+    '''
+
+    def __init__(self, storage_dir, seed=0, block_size=1024 * 1024):
+        self.storage_dir = storage_dir
+        self.rng = random.Random(seed)
+        self.block_size = block_size
+
+    @classmethod
+    def default_storage_dir(cls):
+        return os.path.join(os.environ['SEAFILE_CONF_DIR'], 'storage')
+
+    def _write(self, obj_type, repo_id, obj_id, data):
+        path = os.path.join(self.storage_dir, obj_type, repo_id, obj_id[:2], obj_id[2:])
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+
+    def _write_fs(self, repo_id, obj):
+        data = json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        obj_id = hashlib.sha1(data).hexdigest()
+        self._write('fs', repo_id, obj_id, zlib.compress(data))
+        return obj_id
+
+    def write_file(self, repo_id, content):
+        block_ids = []
+        for i in range(0, len(content), self.block_size):
+            block = content[i:i + self.block_size]
+            block_id = hashlib.sha1(block).hexdigest()
+            self._write('blocks', repo_id, block_id, block)
+            block_ids.append(block_id)
+        return self._write_fs(repo_id, {
+            'block_ids': block_ids,
+            'size': len(content),
+            'type': SEAF_METADATA_TYPE_FILE,
+            'version': 1,
+        })
+
+    def write_dir(self, repo_id, dirents):
+        # seafile keeps dirents sorted by name, descending
+        dirents = sorted(dirents, key=lambda d: d['name'], reverse=True)
+        return self._write_fs(repo_id, {
+            'dirents': dirents,
+            'type': SEAF_METADATA_TYPE_DIR,
+            'version': 1,
+        })
+
+    def write_commit(self, repo_id, root_id, parent_id=None, desc='synthetic commit'):
+        ctime = BASE_TIME
+        commit = {
+            'repo_id': repo_id,
+            'root_id': root_id,
+            'parent_id': parent_id,
+            'second_parent_id': None,
+            'repo_name': 'bench-' + repo_id[:8],
+            'repo_desc': '',
+            'repo_category': None,
+            'creator': '0' * 40,
+            'creator_name': 'bench@seafes',
+            'description': desc,
+            'ctime': ctime,
+            'no_local_history': 0,
+            'version': 1,
+        }
+        commit_id = hashlib.sha1(json.dumps(commit, sort_keys=True).encode('utf-8')).hexdigest()
+        commit['commit_id'] = commit_id
+        self._write('commits', repo_id, commit_id, json.dumps(commit, sort_keys=True).encode('utf-8'))
+        return commit_id
+
+    def _pick_suffix(self, mix):
+        total = sum(mix.values())
+        n = self.rng.uniform(0, total)
+        for suffix, weight in sorted(mix.items()):
+            n -= weight
+            if n <= 0:
+                return suffix
+        return suffix
+
+    def _pick_size(self, shape):
+        lo, hi = max(shape.min_size, 1), max(shape.max_size, shape.min_size, 1)
+        return int(round(lo * (float(hi) / lo) ** self.rng.random()))
+
+    def _generate_dir(self, repo, path, level, shape, mtime):
+        dirents = []
+        for i in range(shape.files_per_dir):
+            suffix = self._pick_suffix(shape.file_mix)
+            name = 'file-%d-%d.%s' % (level, i, suffix)
+            content = make_document(suffix, self.rng, self._pick_size(shape))
+            dirents.append({'id': self.write_file(repo.repo_id, content), 'mode': FILE_MODE,
+                            'modifier': 'bench@seafes', 'mtime': mtime, 'name': name,
+                            'size': len(content)})
+            repo.files.append((path.rstrip('/') + '/' + name, suffix, len(content)))
+        if level < shape.depth:
+            for i in range(shape.dirs_per_dir):
+                name = 'dir-%d-%d' % (level, i)
+                dir_id = self._generate_dir(repo, path.rstrip('/') + '/' + name, level + 1, shape, mtime)
+                dirents.append({'id': dir_id, 'mode': DIR_MODE, 'mtime': mtime, 'name': name})
+                repo.dirs += 1
+        return self.write_dir(repo.repo_id, dirents)
+
+    def generate(self, shape, repo_id=None):
+        """Generate one repo with a single commit, return a ``GeneratedRepo``.
+        """
+        repo_id = repo_id or str(uuid.UUID(int=self.rng.getrandbits(128)))
+        repo = GeneratedRepo(repo_id, None)
+        root_id = self._generate_dir(repo, '/', 0, shape, BASE_TIME)
+        repo.commit_id = self.write_commit(repo_id, root_id)
+        return repo
+
+    def generate_many(self, count, shape):
+        return [self.generate(shape) for _ in range(count)]
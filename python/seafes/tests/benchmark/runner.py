@@ -0,0 +1,218 @@
+# coding: UTF-8
+"""End-to-end indexing benchmark.
+
+Generates synthetic repos in the object storage, indexes them with
+``IndexLocal`` or ``IndexWorker`` against the elasticsearch stand-in (or a
+real cluster with ``--es``), and reports files/sec, extracted bytes/sec, ES
+requests per repo, time per indexing stage and peak RSS.
+
+Like the integration tests it needs a seafile environment, i.e.
+``SEAFILE_CONF_DIR`` (the storage is written there unless ``--storage`` is
+given) and the seafile database, and the ``worker`` scenario needs redis.
+``EVENTS_CONFIG_FILE`` must be set before ``seafes`` is imported, e.g. to
+the config of the integration tests:
+
+    export EVENTS_CONFIG_FILE=$PWD/seafes/tests/integration/seafevents.conf
+    python -m seafes.tests.benchmark.runner --repos 20 --files 20 --es-latency 0.005
+    python -m seafes.tests.benchmark.runner --scenario worker --workers 4 --json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import threading
+
+from .fake_es import FakeElasticsearch
+from .repo_generator import RepoGenerator, TreeShape, parse_file_mix, DEFAULT_FILE_MIX
+
+logger = logging.getLogger('seafes')
+
+
+def get_peak_rss_mb():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def get_extracted_bytes(repos):
+    """Bytes of the generated files whose content the indexer extracts."""
+    from seafes.extract import ExtractorFactory
+
+    total = 0
+    for repo in repos:
+        for path, _, size in repo.files:
+            name = os.path.basename(path)
+            if ExtractorFactory.get_extractor(name) is not None and \
+               size <= ExtractorFactory.get_file_size_limit(name):
+                total += size
+    return total
+
+def get_stage_seconds():
+    from seafes.metrics import index_stage_seconds
+
+    return dict((key[0], round(total, 3)) for key, (_, total, _) in index_stage_seconds.collect().items())
+
+def get_repos_handled(result=None):
+    from seafes.file_index_updater import repos_updated
+
+    values = repos_updated.collect()
+    if result is not None:
+        return values.get((result,), 0)
+    return sum(values.values())
+
+
+def run_local(es, repos, workers):
+    from seafes.config import seafes_config
+    from seafes.index_local import IndexLocal
+
+    class BenchIndexLocal(IndexLocal):
+        def iter_repo_commits(self):
+            for repo in repos:
+                yield repo.repo_id, repo.commit_id
+
+        def clear_deleted_repo(self, repos):
+            # never touch repos which are not part of the benchmark
+            pass
+
+    seafes_config.index_workers = workers
+    index_local = BenchIndexLocal(es)
+    start = time.time()
+    index_local.run()
+    return time.time() - start, index_local.error_counter
+
+def run_worker(es, repos, workers, redis_host, redis_port, timeout, pipeline=False):
+    from seafes.config import seafes_config
+    from seafes.index_worker import IndexWorker
+    from seafes.mq import get_mq
+
+    seafes_config.subscribe_mq = 'REDIS'
+    seafes_config.subscribe_server = redis_host
+    seafes_config.subscribe_port = redis_port
+    seafes_config.subscribe_password = None
+    seafes_config.index_slave_workers = workers
+    seafes_config.index_pipeline = pipeline
+    seafes_config.pipeline_fetch_workers = 8
+    seafes_config.pipeline_extract_workers = 4
+    seafes_config.pipeline_write_workers = 2
+    seafes_config.pipeline_bulk_size = 100
+
+    heads = dict((repo.repo_id, repo.commit_id) for repo in repos)
+
+    class BenchIndexWorker(IndexWorker):
+        def get_head_commit(self, repo_id):
+            return heads.get(repo_id)
+
+    mq = get_mq('REDIS', redis_host, redis_port, None)
+    for repo in repos:
+        mq.lpush('index_task', '\t'.join(['repo-update', repo.repo_id, repo.commit_id]))
+
+    should_stop = threading.Event()
+    worker = BenchIndexWorker(es, should_stop)
+    handled, failed = get_repos_handled(), get_repos_handled('error')
+    start = time.time()
+    worker.start()
+    while get_repos_handled() - handled < len(repos) and time.time() - start < timeout:
+        time.sleep(0.05)
+    elapsed = time.time() - start
+    # the worker threads exit after their current brpop times out
+    should_stop.set()
+    # a failed repo is pushed back to the queue, count it once
+    errors = max(len(repos) - (get_repos_handled() - handled), get_repos_handled('error') - failed)
+    return elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='seafes indexing benchmark')
+    parser.add_argument('--scenario', choices=('local', 'worker'), default='local')
+    parser.add_argument('--repos', type=int, default=10, help='number of repos to generate')
+    parser.add_argument('--depth', type=int, default=2, help='depth of the dir tree')
+    parser.add_argument('--dirs', type=int, default=3, help='sub-dirs per dir')
+    parser.add_argument('--files', type=int, default=10, help='files per dir')
+    parser.add_argument('--min-size', type=int, default=1024)
+    parser.add_argument('--max-size', type=int, default=256 * 1024)
+    parser.add_argument('--mix', default=','.join('%s:%s' % e for e in sorted(DEFAULT_FILE_MIX.items())),
+                        help='file suffixes and their weights, e.g. txt:4,docx:2,bin:1')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--storage', help='object storage dir, default $SEAFILE_CONF_DIR/storage')
+    parser.add_argument('--workers', type=int, default=2, help='index threads')
+    parser.add_argument('--es', help='index into this elasticsearch (host:port) instead of the stand-in')
+    parser.add_argument('--es-latency', type=float, default=0, help='seconds added to each stand-in request')
+    parser.add_argument('--es-jitter', type=float, default=0, help='up to this many more seconds, at random')
+    parser.add_argument('--es-reject-rate', type=float, default=0, help='fraction of writes rejected with 429')
+    parser.add_argument('--redis-host', default='127.0.0.1')
+    parser.add_argument('--redis-port', default='6379')
+    parser.add_argument('--pipeline', action='store_true', help='worker scenario: index files with IndexPipeline')
+    parser.add_argument('--timeout', type=float, default=3600, help='worker scenario timeout, in seconds')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    parser.add_argument('--loglevel', default='warning')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()), format='[%(asctime)s] %(message)s')
+
+    fake = None
+    from seafes.config import seafes_config
+    if args.es:
+        seafes_config.hosts = [args.es]
+    else:
+        fake = FakeElasticsearch(latency=args.es_latency, jitter=args.es_jitter,
+                                 reject_rate=args.es_reject_rate, seed=args.seed).start()
+        seafes_config.hosts = [fake.host]
+    seafes_config.index_office_pdf = True
+
+    shape = TreeShape(args.depth, args.dirs, args.files, args.min_size, args.max_size,
+                      parse_file_mix(args.mix))
+    generator = RepoGenerator(args.storage or RepoGenerator.default_storage_dir(), seed=args.seed)
+    gen_start = time.time()
+    repos = generator.generate_many(args.repos, shape)
+    gen_seconds = time.time() - gen_start
+
+    from seafes.connection import es_get_conn
+    es = es_get_conn()
+    if fake is not None:
+        fake.reset_stats()
+
+    if args.scenario == 'local':
+        elapsed, errors = run_local(es, repos, args.workers)
+    else:
+        elapsed, errors = run_worker(es, repos, args.workers, args.redis_host, args.redis_port, args.timeout,
+                                     args.pipeline)
+
+    files = sum(len(r.files) for r in repos)
+    extracted = get_extracted_bytes(repos)
+    report = {
+        'scenario': args.scenario + ('+pipeline' if args.pipeline and args.scenario == 'worker' else ''),
+        'repos': len(repos),
+        'files': files,
+        'dirs': sum(r.dirs for r in repos),
+        'errors': errors,
+        'generate_seconds': round(gen_seconds, 3),
+        'seconds': round(elapsed, 3),
+        'files_per_sec': round(files / elapsed, 1) if elapsed else None,
+        'extracted_mb_per_sec': round(extracted / 1024.0 / 1024 / elapsed, 3) if elapsed else None,
+        'stage_seconds': get_stage_seconds(),
+        'peak_rss_mb': round(get_peak_rss_mb(), 1),
+    }
+    if fake is not None:
+        stats = fake.get_stats()
+        report['es_requests'] = stats['requests']
+        report['es_requests_per_repo'] = round(stats['requests'] / float(len(repos)), 1) if repos else None
+        report['es_requests_by_api'] = stats['by_api']
+        report['es_rejected'] = stats['rejected']
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        for key in sorted(report):
+            print('%-24s %s' % (key, report[key]))
+
+    if fake is not None:
+        fake.stop()
+    sys.stdout.flush()
+    if args.scenario == 'worker':
+        # don't wait for the worker threads blocked in brpop
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# coding: UTF-8
+from mock import patch
+from pytest import yield_fixture # pylint: disable=E0611
+
+from seaserv import seafile_api
+
+from seafes.config import seafes_config
+from seafes.connection import es_get_conn
+from seafes.indexes import RepoFilesIndex
+from .utils import update_index_same_process, search_files
+
+
+@yield_fixture(scope='function')
+def dedup_content():
+    with patch.object(seafes_config, 'dedup_content', True):
+        yield
+
+def test_search_dedup_content(dedup_content, repo): # pylint: disable=unused-argument
+    root = repo.get_dir('/')
+    content = 'the quick brown fox jumps over the lazy dog'
+    root.mkdir('a').upload(content, 'first.txt')
+    root.mkdir('b').upload(content, 'second.md')
+    root.upload('nothing to see here', 'other.txt')
+    update_index_same_process()
+
+    repo_obj = seafile_api.get_repo(repo.id)
+    results = search_files({repo.id: repo_obj}, 'lazy dog')
+    assert sorted(results) == ['/a/first.txt', '/b/second.md']
+    # both copies share one object, highlighted from repocontents
+    assert results['/a/first.txt']['obj_id'] == results['/b/second.md']['obj_id']
+    assert '<b>lazy</b>' in results['/a/first.txt']['content_highlight']
+    assert '<b>lazy</b>' in results['/b/second.md']['content_highlight']
+
+    # the scope is applied before the best objects are picked
+    results = search_files({repo.id: repo_obj}, 'lazy dog', search_path='/b')
+    assert list(results) == ['/b/second.md']
+    results = search_files({repo.id: repo_obj}, 'lazy dog', obj_desc={'suffixes': ['md']})
+    assert list(results) == ['/b/second.md']
+    results = search_files({repo.id: repo_obj}, 'lazy dog', obj_desc={'suffixes': ['pdf']})
+    assert not results
+
+def test_clear_unused_contents(dedup_content, repo, another_repo): # pylint: disable=unused-argument
+    content = 'pack my box with five dozen liquor jugs'
+    repo.get_dir('/').upload(content, 'kept.txt')
+    repo.get_dir('/').upload('sphinx of black quartz, judge my vow', 'deleted.txt')
+    another_repo.get_dir('/').upload(content, 'copy.txt')
+    update_index_same_process()
+
+    files_index = RepoFilesIndex(es_get_conn())
+    contents_index = files_index.contents_index
+    contents_index.refresh()
+    def get_obj_id(path):
+        doc = files_index.es.get(index=files_index.INDEX_NAME, doc_type='file', id=repo.id + path)
+        return doc['_source']['obj_id']
+    kept_id = get_obj_id('/kept.txt')
+    deleted_id = get_obj_id('/deleted.txt')
+
+    # the deleted repo is removed from the objects, which are kept while in another repo
+    files_index.delete_repo(another_repo.id)
+    doc = contents_index.es.get(index=contents_index.INDEX_NAME, doc_type='content', id=kept_id)
+    assert doc['_source']['repos'] == [repo.id]
+
+    # the objects no file refers to any more are deleted once they are not seen for a while
+    files_index.delete_files(repo.id, ['/deleted.txt'])
+    assert contents_index.collect_garbage(files_index.INDEX_NAME) == 0
+    with patch.object(contents_index, 'GC_GRACE_PERIOD', -10):
+        assert contents_index.collect_garbage(files_index.INDEX_NAME) == 1
+    contents_index.refresh()
+    assert not contents_index.es.exists(index=contents_index.INDEX_NAME, doc_type='content', id=deleted_id)
+    assert contents_index.es.exists(index=contents_index.INDEX_NAME, doc_type='content', id=kept_id)
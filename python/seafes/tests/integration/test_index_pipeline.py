@@ -0,0 +1,56 @@
+# coding: UTF-8
+import time
+import threading
+
+from mock import patch
+
+from seafes.index_pipeline import IndexPipeline
+
+
+class SlowFilesIndex(object):
+    '''Records how many fetched contents are held until their bulk request
+    is written, with bulk requests much slower than fetching.
+    '''
+    contents_index = None
+    quarantine = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = 0
+        self.max_held = 0
+        self.written = 0
+
+    def prepare_indexing(self):
+        pass
+
+    def fetch(self, repo_id, version, obj_id, path):
+        with self.lock:
+            self.held += 1
+            self.max_held = max(self.max_held, self.held)
+        return b'content'
+
+    def extract_content(self, repo_id, obj_id, path, raw):
+        return raw.decode('utf-8')
+
+    def make_file_action(self, repo_id, path, content, obj_id, mtime, size):
+        return path
+
+    def bulk(self, actions):
+        time.sleep(0.05)
+        with self.lock:
+            self.held -= len(actions)
+            self.written += len(actions)
+
+
+def test_pipeline_bounds_fetched_contents():
+    files_index = SlowFilesIndex()
+    pipeline = IndexPipeline(files_index, fetch_workers=4, extract_workers=2, write_workers=2, bulk_size=10)
+    files = [('/f%d.txt' % i, '%040d' % i, 0, 10) for i in range(500)]
+    with patch('seafes.index_pipeline.ExtractorFactory.get_extractor', return_value=files_index):
+        pipeline.add_files('repo', 1, files)
+
+    assert files_index.written == 500
+    # the files between fetching and batching, one batch being filled, and
+    # the bulk requests in flight
+    bound = pipeline.max_files_in_flight + pipeline.bulk_size * (1 + pipeline.max_writes_in_flight)
+    assert files_index.max_held <= bound
@@ -0,0 +1,77 @@
+# coding: UTF-8
+import time
+import uuid
+import threading
+
+from mock import patch
+from pytest import raises
+
+from seafes.connection import es_get_conn
+from seafes.indexes import RepoStatusIndex
+
+
+def new_repo_ids(n):
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+def test_begins_are_grouped():
+    status_index = RepoStatusIndex(es_get_conn(), flush_interval=60)
+    repo_ids = new_repo_ids(20)
+    real_bulk = RepoStatusIndex.bulk
+    bulks = []
+
+    def slow_bulk(self, actions, **kw):
+        bulks.append(len(actions))
+        time.sleep(0.1)
+        return real_bulk(self, actions, **kw)
+
+    def begin(repo_id):
+        status_index.begin_update_repo(repo_id, None, 'commit-' + repo_id)
+
+    start = time.time()
+    with patch.object(RepoStatusIndex, 'bulk', slow_bulk):
+        threads = [threading.Thread(target=begin, args=(r,)) for r in repo_ids]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    # written without waiting for the timer, with fewer bulk requests
+    assert time.time() - start < 10
+    assert sum(bulks) == 20
+    assert len(bulks) < 20
+
+    reader = RepoStatusIndex(es_get_conn())
+    for repo_id in repo_ids:
+        assert reader.get_repo_status(repo_id).to_commit == 'commit-' + repo_id
+
+def test_failed_begin_and_recovery():
+    status_index = RepoStatusIndex(es_get_conn(), flush_interval=60)
+    repo_id, = new_repo_ids(1)
+
+    with patch.object(RepoStatusIndex, 'bulk', side_effect=Exception('Mocked Exception for testing')):
+        with raises(Exception):
+            status_index.begin_update_repo(repo_id, None, 'commit-1')
+
+    # the failed change is retried with the next one
+    status_index.begin_update_repo(repo_id, None, 'commit-2')
+    status_index.finish_update_repo(repo_id, 'commit-2')
+
+    # the process dies before the finish marker is written
+    status = RepoStatusIndex(es_get_conn()).get_repo_status(repo_id)
+    assert status.need_recovery()
+    assert status.to_commit == 'commit-2'
+
+    status_index.flush()
+    status = RepoStatusIndex(es_get_conn()).get_repo_status(repo_id)
+    assert not status.need_recovery()
+    assert status.from_commit == 'commit-2'
+
+def test_delete_buffered_repo():
+    status_index = RepoStatusIndex(es_get_conn(), flush_interval=60)
+    repo_id, = new_repo_ids(1)
+    status_index.begin_update_repo(repo_id, None, 'commit-1')
+    status_index.finish_update_repo(repo_id, 'commit-1')
+
+    status_index.delete_repo(repo_id)
+    status_index.flush()
+    assert repo_id not in [r['id'] for r in status_index.get_all_repos_from_index()]
@@ -11,6 +11,8 @@ from .utils import (
 
 from seaserv import seafile_api
 
+import seafes
+
 def test_search_file_names(repo):
     root = repo.get_dir('/')
     foo_txt = root.create_empty_file('foo.txt')
@@ -117,6 +119,28 @@ def test_search_start_limit(repo):
     results = search_files({repo.id: repo_obj}, 'foo', start=10, limit=1)
     assert len(results) == 1
 
+def test_search_by_cursor(repo):
+    root = repo.get_dir('/')
+    N = 25
+    for i in range(N):
+        root.create_empty_file('foo.{}'.format(i))
+
+    update_index()
+    repo_obj = seafile_api.get_repo(repo.id)
+    paths = set()
+    cursor = None
+    pages = 0
+    while True:
+        entries, total, cursor = seafes.es_search_by_cursor(
+            {repo.id: repo_obj}, None, 'foo', {}, cursor, 10)
+        assert total == N
+        paths.update(e['fullpath'] for e in entries)
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 3
+    assert len(paths) == N
+
 def test_search_with_obj_type(repo):
     root = repo.get_dir('/')
     root.create_empty_file('foobar.txt')
@@ -133,6 +157,31 @@ def test_search_with_obj_type(repo):
     results = search_files({repo.id: repo_obj}, 'foobar', obj_desc=obj_desc)
     assert len(results) == 2
 
+def test_search_with_facets(repo):
+    root = repo.get_dir('/')
+    root.create_empty_file('foobar.txt')
+    root.create_empty_file('foobar.md')
+    root.create_empty_file('foobar1.md')
+    root.mkdir('foobar')
+    update_index()
+
+    repo_obj = seafile_api.get_repo(repo.id)
+    entries, total, facets = seafes.es_search_with_facets(
+        {repo.id: repo_obj}, None, 'foobar', {}, 0, 10)
+    assert total == 4
+    assert len(entries) == 4
+    suffixes = dict((b['key'], b['count']) for b in facets['suffix'])
+    assert suffixes == {'md': 2, 'txt': 1}
+    types = dict((b['key'], b['count']) for b in facets['is_dir'])
+    assert types == {True: 1, False: 3}
+    sizes = dict((b['key'], b['count']) for b in facets['size'])
+    assert sizes['lt_1m'] == 4
+    # all created now, in the last bucket of the histogram
+    assert len(facets['mtime']) == 1
+    bucket = facets['mtime'][0]
+    assert bucket['count'] == 4
+    assert bucket['range'][0] <= time.time() <= bucket['range'][1]
+
 
 def test_search_file_content(repo):
     root = repo.get_dir('/')
@@ -175,6 +224,22 @@ def test_filename_ngram(repo):
     assert '/foobar.txt' in search_files({repo.id: repo_obj}, 'foo')
     assert '/foobar.txt' in search_files({repo.id: repo_obj}, 'bar')
 
+def test_suggest_filenames(repo):
+    root = repo.get_dir('/')
+    root.create_empty_file('annual report.pdf')
+    root.create_empty_file('Annotations.txt')
+    subdir = root.mkdir('sub')
+    subdir.create_empty_file('another.md')
+
+    update_index()
+    repo_obj = seafile_api.get_repo(repo.id)
+    names = [e['name'] for e in seafes.es_suggest_filenames({repo.id: repo_obj}, 'ann')]
+    assert sorted(names) == ['Annotations.txt', 'annual report.pdf']
+    names = [e['name'] for e in seafes.es_suggest_filenames({repo.id: repo_obj}, 'rep')]
+    assert names == ['annual report.pdf']
+    names = [e['name'] for e in seafes.es_suggest_filenames({repo.id: repo_obj}, 'an', search_path='/sub')]
+    assert names == ['another.md']
+
 def test_filename_ik_smart(use_chinese_lang, repo): # pylint: disable=unused-argument
     root = repo.get_dir('/')
     root.create_empty_file('公司交互规范.txt')
@@ -275,6 +340,28 @@ def test_search_multi_repo(repo, another_repo):
     assert '/foo.txt' in search_files({repo.id: repo_obj, another_repo.id: another_repo_obj}, 'foo', search_path='/test')
     assert '/handsome.md' in search_files({repo.id: repo_obj, another_repo.id: another_repo_obj}, 'handsome', search_path='/test')
 
+def test_search_multi_scopes(repo, another_repo):
+    root = repo.get_dir('/')
+    another_root = another_repo.get_dir('/')
+    subdir = root.mkdir('sub')
+    subdir.create_empty_file('foo.txt')
+    root.create_empty_file('foo.md')
+    another_root.create_empty_file('foo.py')
+
+    update_index()
+    repo_obj = seafile_api.get_repo(repo.id)
+    another_repo_obj = seafile_api.get_repo(another_repo.id)
+    scopes = [
+        {'repos_map': {repo.id: repo_obj}, 'search_path': '/sub'},
+        {'repos_map': {repo.id: repo_obj}},
+        {'repos_map': {repo.id: repo_obj, another_repo.id: another_repo_obj}},
+    ]
+    folder, library, everywhere = seafes.es_search_multi(scopes, 'foo')
+    assert folder['error'] is None
+    assert [e['fullpath'] for e in folder['results']] == ['/sub/foo.txt']
+    assert library['total'] == 2
+    assert everywhere['total'] == 3
+
 def test_search_outside_file(repo, another_repo):
     root = repo.get_dir('/')
     another_root = another_repo.get_dir('/')
@@ -341,3 +428,22 @@ def test_search_by_size(repo):
     }
     assert len(search_files({repo.id: repo_obj}, 'simple', obj_desc=obj_desc)) == 1
     assert '/' + txt_filename in search_files({repo.id: repo_obj}, 'simple', obj_desc=obj_desc)
+
+def test_check_results_of_changed_dir(repo):
+    root = repo.get_dir('/')
+    foo_dir = root.mkdir('foo')
+    foo_txt = foo_dir.create_empty_file('foofile.txt')
+    update_index()
+
+    repo_obj = seafile_api.get_repo(repo.id)
+    results = search_files({repo.id: repo_obj}, 'foo')
+    entries = [results['/foo/'], results['/foo/foofile.txt']]
+    assert seafes.es_check_results(entries) == [True, True]
+
+    # a change below the dir changes its obj_id, the dir is still there
+    foo_dir.create_empty_file('another.txt')
+    foo_txt.delete()
+    assert seafes.es_check_results(entries) == [True, False]
+
+    foo_dir.delete()
+    assert seafes.es_check_results(entries) == [False, False]
@@ -41,7 +41,7 @@ class App(object):
 
         self._bg_tasks = None
         if self._bg_tasks_enabled:
-            self._bg_tasks = BackgroundTasks(args.config_file)
+            self._bg_tasks = BackgroundTasks(args.config_file, self._events_handler_enabled)
 
         if appconfig.enable_statistics:
             self.update_login_record_task = CountUserActivity()
@@ -68,9 +68,10 @@ class App(object):
 
 class BackgroundTasks(object):
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, events_handler_enabled=True):
 
         self._app_config = get_config(config_file)
+        self._events_handler_enabled = events_handler_enabled
 
         self._index_updater = IndexUpdater(self._app_config)
         self._seahub_email_sender = SeahubEmailSender(self._app_config)
@@ -101,7 +102,7 @@ class BackgroundTasks(object):
             logging.info('work weixin notice sender is disabled')
 
         if self._index_updater.is_enabled():
-            self._index_updater.start()
+            self._index_updater.start(self._events_handler_enabled)
         else:
             logging.info('search indexer is disabled')
 
@@ -1,9 +1,11 @@
 # coding: UTF-8
 
 import os
+import sys
+import time
 import logging
 import configparser
-from threading import Thread, Event
+from threading import Thread, Event, Condition, Lock
 
 from seafevents.utils import get_python_executable, run
 from seafevents.utils.config import parse_bool, parse_interval, get_opt_from_conf_or_env
@@ -12,6 +14,12 @@ __all__ = [
     'IndexUpdater',
 ]
 
+# a repo changed continuously is indexed at the latest this many delays
+# after its first event.
+INCREMENTAL_MAX_DELAYS = 5
+# seconds between attempts to take the update lock of seafes
+UPDATE_LOCK_RETRY_INTERVAL = 10
+
 
 class IndexUpdater(object):
     def __init__(self, config):
@@ -23,6 +31,8 @@ class IndexUpdater(object):
         self._logfile = None
         self._es_host = None
         self._es_port = None
+        self._incremental = False
+        self._incremental_delay = None
 
         self._timer = None
 
@@ -38,8 +48,11 @@ class IndexUpdater(object):
         key_index_office_pdf = 'index_office_pdf'
         key_es_host = 'es_host'
         key_es_port = 'es_port'
+        key_incremental = 'incremental'
+        key_incremental_delay = 'incremental_delay'
 
         default_index_interval = 30 * 60 # 30 min
+        default_incremental_delay = 30 # seconds after the last commit of a repo
 
         if not config.has_section(section_name):
             return
@@ -102,10 +115,22 @@ class IndexUpdater(object):
                 es_host = host
                 es_port = port
 
+        # [ index changed repos on event ]
+        incremental = get_opt_from_conf_or_env(config, section_name, key_incremental, default=False)
+        incremental = parse_bool(incremental)
+        incremental_delay = get_opt_from_conf_or_env(config, section_name, key_incremental_delay,
+                                                     default=default_incremental_delay)
+        try:
+            incremental_delay = int(incremental_delay)
+        except ValueError:
+            logging.warning('invalid incremental_delay "%s"' % incremental_delay)
+            incremental_delay = default_incremental_delay
+
         logging.debug('seafes dir: %s', seafesdir)
         logging.debug('seafes logfile: %s', logfile)
         logging.debug('seafes index interval: %s sec', interval)
         logging.debug('seafes index office/pdf: %s', index_office_pdf)
+        logging.debug('seafes incremental: %s, delay %s sec', incremental, incremental_delay)
 
         if es_host:
             logging.debug('elasticsearch host: %s', es_host)
@@ -117,16 +142,33 @@ class IndexUpdater(object):
         self._logfile = os.path.abspath(logfile)
         self._es_host = es_host
         self._es_port = es_port
+        self._incremental = incremental
+        self._incremental_delay = incremental_delay
 
-    def start(self):
+    def start(self, events_handler_enabled=True):
         if not self.is_enabled():
             logging.warning('Can not start index updater: it is not enabled!')
             return
 
+        # the full pass and the incremental indexing don't update at the same time
+        update_lock = Lock()
+        if self._incremental and not events_handler_enabled:
+            logging.warning('incremental search indexing is enabled, but this process does not handle '
+                            'events, changed repos are only indexed by the periodic update')
+        elif self._incremental:
+            from seafevents.app.mq_handler import message_handler
+
+            indexer = IncrementalIndexer(self._incremental_delay, self._seafesdir, update_lock)
+            indexer.start()
+            # the seaf_server.event channel is subscribed by other handlers
+            # already, handlers are looked up for each message.
+            message_handler.add_handler('seaf_server.event:repo-update', indexer.handle_repo_update)
+            logging.info('incremental search indexer is started, delay = %s sec', self._incremental_delay)
+
         logging.info('search indexer is started, interval = %s sec', self._interval)
         IndexUpdateTimer(
             self._interval, self._seafesdir, self._index_office_pdf,
-            self._logfile, self._es_host, self._es_port
+            self._logfile, self._es_host, self._es_port, update_lock
         ).start()
 
     def is_enabled(self):
@@ -135,7 +177,7 @@ class IndexUpdater(object):
 
 class IndexUpdateTimer(Thread):
 
-    def __init__(self, interval, seafesdir, index_office_pdf, logfile, es_host, es_port):
+    def __init__(self, interval, seafesdir, index_office_pdf, logfile, es_host, es_port, update_lock=None):
         Thread.__init__(self)
         self._interval = interval
         self._seafesdir = seafesdir
@@ -143,6 +185,7 @@ class IndexUpdateTimer(Thread):
         self._logfile = logfile
         self._es_host = es_host
         self._es_port = es_port
+        self._update_lock = update_lock or Lock()
         self.finished = Event()
 
     def run(self):
@@ -167,9 +210,147 @@ class IndexUpdateTimer(Thread):
                         env['SEAFES_ES_HOST'] = self._es_host
                         env['SEAFES_ES_PORT'] = str(self._es_port)
 
-                    run(cmd, cwd=self._seafesdir, env=env)
+                    with self._update_lock:
+                        run(cmd, cwd=self._seafesdir, env=env)
                 except Exception as e:
                     logging.exception('error when index files: %s', e)
 
     def cancel(self):
         self.finished.set()
+
+
+class IncrementalIndexer(Thread):
+    """Index the repos changed by ``repo-update`` events in this process with
+    a resident seafes ``FileIndexUpdater``. A repo is indexed ``delay``
+    seconds after its last event, so a burst of commits is indexed once, but
+    at the latest ``INCREMENTAL_MAX_DELAYS`` delays after its first event.
+
+    The repos are indexed holding the update lock file of seafes, like
+    ``index_local update``, so they are not indexed by other updates at the
+    same time. Repos that fail to be indexed are left to the periodic full
+    pass.
+    """
+
+    def __init__(self, delay, seafesdir, update_lock):
+        Thread.__init__(self)
+        self.daemon = True
+        self._delay = delay
+        self._seafesdir = seafesdir
+        self._update_lock = update_lock
+        self._pending = {} # repo_id -> (due time, commit_id, time of the first event)
+        self._cond = Condition()
+        self._updater = None
+        self.finished = Event()
+
+    def handle_repo_update(self, session, msg): # pylint: disable=unused-argument
+        elements = msg['content'].split('\t')
+        if len(elements) != 3:
+            logging.warning("got bad message: %s", elements)
+            return
+
+        repo_id, commit_id = elements[1], elements[2]
+        now = time.time()
+        with self._cond:
+            first = self._pending[repo_id][2] if repo_id in self._pending else now
+            due = min(now + self._delay, first + INCREMENTAL_MAX_DELAYS * self._delay)
+            self._pending[repo_id] = (due, commit_id, first)
+            self._cond.notify()
+
+    def _get_due_repos(self):
+        """Wait for repos whose delay has passed, and return them as a
+        list of (repo_id, commit_id).
+        """
+        with self._cond:
+            while not self.finished.is_set():
+                now = time.time()
+                due = [(repo_id, commit_id) for repo_id, (due_time, commit_id, _) in self._pending.items()
+                       if due_time <= now]
+                if due:
+                    for repo_id, _ in due:
+                        del self._pending[repo_id]
+                    return due
+                timeout = None
+                if self._pending:
+                    timeout = min(due_time for due_time, _, _ in self._pending.values()) - now
+                self._cond.wait(timeout)
+            return []
+
+    def _import_seafes(self):
+        if self._seafesdir not in sys.path:
+            sys.path.insert(0, self._seafesdir)
+
+    def _lock_update(self):
+        """Take the update lock file of seafes, waiting for the update
+        holding it. Return False if cancelled meanwhile.
+        """
+        self._import_seafes()
+        from seafes import index_local
+        while not self.finished.is_set():
+            if index_local.do_lock(index_local.UPDATE_FILE_LOCK):
+                if not index_local.get_excluding_update_locks(index_local.UPDATE_FILE_LOCK):
+                    return True
+            index_local.do_unlock()
+            logging.debug('another search index update is running, wait')
+            self.finished.wait(UPDATE_LOCK_RETRY_INTERVAL)
+        return False
+
+    def _unlock_update(self):
+        from seafes import index_local
+        index_local.do_unlock()
+
+    def _get_updater(self):
+        if self._updater is None:
+            self._import_seafes()
+            from seafes.connection import es_get_conn
+            from seafes.file_index_updater import FileIndexUpdater
+            self._updater = FileIndexUpdater(es_get_conn())
+        return self._updater
+
+    def _index_repo(self, repo_id, commit_id):
+        from seaserv import seafile_api
+
+        repo = seafile_api.get_repo(repo_id)
+        if not repo or repo.is_virtual:
+            # deleted repos are cleared by the full pass, virtual repos are
+            # indexed as part of their origin repo
+            return
+        self._get_updater().update_repo(repo_id, commit_id)
+
+    def run(self):
+        while not self.finished.is_set():
+            repos = self._get_due_repos()
+            if not repos:
+                continue
+            with self._update_lock:
+                try:
+                    if not self._lock_update():
+                        return
+                except Exception as e:
+                    logging.exception('error when lock search index update: %s', e)
+                    continue
+                try:
+                    start = time.time()
+                    for repo_id, commit_id in repos:
+                        try:
+                            self._index_repo(repo_id, commit_id)
+                        except Exception as e:
+                            logging.exception('error when index repo %s: %s', repo_id, e)
+                    logging.info('indexed %d changed repos in %.1f sec', len(repos), time.time() - start)
+                finally:
+                    self._flush_status()
+                    self._unlock_update()
+
+    def _flush_status(self):
+        # the status of the repos is buffered, write it before other
+        # updates may run
+        if self._updater is None:
+            return
+        try:
+            self._updater.status_index.flush()
+        except Exception as e:
+            logging.warning('failed to write the status of indexed repos: %s', e)
+
+    def cancel(self):
+        with self._cond:
+            self.finished.set()
+            self._cond.notify()